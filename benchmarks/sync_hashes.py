@@ -0,0 +1,148 @@
+"""
+Benchmark the 'python' and 'sql' engines of 'sync-hashes' using a generated
+dataset.
+
+A separate database is created for the benchmark and dropped afterwards.
+Its name is derived from the configured database by appending '_benchmark'.
+
+Usage:
+
+    python benchmarks/sync_hashes.py --objects 100000
+"""
+import hashlib
+import random
+import re
+import time
+
+import click
+from sqlalchemy import create_engine
+from sqlalchemy_utils import create_database, database_exists, drop_database
+
+from passari_workflow.db import DBSession, scoped_session
+from passari_workflow.db.connection import get_connection_uri
+from passari_workflow.db.models import (Base, MuseumAttachment, MuseumObject,
+                                        object_attachment_association_table)
+from passari_workflow.scripts.sync_hashes import (update_hashes_python,
+                                                  update_hashes_sql)
+
+INSERT_CHUNK_SIZE = 10000
+
+
+def insert_chunked(engine, table, rows):
+    for i in range(0, len(rows), INSERT_CHUNK_SIZE):
+        engine.execute(table.insert(), rows[i:i+INSERT_CHUNK_SIZE])
+
+
+def generate_dataset(engine, object_count, max_attachments, seed):
+    """
+    Generate objects with a random number of attachments each
+    """
+    rand = random.Random(seed)
+
+    objects = []
+    attachments = []
+    links = []
+
+    attachment_id = 0
+    for object_id in range(1, object_count + 1):
+        objects.append({"id": object_id})
+
+        for _ in range(rand.randint(0, max_attachments)):
+            attachment_id += 1
+            attachments.append({
+                "id": attachment_id,
+                "metadata_hash": hashlib.sha256(
+                    str(rand.random()).encode("utf-8")
+                ).hexdigest()
+            })
+            links.append({
+                "museum_object_id": object_id,
+                "museum_attachment_id": attachment_id
+            })
+
+    insert_chunked(engine, MuseumObject.__table__, objects)
+    insert_chunked(engine, MuseumAttachment.__table__, attachments)
+    insert_chunked(engine, object_attachment_association_table, links)
+
+    return len(attachments)
+
+
+def reset_hashes(engine):
+    engine.execute(
+        MuseumObject.__table__.update().values(attachment_metadata_hash=None)
+    )
+
+
+def run_engine(engine, func):
+    """
+    Run the update from scratch and again with up-to-date hashes, returning
+    the elapsed time for both runs
+    """
+    reset_hashes(engine)
+
+    timings = []
+    for _ in range(2):
+        start = time.perf_counter()
+        with scoped_session() as db:
+            func(db)
+        timings.append(time.perf_counter() - start)
+
+    return timings
+
+
+def get_hashes(engine):
+    return engine.execute(
+        MuseumObject.__table__.select()
+        .with_only_columns([
+            MuseumObject.id, MuseumObject.attachment_metadata_hash
+        ])
+        .order_by(MuseumObject.id)
+    ).fetchall()
+
+
+@click.command()
+@click.option("--objects", "object_count", type=int, default=100000)
+@click.option("--max-attachments", type=int, default=6)
+@click.option("--seed", type=int, default=0)
+def cli(object_count, max_attachments, seed):
+    db_url = get_connection_uri()
+    benchmark_db_url = re.sub(
+        r"^([^?]*[^/?])(/?[?]?.*)$", r"\1_benchmark\2", db_url
+    )
+    if database_exists(benchmark_db_url):
+        drop_database(benchmark_db_url)
+    create_database(benchmark_db_url)
+
+    engine = create_engine(benchmark_db_url)
+
+    try:
+        engine.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+        engine.execute("CREATE EXTENSION IF NOT EXISTS pgcrypto")
+        Base.metadata.create_all(engine)
+        DBSession.configure(bind=engine)
+
+        attachment_count = generate_dataset(
+            engine, object_count, max_attachments, seed
+        )
+        engine.execute("ANALYZE")
+        print(f"{object_count} objects, {attachment_count} attachments")
+
+        results = {}
+        for name, func in (("python", update_hashes_python),
+                           ("sql", update_hashes_sql)):
+            first, second = run_engine(engine, func)
+            results[name] = get_hashes(engine)
+            print(
+                f"{name:>6}: {first:.2f}s initial run, "
+                f"{second:.2f}s with unchanged hashes"
+            )
+
+        if results["python"] != results["sql"]:
+            raise click.ClickException("Engines produced different hashes")
+    finally:
+        engine.dispose()
+        drop_database(benchmark_db_url)
+
+
+if __name__ == "__main__":
+    cli()
@@ -5,10 +5,12 @@
 # production the workers should be started with a process manager like
 # systemd.
 
+# Jobs postponed by disk admission or lock deferral are retried by the RQ
+# scheduler, which only handles the queues of the worker running it
 rq worker enqueue_objects &
-rq worker download_object &
-rq worker create_sip &
-rq worker submit_sip &
+rq worker --with-scheduler download_object_high download_object download_object_low &
+rq worker --with-scheduler create_sip &
+rq worker --with-scheduler submit_sip &
 rq worker confirm_sip &
 
 # Wait a bit for workers to start and stop outputting to console
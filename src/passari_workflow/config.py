@@ -53,6 +53,12 @@ host='127.0.0.1'
 port='5432'
 name='passari'
 
+# Connection pool settings. Each worker process uses its own pool.
+pool_size=5
+max_overflow=10
+# Test connections before using them to detect ones closed by the server
+pool_pre_ping=true
+
 [redis]
 # Redis server credentials
 host='127.0.0.1'
@@ -82,6 +88,50 @@ preservation_delay=2592000
 # Delay before a preserved package will be updated if changed.
 # Default is 30 days (2592000 seconds)
 update_delay=2592000
+
+[scheduling]
+# Priority of the download jobs for different kinds of objects.
+# Allowed values are 'high', 'normal' and 'low', corresponding to the queues
+# 'download_object_high', 'download_object' and 'download_object_low'.
+# If you use other priorities than 'normal', make sure the download workers
+# listen to all three queues.
+
+# Objects that haven't been preserved yet
+new_priority='normal'
+# Objects that have been preserved before and have changed since
+updated_priority='normal'
+# Objects enqueued explicitly by the user, eg. using
+# 'enqueue-objects --object-ids', 'reenqueue-object' or
+# 'unfreeze-objects --enqueue'
+user_priority='normal'
+# Objects with more attachments than this always get the 'low' priority
+# unless they were enqueued by the user, preventing a few large objects from
+# blocking the smaller ones. 0 disables the limit.
+large_object_attachment_count=0
+
+# Reserve space in the package directory for each object before downloading
+# it, and postpone the download if there isn't enough free space.
+# This requires the download workers to be started with the
+# '--with-scheduler' flag.
+disk_admission=false
+# Space to always leave free in the package directory, in bytes.
+# Default is 1 GiB.
+min_free_space=1073741824
+# Estimated size of an attachment for objects that haven't been downloaded
+# before, in bytes. Default is 100 MiB.
+attachment_size_estimate=104857600
+
+# Postpone jobs whose object is being processed by another job instead of
+# waiting for the other job to finish, allowing the worker to process other
+# objects in the meantime. This requires the workers to be started with the
+# '--with-scheduler' flag.
+lock_deferral=false
+
+# Delay in seconds before a postponed job is attempted again. The delay
+# is doubled each time the same job is postponed, up to
+# 'max_deferral_delay'.
+deferral_delay=60
+max_deferral_delay=3600
 """[1:]
 
 USER_CONFIG_DIR = click.get_app_dir("passari-workflow")
@@ -98,3 +148,31 @@ PRESERVATION_DELAY = datetime.timedelta(
 UPDATE_DELAY = datetime.timedelta(
     seconds=int(CONFIG["package"].get("update_delay", 2592000))
 )
+
+NEW_OBJECT_PRIORITY = CONFIG.get("scheduling", {}).get(
+    "new_priority", "normal"
+)
+UPDATED_OBJECT_PRIORITY = CONFIG.get("scheduling", {}).get(
+    "updated_priority", "normal"
+)
+USER_PRIORITY = CONFIG.get("scheduling", {}).get("user_priority", "normal")
+LARGE_OBJECT_ATTACHMENT_COUNT = int(
+    CONFIG.get("scheduling", {}).get("large_object_attachment_count", 0)
+)
+
+DISK_ADMISSION = bool(
+    CONFIG.get("scheduling", {}).get("disk_admission", False)
+)
+MIN_FREE_SPACE = int(
+    CONFIG.get("scheduling", {}).get("min_free_space", 1073741824)
+)
+ATTACHMENT_SIZE_ESTIMATE = int(
+    CONFIG.get("scheduling", {}).get("attachment_size_estimate", 104857600)
+)
+LOCK_DEFERRAL = bool(
+    CONFIG.get("scheduling", {}).get("lock_deferral", False)
+)
+DEFERRAL_DELAY = int(CONFIG.get("scheduling", {}).get("deferral_delay", 60))
+MAX_DEFERRAL_DELAY = int(
+    CONFIG.get("scheduling", {}).get("max_deferral_delay", 3600)
+)
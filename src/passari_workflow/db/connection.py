@@ -1,4 +1,5 @@
 import os
+import threading
 
 from passari_workflow.db import DBSession
 
@@ -40,12 +41,46 @@ def get_connection_uri(*, default="error"):
     return f"postgresql:///{name}"
 
 
+# Engines keyed by (process ID, connection URI, engine options)
+_ENGINES = {}
+_ENGINES_LOCK = threading.Lock()
+
+
+def get_engine_options():
+    """
+    Get the connection pool options for the engine from the configuration
+    """
+    db_config = CONFIG["db"]
+
+    return {
+        "pool_size": int(db_config.get("pool_size", 5)),
+        "max_overflow": int(db_config.get("max_overflow", 10)),
+        "pool_pre_ping": bool(db_config.get("pool_pre_ping", True))
+    }
+
+
 def connect_db():
     """
     Connect to the database, ensuring that functions that return database
     connections work.
+
+    The engine and its connection pool are created once per process and
+    reused on subsequent calls. RQ's default worker runs each job in a
+    new forked process, so the connections are only reused across jobs
+    when the worker runs the jobs in its own process, eg. 'SimpleWorker'.
     """
-    engine = create_engine(get_connection_uri())
+    options = get_engine_options()
+    key = (os.getpid(), get_connection_uri(), tuple(sorted(options.items())))
+
+    with _ENGINES_LOCK:
+        engine = _ENGINES.get(key)
+        if engine is None:
+            # Engines inherited from a parent process are kept as-is: closing
+            # or garbage collecting their connections would also close them
+            # for the parent process that is still using them
+            engine = create_engine(key[1], **options)
+            _ENGINES[key] = engine
+
     DBSession.configure(bind=engine)
 
     return engine
@@ -0,0 +1,24 @@
+"""add index for outstanding MuseumPackages
+
+Revision ID: 3f9a2c7d1e64
+Revises: d8e1f3a6b095
+Create Date: 2026-10-18 19:41:52.207315
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '3f9a2c7d1e64'
+down_revision = 'd8e1f3a6b095'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_index('ix_museum_packages_outstanding', 'museum_packages', ['sip_filename'], unique=False, postgresql_where=sa.text('uploaded AND NOT preserved AND NOT rejected AND NOT cancelled'))
+
+
+def downgrade():
+    op.drop_index('ix_museum_packages_outstanding', table_name='museum_packages')
@@ -0,0 +1,24 @@
+"""add MuseumObject.lock_token
+
+Revision ID: 7a3d5c9e1b42
+Revises: e2b6f4a1c8d3
+Create Date: 2026-10-18 17:21:44.302518
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '7a3d5c9e1b42'
+down_revision = 'e2b6f4a1c8d3'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column('museum_objects', sa.Column('lock_token', sa.BigInteger(), nullable=True))
+
+
+def downgrade():
+    op.drop_column('museum_objects', 'lock_token')
@@ -0,0 +1,25 @@
+"""add pgcrypto extension
+
+Revision ID: 8d3c0f5e2b71
+Revises: 156f33fadc35
+Create Date: 2026-10-18 10:12:41.204518
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '8d3c0f5e2b71'
+down_revision = '156f33fadc35'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Required by 'sync-hashes --engine sql'
+    op.execute("CREATE EXTENSION IF NOT EXISTS pgcrypto")
+
+
+def downgrade():
+    pass
@@ -0,0 +1,79 @@
+"""add MuseumObject preservation and update delay starts
+
+Revision ID: c41a7d9e3f20
+Revises: 8d3c0f5e2b71
+Create Date: 2026-10-18 14:37:05.118342
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c41a7d9e3f20'
+down_revision = '8d3c0f5e2b71'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column('museum_objects', sa.Column('preservation_delay_start', sa.DateTime(timezone=True), nullable=True))
+    op.add_column('museum_objects', sa.Column('update_delay_start', sa.DateTime(timezone=True), nullable=True))
+
+    # Populate the fields for existing objects. This is the same as
+    # 'refresh_preservation_pending' at the time of writing.
+    op.execute("""
+        UPDATE museum_objects
+        SET
+            preservation_delay_start = new_values.preservation_delay_start,
+            update_delay_start = new_values.update_delay_start
+        FROM (
+            SELECT
+                obj.id,
+                CASE
+                    WHEN obj.frozen = false
+                        AND obj.metadata_hash IS NOT NULL
+                        AND obj.attachment_metadata_hash IS NOT NULL
+                        AND obj.latest_package_id IS NULL
+                    THEN coalesce(
+                        obj.created_date, '1970-01-01 00:00:00+00'
+                    )
+                END AS preservation_delay_start,
+                CASE
+                    WHEN obj.frozen = false
+                        AND obj.metadata_hash IS NOT NULL
+                        AND obj.attachment_metadata_hash IS NOT NULL
+                        AND obj.latest_package_id IS NOT NULL
+                        AND pkg.cancelled = true
+                    THEN timestamptz '1970-01-01 00:00:00+00'
+                    WHEN obj.frozen = false
+                        AND obj.metadata_hash IS NOT NULL
+                        AND obj.attachment_metadata_hash IS NOT NULL
+                        AND obj.latest_package_id IS NOT NULL
+                        AND pkg.object_modified_date
+                            IS DISTINCT FROM obj.modified_date
+                        AND (
+                            obj.metadata_hash != pkg.metadata_hash
+                            OR obj.attachment_metadata_hash
+                                != pkg.attachment_metadata_hash
+                        )
+                    THEN coalesce(
+                        pkg.object_modified_date, '1970-01-01 00:00:00+00'
+                    )
+                END AS update_delay_start
+            FROM museum_objects AS obj
+            LEFT OUTER JOIN museum_packages AS pkg
+                ON pkg.id = obj.latest_package_id
+        ) AS new_values
+        WHERE museum_objects.id = new_values.id
+    """)
+
+    op.create_index(op.f('ix_museum_objects_preservation_delay_start'), 'museum_objects', ['preservation_delay_start'], unique=False)
+    op.create_index(op.f('ix_museum_objects_update_delay_start'), 'museum_objects', ['update_delay_start'], unique=False)
+
+
+def downgrade():
+    op.drop_index(op.f('ix_museum_objects_update_delay_start'), table_name='museum_objects')
+    op.drop_index(op.f('ix_museum_objects_preservation_delay_start'), table_name='museum_objects')
+    op.drop_column('museum_objects', 'update_delay_start')
+    op.drop_column('museum_objects', 'preservation_delay_start')
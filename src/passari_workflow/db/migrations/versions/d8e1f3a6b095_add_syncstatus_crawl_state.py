@@ -0,0 +1,25 @@
+"""add SyncStatus.crawl_state
+
+Revision ID: d8e1f3a6b095
+Revises: 7a3d5c9e1b42
+Create Date: 2026-10-18 19:02:13.518204
+
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+# revision identifiers, used by Alembic.
+revision = 'd8e1f3a6b095'
+down_revision = '7a3d5c9e1b42'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column('sync_statuses', sa.Column('crawl_state', postgresql.JSONB(astext_type=sa.Text()), nullable=True))
+
+
+def downgrade():
+    op.drop_column('sync_statuses', 'crawl_state')
@@ -0,0 +1,24 @@
+"""add MuseumPackage.downloaded_size
+
+Revision ID: e2b6f4a1c8d3
+Revises: c41a7d9e3f20
+Create Date: 2026-10-18 16:02:51.630724
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e2b6f4a1c8d3'
+down_revision = 'c41a7d9e3f20'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column('museum_packages', sa.Column('downloaded_size', sa.BigInteger(), nullable=True))
+
+
+def downgrade():
+    op.drop_column('museum_packages', 'downloaded_size')
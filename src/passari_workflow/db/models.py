@@ -6,10 +6,12 @@ from typing import List
 
 from sqlalchemy import (BigInteger, Boolean, Column, DateTime, Enum,
                         ForeignKey, Index, MetaData, String, Table, Text,
-                        UniqueConstraint, and_, exists, func, not_, or_)
+                        UniqueConstraint, and_, any_, event, exists, func,
+                        literal, not_, or_, select, text)
 from sqlalchemy.dialects import postgresql
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import relationship
+from sqlalchemy.orm import Session, relationship
+from sqlalchemy.sql.expression import case
 from sqlalchemy.sql.functions import coalesce
 
 from passari.dpres.package import get_archive_path_parts
@@ -112,6 +114,15 @@ class MuseumPackage(Base):
             postgresql_ops={"sip_filename": "gin_trgm_ops"},
             postgresql_using="gin"
         ),
+        # Packages awaiting processing in the preservation service, which
+        # are retrieved by 'sync_processed_sips'
+        Index(
+            "ix_museum_packages_outstanding", "sip_filename",
+            postgresql_where=text(
+                "uploaded AND NOT preserved AND NOT rejected "
+                "AND NOT cancelled"
+            )
+        ),
     )
 
     id = Column(BigInteger, primary_key=True)
@@ -141,6 +152,10 @@ class MuseumPackage(Base):
     packaged = Column(Boolean, default=False)
     uploaded = Column(Boolean, default=False)
 
+    # Size of the downloaded object files in bytes. Used to estimate the
+    # disk space required when the object is downloaded again.
+    downloaded_size = Column(BigInteger)
+
     # Whether the SIP was rejected by the digital preservation service
     rejected = Column(Boolean, default=False)
     preserved = Column(Boolean, default=False)
@@ -294,6 +309,20 @@ class MuseumObject(Base):
     # or an empty string if this object has no attachments.
     attachment_metadata_hash = Column(String(64))
 
+    # Materialized 'preservation pending' state maintained by
+    # 'refresh_preservation_pending'. The object is pending preservation
+    # once the preservation delay has passed since
+    # 'preservation_delay_start' or the update delay has passed since
+    # 'update_delay_start'. Each field is None if the corresponding
+    # condition doesn't apply to the object.
+    preservation_delay_start = Column(DateTime(timezone=True), index=True)
+    update_delay_start = Column(DateTime(timezone=True), index=True)
+
+    # Fencing token of the latest job that has updated the object while
+    # holding the object lock. Updates from jobs with an older token are
+    # rejected, as their lock has expired in the meantime.
+    lock_token = Column(BigInteger)
+
     packages = relationship(
         "MuseumPackage", back_populates="museum_object",
         order_by="MuseumPackage.created_date",
@@ -372,69 +401,179 @@ class MuseumObject(Base):
         )
 
 
-def filter_preservation_pending(q):
-    """
-    Transform query to only include MuseumObject entries which are
-    pending preservation
+# Delay start used for objects that don't have a date to compare against and
+# are thus eligible for preservation immediately
+NO_DELAY_START = datetime.datetime(1970, 1, 1, tzinfo=datetime.timezone.utc)
+
+
+def refresh_preservation_pending(session, object_ids=None, package_ids=None):
     """
-    now = datetime.datetime.now(datetime.timezone.utc)
-    preservation_boundary = now - PRESERVATION_DELAY
-    update_boundary = now - UPDATE_DELAY
+    Recompute the materialized 'preservation pending' fields
+    ('preservation_delay_start' and 'update_delay_start') for the given
+    objects.
 
-    return (
-        q.outerjoin(
-            MuseumPackage,
-            MuseumPackage.id == MuseumObject.latest_package_id
-        )
-        .filter(MuseumObject.frozen == False)
-        .filter(
-            and_(
-                # Metadata hashes can't be incomplete before we start
-                # preservation
-                MuseumObject.attachment_metadata_hash != None,
-                MuseumObject.metadata_hash != None
-            )
-        )
-        .filter(
-            or_(
-                # Object has never been preserved and has passed the
-                # preservation delay (by default one month)...
+    Changes made through the ORM are handled automatically after each flush.
+    This needs to be called explicitly after bulk updates that change the
+    hashes, dates, freeze state or latest package of objects.
+
+    :param session: SQLAlchemy session
+    :param object_ids: Object IDs to refresh. If neither this nor
+                       'package_ids' is provided, all objects are refreshed.
+    :param package_ids: Refresh objects that have one of these packages
+                        as the latest package
+
+    :returns: Number of objects whose fields were changed
+    """
+    object_table = MuseumObject.__table__
+    package_table = MuseumPackage.__table__
+    obj = object_table.alias("obj")
+
+    # The conditions are the same as in 'MuseumObject.preservation_pending'
+    eligible = and_(
+        obj.c.frozen == False,
+        obj.c.metadata_hash != None,
+        obj.c.attachment_metadata_hash != None
+    )
+    preservation_delay_start = case(
+        [(
+            # Object has never been preserved
+            and_(eligible, obj.c.latest_package_id == None),
+            coalesce(obj.c.created_date, NO_DELAY_START)
+        )],
+        else_=None
+    )
+    update_delay_start = case(
+        [
+            (
+                # Last package was cancelled, meaning that the preservation
+                # can be restarted immediately
                 and_(
-                    MuseumObject.latest_package_id == None,
-                    or_(
-                        MuseumObject.created_date == None,
-                        MuseumObject.created_date < preservation_boundary
-                    )
+                    eligible,
+                    obj.c.latest_package_id != None,
+                    package_table.c.cancelled == True
                 ),
-                # ...OR the object has been preserved at least once,
-                # but the preservation delay (by default one month) has
-                # already passed since last preservation and the object has
-                # changed (object or attachment metadata hash changed since
-                # last preservation)
+                literal(NO_DELAY_START, DateTime(timezone=True))
+            ),
+            (
+                # Object has been preserved, but its modification date
+                # and one of its metadata hashes have changed since
                 and_(
-                    MuseumObject.latest_package_id != None,
-                    # Compare modification dates and check for equality,
-                    # including NULL != NULL which evaluates to False here
-                    coalesce(MuseumPackage.object_modified_date, datetime.datetime.min)
-                    != coalesce(MuseumObject.modified_date, datetime.datetime.min),
-                    or_(
-                        MuseumPackage.object_modified_date == None,
-                        MuseumPackage.object_modified_date < update_boundary
+                    eligible,
+                    obj.c.latest_package_id != None,
+                    package_table.c.object_modified_date.is_distinct_from(
+                        obj.c.modified_date
                     ),
                     or_(
-                        MuseumObject.metadata_hash
-                        != MuseumPackage.metadata_hash,
-                        MuseumObject.attachment_metadata_hash
-                        != MuseumPackage.attachment_metadata_hash
+                        obj.c.metadata_hash
+                        != package_table.c.metadata_hash,
+                        obj.c.attachment_metadata_hash
+                        != package_table.c.attachment_metadata_hash
                     )
                 ),
-                # ...OR the last package was cancelled, meaning that the
-                # preservation can be restarted immediately if it's not frozen
-                and_(
-                    MuseumObject.latest_package_id != None,
-                    MuseumPackage.cancelled == True
+                coalesce(
+                    package_table.c.object_modified_date, NO_DELAY_START
                 )
             )
+        ],
+        else_=None
+    )
+
+    new_values = (
+        select([
+            obj.c.id,
+            preservation_delay_start.label("preservation_delay_start"),
+            update_delay_start.label("update_delay_start")
+        ])
+        .select_from(
+            obj.outerjoin(
+                package_table, package_table.c.id == obj.c.latest_package_id
+            )
+        )
+    )
+
+    if object_ids is not None or package_ids is not None:
+        conditions = []
+        if object_ids:
+            conditions.append(
+                obj.c.id == any_(
+                    literal(list(object_ids), postgresql.ARRAY(BigInteger))
+                )
+            )
+        if package_ids:
+            conditions.append(
+                obj.c.latest_package_id == any_(
+                    literal(list(package_ids), postgresql.ARRAY(BigInteger))
+                )
+            )
+
+        if not conditions:
+            return 0
+
+        new_values = new_values.where(or_(*conditions))
+
+    new_values = new_values.alias("new_values")
+
+    update_stmt = (
+        object_table.update()
+        .values(
+            preservation_delay_start=new_values.c.preservation_delay_start,
+            update_delay_start=new_values.c.update_delay_start
+        )
+        .where(object_table.c.id == new_values.c.id)
+        .where(
+            or_(
+                object_table.c.preservation_delay_start.is_distinct_from(
+                    new_values.c.preservation_delay_start
+                ),
+                object_table.c.update_delay_start.is_distinct_from(
+                    new_values.c.update_delay_start
+                )
+            )
+        )
+    )
+
+    return session.execute(update_stmt).rowcount
+
+
+@event.listens_for(Session, "after_flush")
+def _refresh_flushed_preservation_pending(session, flush_context):
+    """
+    Refresh the 'preservation pending' fields for objects and packages
+    that were added or changed in the flush
+    """
+    object_ids = set()
+    package_ids = set()
+
+    for instance in list(session.new) + list(session.dirty):
+        if isinstance(instance, MuseumObject):
+            object_ids.add(instance.id)
+        elif isinstance(instance, MuseumPackage):
+            package_ids.add(instance.id)
+
+    if object_ids or package_ids:
+        refresh_preservation_pending(
+            session, object_ids=object_ids, package_ids=package_ids
+        )
+
+
+def filter_preservation_pending(q):
+    """
+    Transform query to only include MuseumObject entries which are
+    pending preservation
+    """
+    now = datetime.datetime.now(datetime.timezone.utc)
+    preservation_boundary = now - PRESERVATION_DELAY
+    update_boundary = now - UPDATE_DELAY
+
+    return q.filter(
+        or_(
+            # Object has never been preserved and has passed the
+            # preservation delay (by default one month)...
+            MuseumObject.preservation_delay_start < preservation_boundary,
+            # ...OR the object has changed since the last preservation
+            # and the update delay (by default one month) has passed, or
+            # the last package was cancelled
+            MuseumObject.update_delay_start < update_boundary
         )
     )
 
@@ -448,58 +587,15 @@ def exclude_preservation_pending(q):
     preservation_boundary = now - PRESERVATION_DELAY
     update_boundary = now - UPDATE_DELAY
 
-    return (
-        q.outerjoin(
-            MuseumPackage,
-            MuseumPackage.id == MuseumObject.latest_package_id
-        )
-        .filter(
-            # If any of the four conditions is true, the object will not
-            # be preserved and are thus included in this query:
+    return q.filter(
+        and_(
             or_(
-                # 1. Is metadata information still incomplete?
-                MuseumObject.metadata_hash == None,
-                MuseumObject.attachment_metadata_hash == None,
-                # 2. Is the object frozen?
-                MuseumObject.frozen,
-                # 3. The object hasn't been preserved, but it has been less
-                #    than a month passed since the creation of the object?
-                and_(
-                    MuseumObject.latest_package_id == None,
-                    coalesce(
-                        MuseumObject.created_date, datetime.datetime.min
-                    ) > preservation_boundary
-                ),
-                # 4. Has the object entered preservation before, but...
-                and_(
-                    MuseumObject.latest_package_id != None,
-                    # ...the package wasn't cancelled, and either...
-                    MuseumPackage.cancelled == False,
-                    or_(
-                        # ...modification date hasn't changed?
-                        coalesce(
-                            MuseumPackage.object_modified_date,
-                            datetime.datetime.min
-                        ) == coalesce(
-                            MuseumObject.modified_date,
-                            datetime.datetime.min
-                        ),
-                        # ...modification date has changed, but it's been
-                        # less than a month?
-                        coalesce(
-                            MuseumPackage.object_modified_date,
-                            datetime.datetime.min
-                        ) > update_boundary,
-                        # ...metadata hashes haven't changed, indicating no
-                        # change has happened?
-                        and_(
-                            MuseumPackage.metadata_hash
-                            == MuseumObject.metadata_hash,
-                            MuseumPackage.attachment_metadata_hash
-                            == MuseumObject.attachment_metadata_hash
-                        )
-                    )
-                )
+                MuseumObject.preservation_delay_start == None,
+                MuseumObject.preservation_delay_start >= preservation_boundary
+            ),
+            or_(
+                MuseumObject.update_delay_start == None,
+                MuseumObject.update_delay_start >= update_boundary
             )
         )
     )
@@ -535,3 +631,7 @@ class SyncStatus(Base):
     # If last synchronization run was incomplete, synchronization will
     # continue from this offset. Otherwise, start from scratch (aka 0).
     offset = Column(BigInteger, default=0, server_default="0")
+
+    # Script-specific state persisted between synchronization runs, eg. the
+    # fingerprints of the directories crawled by 'sync_processed_sips'
+    crawl_state = Column(postgresql.JSONB, nullable=True, default=None)
@@ -1,3 +1,8 @@
+from sqlalchemy import literal_column, or_, select, tuple_
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.sql.expression import case
+
+
 def bulk_create_or_get(session, mapper, ids):
     """
     For given model, return a list of entries with given primary keys.
@@ -22,3 +27,128 @@ def bulk_create_or_get(session, mapper, ids):
         )
 
     return entries
+
+
+def bulk_create_missing(session, mapper, ids):
+    """
+    For given model, create empty entries with given primary keys if they
+    don't exist already.
+
+    Unlike 'bulk_create_or_get', the entries are not loaded.
+    """
+    if not ids:
+        return
+
+    session.execute(
+        insert(mapper.__table__)
+        .values([{"id": id_} for id_ in ids])
+        .on_conflict_do_nothing(index_elements=["id"])
+    )
+
+
+def bulk_upsert(session, mapper, entries, update_fields,
+                increasing_fields=()):
+    """
+    Create entries for given model or update the existing entries with the
+    same primary keys using a single INSERT ... ON CONFLICT statement.
+
+    :param session: SQLAlchemy session
+    :param mapper: Model to create or update
+    :param list entries: List of dicts with the column values for each entry.
+                         Each dict must contain the same keys, and each
+                         primary key can only appear once.
+    :param list update_fields: Fields that are overwritten for existing
+                               entries
+    :param list increasing_fields: Fields that are updated for existing
+                                   entries only if the current value is
+                                   missing or older than the new value
+
+    :returns: (inserts, updates) tuple
+    """
+    if not entries:
+        return 0, 0
+
+    table = mapper.__table__
+    stmt = insert(table).values(entries)
+
+    set_ = {field: stmt.excluded[field] for field in update_fields}
+    for field in increasing_fields:
+        set_[field] = case(
+            [(
+                or_(
+                    table.c[field] == None,
+                    table.c[field] < stmt.excluded[field]
+                ),
+                stmt.excluded[field]
+            )],
+            else_=table.c[field]
+        )
+
+    stmt = (
+        stmt.on_conflict_do_update(index_elements=[table.c.id], set_=set_)
+        # 'xmax' system column is zero for newly inserted rows, which
+        # allows us to tell inserts and updates apart
+        .returning(literal_column("xmax = 0"))
+    )
+    results = [inserted for inserted, in session.execute(stmt)]
+    inserts = sum(1 for inserted in results if inserted)
+
+    return inserts, len(results) - inserts
+
+
+def sync_association(session, column, other_column, links):
+    """
+    Update the rows in an association table so that each ID in 'links' is
+    associated with exactly the given IDs and nothing else.
+
+    The current associations are retrieved in one query, and only the
+    associations that were added or removed are written using one INSERT
+    and one DELETE statement.
+
+    :param session: SQLAlchemy session
+    :param column: Association table column for the IDs used as keys in
+                   'links', eg. 'museum_object_id'
+    :param other_column: Association table column for the associated IDs,
+                         eg. 'museum_attachment_id'
+    :param dict links: {id: associated_ids} dict. IDs that are not included
+                       are left untouched.
+
+    :returns: (added, removed) tuple of sets containing the
+              (id, other_id) pairs that were added and removed
+    """
+    if not links:
+        return set(), set()
+
+    table = column.table
+
+    current = {
+        (id_, other_id) for id_, other_id in session.execute(
+            select([column, other_column])
+            .where(column.in_(list(links.keys())))
+        )
+    }
+    wanted = {
+        (id_, other_id)
+        for id_, other_ids in links.items()
+        for other_id in other_ids
+    }
+
+    added = wanted - current
+    removed = current - wanted
+
+    if removed:
+        session.execute(
+            table.delete().where(
+                tuple_(column, other_column).in_(sorted(removed))
+            )
+        )
+
+    if added:
+        session.execute(
+            table.insert().values([
+                {column.name: id_, other_column.name: other_id}
+                for id_, other_id in sorted(added)
+            ])
+        )
+
+    return added, removed
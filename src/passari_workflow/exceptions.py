@@ -2,3 +2,16 @@ class WorkflowJobRunningError(ValueError):
     """
     Operation was prevented by a job running in the job queue
     """
+
+
+class JobDeferredError(Exception):
+    """
+    Job couldn't be started yet and will be retried later
+    """
+
+
+class LockLostError(Exception):
+    """
+    Lock expired while it was held and may have been acquired by another
+    process
+    """
@@ -14,6 +14,7 @@ class HeartbeatSource(enum.Enum):
     SYNC_ATTACHMENTS = "sync_attachments"
     SYNC_OBJECTS = "sync_objects"
     SYNC_HASHES = "sync_hashes"
+    RECONCILE_STATS = "reconcile_stats"
 
 
 def submit_heartbeat(source):
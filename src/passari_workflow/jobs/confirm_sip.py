@@ -6,6 +6,8 @@ from passari_workflow.config import ARCHIVE_DIR, PACKAGE_DIR
 from passari_workflow.db import scoped_session
 from passari_workflow.db.connection import connect_db
 from passari_workflow.db.models import MuseumObject, MuseumPackage
+from passari_workflow.queue.scheduling import release_disk_space
+from passari_workflow.stats import ObjectStat, update_stats
 
 
 def confirm_sip(object_id, sip_id):
@@ -38,6 +40,8 @@ def confirm_sip(object_id, sip_id):
         status=status
     )
 
+    preserved_count = 0
+
     with scoped_session() as db:
         db.query(MuseumPackage).filter_by(
             sip_filename=museum_package.sip_filename
@@ -47,8 +51,15 @@ def confirm_sip(object_id, sip_id):
         })
 
         if status == "accepted":
-            db.query(MuseumObject).filter_by(id=object_id).update({
+            preserved_count = db.query(MuseumObject).filter_by(
+                id=object_id, preserved=False
+            ).update({
                 MuseumObject.preserved: True
             })
 
+    update_stats({ObjectStat.PRESERVED: preserved_count})
+
+    # The package directory was removed by 'main'
+    release_disk_space(object_id)
+
     print(f"SIP {museum_package.sip_filename} confirmed")
@@ -5,15 +5,16 @@ from passari.scripts.create_sip import main
 from passari_workflow.config import PACKAGE_DIR
 from passari_workflow.db import scoped_session
 from passari_workflow.db.connection import connect_db
-from passari_workflow.db.models import MuseumObject, MuseumPackage
+from passari_workflow.db.models import (MuseumObject, MuseumPackage,
+                                        refresh_preservation_pending)
 from passari_workflow.jobs.submit_sip import submit_sip
-from passari_workflow.jobs.utils import (freeze_running_object,
+from passari_workflow.jobs.utils import (fence_object, freeze_running_object,
                                          job_locked_by_object_id)
 from passari_workflow.queue.queues import QueueType, get_queue
 
 
 @job_locked_by_object_id
-def create_sip(object_id, sip_id):
+def create_sip(object_id, sip_id, lock_token=None):
     """
     Create SIP from a downloaded objec and enqueue the task 'submit_sip'
     once the object is packaged into a SIP
@@ -66,7 +67,8 @@ def create_sip(object_id, sip_id):
         freeze_running_object(
             object_id=object_id,
             sip_id=sip_id,
-            freeze_reason=exc.error
+            freeze_reason=exc.error,
+            lock_token=lock_token
         )
         return
     except OSError as exc:
@@ -87,6 +89,8 @@ def create_sip(object_id, sip_id):
     print(f"Created SIP for Object {object_id}, updating database")
 
     with scoped_session() as db:
+        fence_object(db, object_id, lock_token)
+
         db_package = db.query(MuseumPackage).filter(
             MuseumPackage.sip_filename == filename
         ).one()
@@ -94,6 +98,7 @@ def create_sip(object_id, sip_id):
         db.query(MuseumObject).filter(
             MuseumObject.id == object_id
         ).update({MuseumObject.latest_package_id: db_package.id})
+        refresh_preservation_pending(db, object_ids=[object_id])
 
         queue = get_queue(QueueType.SUBMIT_SIP)
         queue.enqueue(
@@ -1,22 +1,29 @@
 import datetime
 import errno
+from pathlib import Path
 
 from passari.exceptions import PreservationError
 from passari.scripts.download_object import main
-from passari_workflow.config import PACKAGE_DIR
+from passari_workflow.config import DISK_ADMISSION, PACKAGE_DIR
 from passari_workflow.db import scoped_session
 from passari_workflow.db.connection import connect_db
 from passari_workflow.db.models import (MuseumAttachment, MuseumObject,
-                                        MuseumPackage)
-from passari_workflow.db.utils import bulk_create_or_get
+                                        MuseumPackage,
+                                        package_attachment_association_table)
+from passari_workflow.db.utils import bulk_create_missing, sync_association
 from passari_workflow.jobs.create_sip import create_sip
-from passari_workflow.jobs.utils import (freeze_running_object,
+from passari_workflow.jobs.utils import (fence_object, freeze_running_object,
                                          job_locked_by_object_id)
 from passari_workflow.queue.queues import QueueType, get_queue
+from passari_workflow.queue.scheduling import (PACKAGE_SIZE_FACTOR,
+                                               admit_object_download,
+                                               get_directory_size,
+                                               update_disk_reservation)
+from passari_workflow.stats import ObjectStat, update_stats
 
 
 @job_locked_by_object_id
-def download_object(object_id):
+def download_object(object_id, lock_token=None):
     """
     Download an object from MuseumPlus and enqueue the task 'create_sip'
     once the object is downloaded
@@ -24,6 +31,11 @@ def download_object(object_id):
     object_id = int(object_id)
     connect_db()
 
+    if DISK_ADMISSION:
+        # Postpone the download if the package directory doesn't have
+        # enough room for the object
+        admit_object_download(object_id)
+
     # Create a SIP id from the current time
     sip_id = datetime.datetime.now(
         datetime.timezone.utc
@@ -41,7 +53,8 @@ def download_object(object_id):
         freeze_running_object(
             object_id=object_id,
             sip_id=sip_id,
-            freeze_reason=exc.error
+            freeze_reason=exc.error,
+            lock_token=lock_token
         )
         return
     except OSError as exc:
@@ -58,8 +71,11 @@ def download_object(object_id):
         raise
 
     filename = museum_package.sip_filename
+    downloaded_size = get_directory_size(Path(PACKAGE_DIR) / str(object_id))
 
     with scoped_session() as db:
+        fence_object(db, object_id, lock_token)
+
         db_museum_object = db.query(MuseumObject).filter(
             MuseumObject.id == object_id
         ).one()
@@ -68,13 +84,6 @@ def download_object(object_id):
             sip_filename=filename
         ).first()
 
-        # Get the attachments that currently exist for this object
-        # and add them to the new MuseumPackage
-        attachment_ids = museum_package.museum_object.attachment_ids
-        db_attachments = bulk_create_or_get(
-            db, MuseumAttachment, attachment_ids
-        )
-
         if not db_package:
             db_package = MuseumPackage(
                 sip_filename=filename,
@@ -83,11 +92,11 @@ def download_object(object_id):
                     museum_package.museum_object.modified_date
                 ),
                 downloaded=True,
+                downloaded_size=downloaded_size,
                 metadata_hash=db_museum_object.metadata_hash,
                 attachment_metadata_hash=(
                     db_museum_object.attachment_metadata_hash
-                ),
-                attachments=db_attachments
+                )
             )
             db_package.museum_object = db_museum_object
         else:
@@ -95,10 +104,37 @@ def download_object(object_id):
                 f"Package with filename {filename} already exists"
             )
 
+        # Object is no longer rejected if the previous attempt was
+        replaces_rejected = bool(
+            db_museum_object.latest_package
+            and db_museum_object.latest_package.rejected
+        )
         db_museum_object.latest_package = db_package
 
+        # Get the attachments that currently exist for this object
+        # and add them to the new MuseumPackage
+        attachment_ids = museum_package.museum_object.attachment_ids
+        bulk_create_missing(db, MuseumAttachment, attachment_ids)
+
+        db.flush()
+        sync_association(
+            db,
+            package_attachment_association_table.c.museum_package_id,
+            package_attachment_association_table.c.museum_attachment_id,
+            {db_package.id: attachment_ids}
+        )
+
         queue = get_queue(QueueType.CREATE_SIP)
         queue.enqueue(
             create_sip, kwargs={"object_id": object_id, "sip_id": sip_id},
             job_id=f"create_sip_{object_id}"
         )
+
+    if DISK_ADMISSION:
+        # Replace the estimate with the actual size
+        update_disk_reservation(
+            object_id, downloaded_size * PACKAGE_SIZE_FACTOR
+        )
+
+    if replaces_rejected:
+        update_stats({ObjectStat.REJECTED: -1})
@@ -9,11 +9,11 @@ from passari_workflow.config import PACKAGE_DIR
 from passari_workflow.db import scoped_session
 from passari_workflow.db.connection import connect_db
 from passari_workflow.db.models import MuseumPackage
-from passari_workflow.jobs.utils import job_locked_by_object_id
+from passari_workflow.jobs.utils import fence_object, job_locked_by_object_id
 
 
 @job_locked_by_object_id
-def submit_sip(object_id, sip_id):
+def submit_sip(object_id, sip_id, lock_token=None):
     """
     Submit SIP to the DPRES service.
 
@@ -52,6 +52,8 @@ def submit_sip(object_id, sip_id):
     print(f"Package {filename} submitted, removing local file")
 
     with scoped_session() as db:
+        fence_object(db, object_id, lock_token)
+
         db_museum_package = db.query(MuseumPackage).filter_by(
             sip_filename=museum_package.sip_filename
         ).one()
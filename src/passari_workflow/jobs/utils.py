@@ -1,14 +1,21 @@
+import logging
 import shutil
 from functools import wraps
 from pathlib import Path
 
-import redis_lock
 from passari.dpres.package import MuseumObjectPackage
-from passari_workflow.config import ARCHIVE_DIR, PACKAGE_DIR
+from passari_workflow.config import ARCHIVE_DIR, LOCK_DEFERRAL, PACKAGE_DIR
 from passari_workflow.db import scoped_session
 from passari_workflow.db.models import (FreezeSource, MuseumObject,
                                         MuseumPackage)
-from passari_workflow.redis.connection import get_redis_connection
+from passari_workflow.exceptions import LockLostError
+from passari_workflow.queue.scheduling import (defer_current_job,
+                                               release_disk_space)
+from passari_workflow.redis.locks import get_object_lock
+from passari_workflow.stats import ObjectStat, update_stats
+from sqlalchemy.sql import and_, exists, or_
+
+LOG = logging.getLogger(__name__)
 
 
 def job_locked_by_object_id(func):
@@ -19,6 +26,14 @@ def job_locked_by_object_id(func):
     This ensures that no race conditions with one RQ job starting just before
     the previous one finishes executing (eg. 'download_object' hasn't finished
     persisting DB update when 'create_sip' starts execution)
+
+    If 'lock_deferral' is enabled, a job whose object is locked is postponed
+    instead of waiting for the lock, allowing the worker to start the next
+    job immediately.
+
+    The job is called with an additional 'lock_token' keyword argument
+    containing the fencing token of the lock, which should be passed to
+    'fence_object' when the job updates the database.
     """
     @wraps(func)
     def wrapper(*args, **kwargs):
@@ -30,27 +45,100 @@ def job_locked_by_object_id(func):
             object_id = int(args[0])
 
         # Use lock named with the object ID to ensure mutual exclusion
-        redis = get_redis_connection()
-        lock = redis_lock.Lock(redis, f"lock-object-{object_id}")
+        lock = get_object_lock(object_id)
 
-        with lock:
-            return func(*args, **kwargs)
+        if LOCK_DEFERRAL:
+            if not lock.acquire(blocking=False):
+                defer_current_job(
+                    f"Object {object_id} is being processed by another job"
+                )
+        else:
+            lock.acquire()
+
+        try:
+            return func(*args, lock_token=lock.token, **kwargs)
+        finally:
+            lock.release()
+
+            if lock.lost:
+                # The database updates are protected by the fencing token,
+                # but other changes made by the job may have overlapped with
+                # another job
+                LOG.error(
+                    "Lock for object %d expired while the job was running",
+                    object_id
+                )
 
     return wrapper
 
 
-def freeze_running_object(object_id, sip_id, freeze_reason):
+def fence_object(db, object_id, lock_token):
+    """
+    Record the fencing token of the job updating the object, or raise
+    LockLostError if a job with a newer token has already updated it.
+
+    This should be called in the same transaction as the job's database
+    updates, so that the updates are rolled back if the job's object lock
+    expired and was acquired by another job in the meantime.
+
+    :param db: SQLAlchemy session
+    :param int object_id: Object ID
+    :param int lock_token: Fencing token given by 'job_locked_by_object_id'.
+                           If None, nothing is done.
+    """
+    if lock_token is None:
+        return
+
+    updated = (
+        db.query(MuseumObject)
+        .filter(
+            MuseumObject.id == object_id,
+            or_(
+                MuseumObject.lock_token == None,
+                MuseumObject.lock_token <= lock_token
+            )
+        )
+        .update(
+            {MuseumObject.lock_token: lock_token},
+            synchronize_session=False
+        )
+    )
+
+    if updated:
+        return
+
+    newer_token_exists = db.query(
+        exists().where(
+            and_(
+                MuseumObject.id == object_id,
+                MuseumObject.lock_token > lock_token
+            )
+        )
+    ).scalar()
+
+    if newer_token_exists:
+        raise LockLostError(
+            f"Lock for object {object_id} was lost and acquired by another "
+            f"job"
+        )
+
+
+def freeze_running_object(object_id, sip_id, freeze_reason, lock_token=None):
     """
     Cancel and freeze a MuseumObject that is currently in the workflow,
     and mark the SIP as cancelled if one was created.
     """
     with scoped_session() as db:
+        fence_object(db, object_id, lock_token)
+
         museum_object = (
             db.query(MuseumObject)
             .filter(MuseumObject.id == object_id)
             .one()
         )
 
+        newly_frozen = not museum_object.frozen
+
         museum_object.frozen = True
         museum_object.freeze_reason = freeze_reason
         museum_object.freeze_source = FreezeSource.AUTOMATIC
@@ -80,3 +168,8 @@ def freeze_running_object(object_id, sip_id, freeze_reason):
         except FileNotFoundError:
             # Object directory didn't exist yet
             pass
+
+    release_disk_space(object_id)
+
+    if newly_frozen:
+        update_stats({ObjectStat.FROZEN: 1})
@@ -2,12 +2,15 @@ from collections import defaultdict
 from contextlib import contextmanager
 from enum import Enum
 
-import redis_lock
+from passari_workflow.exceptions import LockLostError
 from passari_workflow.redis.connection import get_redis_connection
-from rq import Queue
+from passari_workflow.redis.locks import MultiLock
+from rq import Callback, Queue
 from rq.exceptions import NoSuchJobError
 from rq.job import Job
-from rq.registry import FailedJobRegistry, StartedJobRegistry
+from rq.registry import (FailedJobRegistry, ScheduledJobRegistry,
+                         StartedJobRegistry)
+from rq.utils import as_text, current_timestamp
 
 
 class QueueType(Enum):
@@ -15,24 +18,179 @@ class QueueType(Enum):
     Each queue type corresponds to a RQ queue
     """
     DOWNLOAD_OBJECT = "download_object"
+    DOWNLOAD_OBJECT_HIGH = "download_object_high"
+    DOWNLOAD_OBJECT_LOW = "download_object_low"
     CREATE_SIP = "create_sip"
     SUBMIT_SIP = "submit_sip"
     CONFIRM_SIP = "confirm_sip"
     ENQUEUE_OBJECTS = "enqueue_objects"
 
 
-class WorkflowQueue(Queue):
-    # Workflow tasks have a default timeout of 4 hours
-    DEFAULT_TIMEOUT = 14400
-
-
 OBJECT_QUEUE_TYPES = [
+    QueueType.DOWNLOAD_OBJECT_HIGH,
     QueueType.DOWNLOAD_OBJECT,
+    QueueType.DOWNLOAD_OBJECT_LOW,
     QueueType.CREATE_SIP,
     QueueType.SUBMIT_SIP,
     QueueType.CONFIRM_SIP
 ]
 
+OBJECT_QUEUE_NAMES = [queue_type.value for queue_type in OBJECT_QUEUE_TYPES]
+
+
+class Priority(Enum):
+    """
+    Priority of an object in the workflow. Each priority has its own
+    'download_object' queue; the subsequent jobs share the same queues.
+    """
+    HIGH = "high"
+    NORMAL = "normal"
+    LOW = "low"
+
+
+DOWNLOAD_OBJECT_QUEUE_TYPES = {
+    Priority.HIGH: QueueType.DOWNLOAD_OBJECT_HIGH,
+    Priority.NORMAL: QueueType.DOWNLOAD_OBJECT,
+    Priority.LOW: QueueType.DOWNLOAD_OBJECT_LOW
+}
+
+# Redis hash of {object_id: queue_name} for the current job of each object.
+# Failed jobs are stored as 'failed:<queue_name>'.
+OBJECT_QUEUE_INDEX_KEY = "workflow:object_queues"
+# Set once the index has been built from the current queues
+OBJECT_QUEUE_INDEX_BUILT_KEY = "workflow:object_queues:built"
+
+# Job ID prefix of each object queue. Every download queue contains
+# 'download_object_<object_id>' jobs.
+OBJECT_JOB_ID_PREFIXES = {
+    queue_type.value: (
+        QueueType.DOWNLOAD_OBJECT.value
+        if queue_type in DOWNLOAD_OBJECT_QUEUE_TYPES.values()
+        else queue_type.value
+    )
+    for queue_type in OBJECT_QUEUE_TYPES
+}
+
+# The workflow lock is split into stripes by object ID, allowing operations
+# concerning different objects to run concurrently
+LOCK_STRIPE_COUNT = 64
+
+# Barrier lock held by 'lock_queues' while it waits for every stripe.
+# 'lock_objects' can't acquire stripes while the barrier is held, which
+# prevents 'lock_queues' from being starved by a steady stream of
+# 'lock_objects' calls.
+GLOBAL_LOCK_BARRIER = "workflow-lock-global-pending"
+
+# Replace the object's index entry with ARGV[4], or delete it if ARGV[4] is
+# empty, but only if the entry still belongs to the queue in ARGV[2..3].
+# This prevents a finished job from removing the entry of the next job
+# it enqueued for the same object.
+UPDATE_OBJECT_QUEUE_INDEX_SCRIPT = """
+local value = redis.call('HGET', KEYS[1], ARGV[1])
+if value ~= ARGV[2] and value ~= ARGV[3] then
+    return 0
+end
+if ARGV[4] == '' then
+    redis.call('HDEL', KEYS[1], ARGV[1])
+else
+    redis.call('HSET', KEYS[1], ARGV[1], ARGV[4])
+end
+return 1
+"""
+
+# Remove the index entries whose job no longer exists, and return the
+# object IDs of the remaining entries. Jobs can disappear without the RQ
+# callbacks being called, eg. when a failed job expires or is removed using
+# the RQ command-line tools. ARGV[1] is the key prefix of RQ jobs, and the
+# rest of ARGV contains (queue_name, job_id_prefix) pairs.
+PRUNE_OBJECT_QUEUE_INDEX_SCRIPT = """
+local job_id_prefixes = {}
+for i = 2, #ARGV, 2 do
+    job_id_prefixes[ARGV[i]] = ARGV[i + 1]
+end
+local object_ids = {}
+local entries = redis.call('HGETALL', KEYS[1])
+for i = 1, #entries, 2 do
+    local object_id = entries[i]
+    local queue_name = string.gsub(entries[i + 1], '^failed:', '')
+    local job_id_prefix = job_id_prefixes[queue_name] or queue_name
+    local job_key = ARGV[1] .. job_id_prefix .. '_' .. object_id
+    if redis.call('EXISTS', job_key) == 0 then
+        redis.call('HDEL', KEYS[1], object_id)
+    else
+        table.insert(object_ids, object_id)
+    end
+end
+return object_ids
+"""
+
+
+class WorkflowQueue(Queue):
+    # Workflow tasks have a default timeout of 4 hours
+    DEFAULT_TIMEOUT = 14400
+
+    def create_job(self, *args, **kwargs):
+        if self.name in OBJECT_QUEUE_NAMES:
+            # Keep the object queue index up-to-date once the job finishes
+            if kwargs.get("on_success") is None:
+                kwargs["on_success"] = Callback(on_object_job_success)
+            if kwargs.get("on_failure") is None:
+                kwargs["on_failure"] = Callback(on_object_job_failure)
+
+        return super().create_job(*args, **kwargs)
+
+    def _enqueue_job(self, job, pipeline=None, at_front=False):
+        object_id = job_id_to_object_id(job.id)
+
+        if self.name not in OBJECT_QUEUE_NAMES or object_id is None:
+            return super()._enqueue_job(
+                job, pipeline=pipeline, at_front=at_front
+            )
+
+        # Update the object queue index in the same pipeline as the job
+        # itself
+        pipe = pipeline if pipeline is not None else self.connection.pipeline()
+        pipe.hset(OBJECT_QUEUE_INDEX_KEY, object_id, self.name)
+        job = super()._enqueue_job(job, pipeline=pipe, at_front=at_front)
+
+        if pipeline is None:
+            pipe.execute()
+
+        return job
+
+
+def _update_object_queue_index(connection, job, new_value):
+    object_id = job_id_to_object_id(job.id)
+    if object_id is None:
+        return
+
+    script = connection.register_script(UPDATE_OBJECT_QUEUE_INDEX_SCRIPT)
+    script(
+        keys=[OBJECT_QUEUE_INDEX_KEY],
+        args=[object_id, job.origin, f"failed:{job.origin}", new_value]
+    )
+
+
+def on_object_job_success(job, connection, result, *args, **kwargs):
+    """
+    RQ callback to remove the object from the object queue index once
+    its job has finished
+    """
+    _update_object_queue_index(connection, job, new_value="")
+
+
+def on_object_job_failure(job, connection, *exc_info, **kwargs):
+    """
+    RQ callback to mark the object as failed in the object queue index
+    """
+    if job.retries_left:
+        # The job will be retried and remains in the same queue
+        return
+
+    _update_object_queue_index(
+        connection, job, new_value=f"failed:{job.origin}"
+    )
+
 
 def job_id_to_object_id(job_id):
     """
@@ -76,9 +234,133 @@ def delete_jobs_for_object_id(object_id):
         except NoSuchJobError:
             pass
 
+    redis.hdel(OBJECT_QUEUE_INDEX_KEY, object_id)
+
     return cancelled_count
 
 
+class QueueSnapshot:
+    """
+    Snapshot of the object IDs in every object-related queue, including
+    pending, executing and failed jobs.
+
+    All job IDs are retrieved using a single Redis pipeline.
+    """
+    def __init__(self, pending, running, failed):
+        """
+        :param dict pending: {queue_name: object_ids} of pending jobs
+        :param dict running: {queue_name: object_ids} of executing jobs
+        :param dict failed: {queue_name: object_ids} of failed jobs
+        """
+        self.pending = pending
+        self.running = running
+        self.failed = failed
+
+    @classmethod
+    def fetch(cls):
+        """
+        Retrieve a snapshot of the current queues.
+
+        Executing jobs that have expired are considered failed, and failed
+        jobs that have expired are ignored, in the same way RQ would treat
+        them when cleaning up its job registries. Jobs scheduled to be
+        retried later are considered pending.
+        """
+        redis = get_redis_connection()
+        now = current_timestamp()
+
+        with redis.pipeline() as pipe:
+            for queue_type in OBJECT_QUEUE_TYPES:
+                queue = WorkflowQueue(queue_type.value, connection=redis)
+                started_key = StartedJobRegistry(queue=queue).key
+                failed_key = FailedJobRegistry(queue=queue).key
+                scheduled_key = ScheduledJobRegistry(queue=queue).key
+
+                pipe.lrange(queue.key, 0, -1)
+                pipe.zrange(scheduled_key, 0, -1)
+                pipe.zrangebyscore(started_key, f"({now}", "+inf")
+                pipe.zrangebyscore(started_key, 0, now)
+                pipe.zrangebyscore(failed_key, f"({now}", "+inf")
+
+            results = iter(pipe.execute())
+
+        pending = {}
+        running = {}
+        failed = {}
+
+        for queue_type in OBJECT_QUEUE_TYPES:
+            name = queue_type.value
+            pending[name] = (
+                _job_ids_to_object_ids(next(results))
+                | _job_ids_to_object_ids(next(results))
+            )
+            running[name] = _job_ids_to_object_ids(next(results))
+            failed[name] = (
+                _job_ids_to_object_ids(next(results))
+                | _job_ids_to_object_ids(next(results))
+            )
+
+        return cls(pending=pending, running=running, failed=failed)
+
+    @property
+    def enqueued_object_ids(self):
+        """
+        Object IDs with pending, executing or failed jobs
+        """
+        object_ids = set()
+
+        for object_ids_by_queue in (self.pending, self.running, self.failed):
+            for queue_object_ids in object_ids_by_queue.values():
+                object_ids |= queue_object_ids
+
+        return object_ids
+
+    @property
+    def running_object_ids(self):
+        """
+        Object IDs with executing jobs
+        """
+        return set().union(*self.running.values())
+
+    def get_object_id2queue_map(self, object_ids):
+        """
+        Get a {object_id: queue_names} dictionary of object IDs and the
+        queues they currently belong to
+        """
+        queue_object_ids = defaultdict(set)
+
+        for queue_type in OBJECT_QUEUE_TYPES:
+            name = queue_type.value
+            queue_object_ids[name] = (
+                self.pending[name] | self.running[name] | self.failed[name]
+            )
+            queue_object_ids["failed"] |= self.failed[name]
+
+        # Check for all queues plus the catch-all failed queue
+        queue_names = [
+            queue_type.value for queue_type in OBJECT_QUEUE_TYPES
+        ] + ["failed"]
+
+        return {
+            object_id: [
+                queue_name for queue_name in queue_names
+                if object_id in queue_object_ids[queue_name]
+            ]
+            for object_id in object_ids
+        }
+
+
+def _job_ids_to_object_ids(job_ids):
+    object_ids = set()
+
+    for job_id in job_ids:
+        object_id = job_id_to_object_id(as_text(job_id))
+        if object_id is not None:
+            object_ids.add(object_id)
+
+    return object_ids
+
+
 def get_enqueued_object_ids():
     """
     Get object IDs from every object-related queue including every pending,
@@ -87,50 +369,114 @@ def get_enqueued_object_ids():
     This can be used to determine which jobs can be enqueued without
     risk of duplicates
     """
-    object_ids = set()
+    return QueueSnapshot.fetch().enqueued_object_ids
+
+
+def get_running_object_ids():
+    """
+    Get object IDs which are currently being executed in the workflow
+    """
+    return QueueSnapshot.fetch().running_object_ids
 
-    registry_types = (StartedJobRegistry, FailedJobRegistry)
 
+def rebuild_object_queue_index():
+    """
+    Rebuild the object queue index from the current contents of the queues.
+
+    This is done automatically if the index hasn't been built yet. It can
+    also be done using the 'rebuild-queue-index' command if the index has
+    become out of sync, for example after jobs have been moved using the RQ
+    command-line tools.
+    """
+    redis = get_redis_connection()
+    snapshot = QueueSnapshot.fetch()
+
+    # If the object has jobs in multiple queues, the latest queue in the
+    # workflow takes precedence
+    index = {}
     for queue_type in OBJECT_QUEUE_TYPES:
-        queue = get_queue(queue_type)
+        name = queue_type.value
+        for object_id in snapshot.pending[name] | snapshot.running[name]:
+            index[object_id] = name
+        for object_id in snapshot.failed[name]:
+            index[object_id] = f"failed:{name}"
 
-        # Retrieve started and failed jobs
-        for registry_type in registry_types:
-            job_registry = registry_type(queue=queue)
-            job_ids = job_registry.get_job_ids()
+    with redis.pipeline() as pipe:
+        pipe.delete(OBJECT_QUEUE_INDEX_KEY)
+        if index:
+            pipe.hset(OBJECT_QUEUE_INDEX_KEY, mapping=index)
+        pipe.set(OBJECT_QUEUE_INDEX_BUILT_KEY, 1)
+        pipe.execute()
 
-            for job_id in job_ids:
-                object_id = job_id_to_object_id(job_id)
-                if object_id is not None:
-                    object_ids.add(object_id)
 
-        # Retrieve scheduled jobs
-        for job_id in queue.get_job_ids():
-            object_id = job_id_to_object_id(job_id)
-            if object_id is not None:
-                object_ids.add(object_id)
+def ensure_object_queue_index():
+    """
+    Build the object queue index if it hasn't been built yet
+    """
+    redis = get_redis_connection()
 
-    return object_ids
+    if not redis.exists(OBJECT_QUEUE_INDEX_BUILT_KEY):
+        rebuild_object_queue_index()
 
 
-def get_running_object_ids():
+def get_object_queue_index_entries(object_ids):
     """
-    Get object IDs which are currently being executed in the workflow
+    Get the object queue index entries for the given object IDs
+
+    :returns: List of entries in the same order as 'object_ids'. Each entry
+              is either the queue name, 'failed:<queue_name>' or None.
     """
-    object_ids = set()
+    object_ids = [int(object_id) for object_id in object_ids]
+    if not object_ids:
+        return []
 
-    for queue_type in OBJECT_QUEUE_TYPES:
-        queue = get_queue(queue_type)
+    redis = get_redis_connection()
+    ensure_object_queue_index()
 
-        job_registry = StartedJobRegistry(queue=queue)
-        job_ids = job_registry.get_job_ids()
+    return [
+        as_text(entry) if entry is not None else None
+        for entry in redis.hmget(OBJECT_QUEUE_INDEX_KEY, object_ids)
+    ]
 
-        for job_id in job_ids:
-            object_id = job_id_to_object_id(job_id)
-            if object_id is not None:
-                object_ids.add(object_id)
 
-    return object_ids
+def get_indexed_object_ids():
+    """
+    Get object IDs that have pending, executing or failed jobs in the
+    workflow using the object queue index.
+
+    This is equivalent to 'get_enqueued_object_ids', but only the object IDs
+    are retrieved instead of the contents of every queue and registry.
+    Entries whose job no longer exists are removed from the index.
+    """
+    redis = get_redis_connection()
+    ensure_object_queue_index()
+
+    job_id_prefixes = [
+        value for item in OBJECT_JOB_ID_PREFIXES.items() for value in item
+    ]
+    script = redis.register_script(PRUNE_OBJECT_QUEUE_INDEX_SCRIPT)
+    object_ids = script(
+        keys=[OBJECT_QUEUE_INDEX_KEY],
+        args=[Job.redis_job_namespace_prefix] + job_id_prefixes
+    )
+
+    return {int(object_id) for object_id in object_ids}
+
+
+def filter_enqueued_object_ids(object_ids):
+    """
+    Get the subset of the given object IDs that have pending, executing or
+    failed jobs in the workflow.
+
+    Unlike 'get_enqueued_object_ids', only the given objects are looked up.
+    """
+    object_ids = [int(object_id) for object_id in object_ids]
+    entries = get_object_queue_index_entries(object_ids)
+
+    return {
+        object_id for object_id, entry in zip(object_ids, entries)
+        if entry is not None
+    }
 
 
 def get_object_id2queue_map(object_ids):
@@ -138,58 +484,82 @@ def get_object_id2queue_map(object_ids):
     Get a {object_id: queue_names} dictionary of object IDs and the queues they
     currently belong to
     """
-    queue_object_ids = defaultdict(set)
+    object_ids = list(object_ids)
+    entries = get_object_queue_index_entries(object_ids)
+
     queue_map = {}
 
-    for queue_type in OBJECT_QUEUE_TYPES:
-        queue = get_queue(queue_type)
-        started_registry = StartedJobRegistry(queue=queue)
-        job_ids = started_registry.get_job_ids() + queue.get_job_ids()
-
-        # Check pending or executing jobs
-        for job_id in job_ids:
-            object_id = job_id_to_object_id(job_id)
-            if object_id is not None:
-                queue_object_ids[queue_type.value].add(object_id)
-
-        failed_registry = FailedJobRegistry(queue=get_queue(queue_type))
-        job_ids = failed_registry.get_job_ids()
-
-        # Check failed jobs
-        for job_id in job_ids:
-            object_id = job_id_to_object_id(job_id)
-            if object_id is not None:
-                queue_object_ids[queue_type.value].add(object_id)
-                queue_object_ids["failed"].add(object_id)
-
-    # Check for all queues plus the catch-all failed queue
-    queue_names = [
-        queue_type.value for queue_type in OBJECT_QUEUE_TYPES
-    ] + ["failed"]
-
-    for object_id in object_ids:
-        queue_map[object_id] = []
-        for queue_name in queue_names:
-            if object_id in queue_object_ids[queue_name]:
-                queue_map[object_id].append(queue_name)
+    for object_id, entry in zip(object_ids, entries):
+        if entry is None:
+            queue_map[object_id] = []
+        elif entry.startswith("failed:"):
+            queue_map[object_id] = [entry[len("failed:"):], "failed"]
+        else:
+            queue_map[object_id] = [entry]
 
     return queue_map
 
 
+def get_lock_stripe_names(object_ids):
+    """
+    Get the names of the workflow lock stripes covering the given objects
+    """
+    return sorted({
+        f"workflow-lock-{int(object_id) % LOCK_STRIPE_COUNT}"
+        for object_id in object_ids
+    })
+
+
 @contextmanager
-def lock_queues():
+def lock_objects(object_ids):
     """
-    Context manager to lock all queues.
+    Context manager to lock the workflow for the given objects.
 
     This lock should be acquired when the workflow is affected directly
     (eg. enqueueing new jobs) or indirectly (eg. updating database
     so that changes an object's qualification to be enqueued or not)
+    for specific objects. Operations concerning different objects can run
+    concurrently, unless their objects share a lock stripe.
+
+    :raises LockLostError: If the lock expired before the operation finished,
+                           in which case another operation may have run
+                           concurrently
     """
-    redis = get_redis_connection()
+    with _lock_stripes(get_lock_stripe_names(object_ids)) as lock:
+        yield lock
+
 
-    lock = redis_lock.Lock(redis, "workflow-lock", expire=900)
+@contextmanager
+def lock_queues():
+    """
+    Context manager to lock the workflow for all objects.
+
+    This should only be used by operations that require a consistent view
+    of the entire workflow. Use 'lock_objects' for operations that only
+    concern specific objects.
+
+    New 'lock_objects' calls wait until this lock has been acquired and
+    released, so it's acquired once the current holders release their
+    stripes.
+    """
+    names = get_lock_stripe_names(range(LOCK_STRIPE_COUNT))
+
+    with _lock_stripes(names, reserve_barrier=True) as lock:
+        yield lock
+
+
+@contextmanager
+def _lock_stripes(names, reserve_barrier=False):
+    lock = MultiLock(
+        names, barrier=GLOBAL_LOCK_BARRIER, reserve_barrier=reserve_barrier
+    )
     lock.acquire(blocking=True)
     try:
         yield lock
     finally:
         lock.release()
+
+    if lock.lost:
+        raise LockLostError(
+            "Workflow lock expired before the operation finished"
+        )
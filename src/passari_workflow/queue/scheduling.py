@@ -0,0 +1,266 @@
+"""
+Scheduling policy determining the priority of objects entering the workflow,
+and admission control that postpones downloads when the package directory
+doesn't have enough free space.
+
+The policy is configured in the 'scheduling' section of the configuration
+file.
+"""
+import shutil
+from pathlib import Path
+
+from rq import get_current_job
+from sqlalchemy import BigInteger, any_, func, literal, select
+from sqlalchemy.dialects.postgresql import ARRAY
+
+from passari_workflow.config import (ATTACHMENT_SIZE_ESTIMATE,
+                                     DEFERRAL_DELAY,
+                                     LARGE_OBJECT_ATTACHMENT_COUNT,
+                                     MAX_DEFERRAL_DELAY, MIN_FREE_SPACE,
+                                     NEW_OBJECT_PRIORITY, PACKAGE_DIR,
+                                     UPDATED_OBJECT_PRIORITY, USER_PRIORITY)
+from passari_workflow.db import scoped_session
+from passari_workflow.db.models import (MuseumObject, MuseumPackage,
+                                        object_attachment_association_table)
+from passari_workflow.exceptions import JobDeferredError
+from passari_workflow.queue.queues import (OBJECT_QUEUE_INDEX_KEY, Priority,
+                                           ensure_object_queue_index)
+from passari_workflow.redis.connection import get_redis_connection
+
+# Redis hash of {object_id: bytes} for the disk space reserved in the
+# package directory by each object in the workflow
+DISK_RESERVATIONS_KEY = "workflow:disk_reservations"
+
+# The package directory contains both the downloaded files and the SIP
+# created from them, so each object needs roughly twice its size
+PACKAGE_SIZE_FACTOR = 2
+
+# Reserve ARGV[2] bytes for the object ARGV[1] if the other reservations
+# leave enough room within the ARGV[3] available bytes. The rest of ARGV
+# contains (object_id, bytes) pairs for the files the objects have already
+# written to the package directory. These bytes are already missing from
+# the available space, so only the remainder of each reservation is counted.
+# Reservations of objects that are no longer in the workflow are removed.
+# The first object is always admitted, as it wouldn't fit later either.
+RESERVE_DISK_SPACE_SCRIPT = """
+local used = {}
+for i = 4, #ARGV, 2 do
+    used[ARGV[i]] = tonumber(ARGV[i + 1])
+end
+local reserved = 0
+local entries = redis.call('HGETALL', KEYS[1])
+for i = 1, #entries, 2 do
+    local object_id = entries[i]
+    if object_id ~= ARGV[1] then
+        if redis.call('HEXISTS', KEYS[2], object_id) == 0 then
+            redis.call('HDEL', KEYS[1], object_id)
+        else
+            local remainder = tonumber(entries[i + 1]) - (used[object_id] or 0)
+            reserved = reserved + math.max(remainder, 0)
+        end
+    end
+end
+if reserved > 0 and reserved + tonumber(ARGV[2]) > tonumber(ARGV[3]) then
+    return 0
+end
+redis.call('HSET', KEYS[1], ARGV[1], ARGV[2])
+return 1
+"""
+
+
+def get_object_priorities(object_ids, user_requested=False):
+    """
+    Get the priority of each object according to the configured policy
+
+    :param list object_ids: Object IDs to check
+    :param bool user_requested: Whether the objects were enqueued explicitly
+                                by the user
+
+    :returns: {object_id: Priority} dict
+    """
+    object_ids = [int(object_id) for object_id in object_ids]
+
+    if user_requested:
+        return {object_id: Priority(USER_PRIORITY) for object_id in object_ids}
+
+    if not object_ids:
+        return {}
+
+    association = object_attachment_association_table
+    query = (
+        select([
+            MuseumObject.id,
+            MuseumObject.preserved,
+            func.count(association.c.museum_attachment_id)
+        ])
+        .select_from(
+            MuseumObject.__table__.outerjoin(
+                association, association.c.museum_object_id == MuseumObject.id
+            )
+        )
+        .where(
+            MuseumObject.id == any_(literal(object_ids, ARRAY(BigInteger)))
+        )
+        .group_by(MuseumObject.id)
+    )
+
+    with scoped_session() as db:
+        results = db.execute(query).fetchall()
+
+    priorities = {}
+
+    for object_id, preserved, attachment_count in results:
+        is_large = (
+            LARGE_OBJECT_ATTACHMENT_COUNT
+            and attachment_count > LARGE_OBJECT_ATTACHMENT_COUNT
+        )
+
+        if is_large:
+            priorities[object_id] = Priority.LOW
+        elif preserved:
+            priorities[object_id] = Priority(UPDATED_OBJECT_PRIORITY)
+        else:
+            priorities[object_id] = Priority(NEW_OBJECT_PRIORITY)
+
+    # Objects that don't exist in the database get the default priority
+    for object_id in object_ids:
+        priorities.setdefault(object_id, Priority(NEW_OBJECT_PRIORITY))
+
+    return priorities
+
+
+def estimate_object_size(db, object_id):
+    """
+    Estimate the size of the object's files in bytes using the size of a
+    previous download, or the attachment count if the object hasn't been
+    downloaded before
+    """
+    previous_size = (
+        db.query(func.max(MuseumPackage.downloaded_size))
+        .filter(MuseumPackage.museum_object_id == object_id)
+        .scalar()
+    )
+
+    if previous_size is not None:
+        return previous_size
+
+    association = object_attachment_association_table
+    attachment_count = db.execute(
+        select([func.count()])
+        .select_from(association)
+        .where(association.c.museum_object_id == object_id)
+    ).scalar()
+
+    return attachment_count * ATTACHMENT_SIZE_ESTIMATE
+
+
+def get_directory_size(path):
+    """
+    Get the total size of the files in a directory in bytes, or zero if
+    the directory doesn't exist
+    """
+    return sum(
+        entry.stat().st_size for entry in Path(path).rglob("*")
+        if entry.is_file()
+    )
+
+
+def reserve_disk_space(object_id, size):
+    """
+    Reserve disk space in the package directory for an object if there is
+    enough free space left after the reservations of the other objects in
+    the workflow. Files the other objects have already written count
+    towards their reservations.
+
+    :param int object_id: Object ID
+    :param int size: Bytes to reserve
+
+    :returns: True if the space was reserved, False otherwise
+    """
+    redis = get_redis_connection()
+    ensure_object_queue_index()
+
+    # Sizes of the files the other objects have already written
+    used_sizes = []
+    for reserved_id in redis.hkeys(DISK_RESERVATIONS_KEY):
+        reserved_id = reserved_id.decode("utf-8")
+        if reserved_id != str(int(object_id)):
+            used_sizes += [
+                reserved_id,
+                get_directory_size(Path(PACKAGE_DIR) / reserved_id)
+            ]
+
+    available = shutil.disk_usage(PACKAGE_DIR).free - MIN_FREE_SPACE
+
+    script = redis.register_script(RESERVE_DISK_SPACE_SCRIPT)
+    return bool(
+        script(
+            keys=[DISK_RESERVATIONS_KEY, OBJECT_QUEUE_INDEX_KEY],
+            args=[int(object_id), int(size), available] + used_sizes
+        )
+    )
+
+
+def update_disk_reservation(object_id, size):
+    """
+    Replace the existing reservation of an object, eg. once the actual size
+    is known
+    """
+    redis = get_redis_connection()
+
+    if redis.hexists(DISK_RESERVATIONS_KEY, int(object_id)):
+        redis.hset(DISK_RESERVATIONS_KEY, int(object_id), int(size))
+
+
+def release_disk_space(object_id):
+    """
+    Release the disk space reserved by an object once its files have been
+    removed from the package directory
+    """
+    redis = get_redis_connection()
+    redis.hdel(DISK_RESERVATIONS_KEY, int(object_id))
+
+
+def defer_current_job(reason):
+    """
+    Stop the current RQ job and schedule it to be retried later.
+
+    The delay is doubled each time the same job is deferred. The worker
+    must be started with the '--with-scheduler' flag for the job to be
+    retried.
+
+    :raises JobDeferredError: Always
+    """
+    job = get_current_job()
+
+    if job:
+        deferral_count = job.meta.get("deferral_count", 0)
+        job.meta["deferral_count"] = deferral_count + 1
+        job.save_meta()
+
+        # RQ retries the job after the interval instead of marking it
+        # as failed
+        job.retries_left = 1
+        job.retry_intervals = [
+            min(DEFERRAL_DELAY * 2 ** deferral_count, MAX_DEFERRAL_DELAY)
+        ]
+
+    raise JobDeferredError(reason)
+
+
+def admit_object_download(object_id):
+    """
+    Reserve disk space for downloading and packaging an object, or defer
+    the current job if there isn't enough free space in the package
+    directory
+
+    :raises JobDeferredError: If there isn't enough free space
+    """
+    with scoped_session() as db:
+        size = estimate_object_size(db, object_id)
+
+    if not reserve_disk_space(object_id, size * PACKAGE_SIZE_FACTOR):
+        defer_current_job(
+            f"Not enough free space in the package directory to download "
+            f"object {object_id}"
+        )
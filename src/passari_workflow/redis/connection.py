@@ -1,4 +1,5 @@
 import os
+import threading
 from urllib.parse import quote
 
 from passari_workflow.config import CONFIG
@@ -6,13 +7,41 @@ from passari_workflow.config import CONFIG
 from redis import Redis
 
 
+# Redis clients keyed by (process ID, URL). Each client has its own
+# connection pool, which is reused by every caller in the same process.
+_CLIENTS = {}
+_CLIENTS_LOCK = threading.Lock()
+
+
 def get_redis_connection():
     """
     Get Redis connection used for the workflow, distributed locks and other
-    miscellaneous tasks
+    miscellaneous tasks.
+
+    The same client is returned for the same URL within a process. Forked
+    processes such as RQ work horses get their own clients instead of
+    sharing the connections of the parent process.
     """
     redis_url = get_redis_url()
-    return Redis.from_url(redis_url)
+    key = (os.getpid(), redis_url)
+
+    client = _CLIENTS.get(key)
+    if client is not None:
+        return client
+
+    with _CLIENTS_LOCK:
+        client = _CLIENTS.get(key)
+        if client is None:
+            # Forget any clients inherited from the parent process without
+            # closing them, as the parent is still using the connections
+            for inherited_key in list(_CLIENTS):
+                if inherited_key[0] != key[0]:
+                    del _CLIENTS[inherited_key]
+
+            client = Redis.from_url(redis_url)
+            _CLIENTS[key] = client
+
+    return client
 
 
 def get_redis_url():
@@ -0,0 +1,297 @@
+"""
+Distributed locks used to ensure mutual exclusion between the workflow jobs
+and scripts.
+
+The locks are leases that expire unless they are renewed. The lock is
+renewed automatically in a background thread while it's held, so locks held
+by a crashed process are released after 'LOCK_EXPIRE' seconds instead of
+blocking the workflow.
+
+A lease may still be lost while it's held if the process is paused for
+longer than the lock expiration. Each acquisition is therefore given an
+increasing fencing token atomically with the lock itself, which can be used
+to reject updates from holders that have since lost the lock.
+"""
+import logging
+import os
+import threading
+import time
+from collections import namedtuple
+
+import redis_lock
+from passari_workflow.redis.connection import get_redis_connection
+from rq.utils import as_text
+
+LOG = logging.getLogger(__name__)
+
+# Seconds until a lock expires unless it is renewed. The lock is renewed
+# every 2/3 of this period.
+LOCK_EXPIRE = 60
+
+# Counter for the fencing tokens
+FENCING_TOKEN_KEY = "workflow:lock_fencing_token"
+
+# Prefix used by 'redis_lock' for the lock keys
+LOCK_KEY_PREFIX = "lock:"
+
+LockInfo = namedtuple("LockInfo", ["name", "owner_id", "ttl"])
+
+# Acquire the ARGV[3] locks KEYS[2..] for the owner ARGV[1] for ARGV[2]
+# milliseconds, or none of them if any of the locks is already held.
+# The fencing token counter KEYS[1] is incremented and the new token is
+# returned and stored in the lock values as "<owner>:<token>".
+#
+# If the barrier lock KEYS[ARGV[3] + 2] is given, the locks can't be
+# acquired while another owner holds the barrier. If ARGV[4] is "1",
+# the owner holds the barrier while waiting for the locks, so that
+# others sharing the barrier can't acquire the locks in the meantime.
+ACQUIRE_LOCKS_SCRIPT = """
+local lock_count = tonumber(ARGV[3])
+local barrier = KEYS[lock_count + 2]
+if barrier then
+    local owner = redis.call('GET', barrier)
+    if owner and owner ~= ARGV[1] then
+        return 0
+    end
+end
+for i = 2, lock_count + 1 do
+    if redis.call('EXISTS', KEYS[i]) == 1 then
+        if barrier and ARGV[4] == '1' then
+            redis.call('SET', barrier, ARGV[1], 'PX', ARGV[2])
+        end
+        return 0
+    end
+end
+local token = redis.call('INCR', KEYS[1])
+for i = 2, lock_count + 1 do
+    redis.call('SET', KEYS[i], ARGV[1] .. ':' .. token, 'PX', ARGV[2])
+end
+if barrier and redis.call('GET', barrier) == ARGV[1] then
+    redis.call('DEL', barrier)
+end
+return token
+"""
+
+# Extend the locks KEYS that still have the value ARGV[1] by ARGV[2]
+# milliseconds and return how many were extended
+EXTEND_LOCKS_SCRIPT = """
+local extended = 0
+for i, key in ipairs(KEYS) do
+    if redis.call('GET', key) == ARGV[1] then
+        redis.call('PEXPIRE', key, ARGV[2])
+        extended = extended + 1
+    end
+end
+return extended
+"""
+
+# Release the locks KEYS that still have the value ARGV[1]
+RELEASE_LOCKS_SCRIPT = """
+for i, key in ipairs(KEYS) do
+    if redis.call('GET', key) == ARGV[1] then
+        redis.call('DEL', key)
+    end
+end
+return 1
+"""
+
+
+class MultiLock:
+    """
+    Lock for one or more names that are acquired atomically: either all of
+    the locks are acquired or none of them are. This prevents deadlocks
+    between processes acquiring overlapping sets of locks.
+
+    The locks are renewed automatically in a single background thread while
+    they are held. If the locks can't be renewed, eg. because the process
+    was paused for longer than the expiration time, 'lost' is set.
+
+    Each acquisition is given a fencing token in 'token', which is larger
+    than the tokens given to any earlier acquisition.
+    """
+    # Longest time to wait between attempts when blocking
+    MAX_RETRY_DELAY = 1.0
+
+    def __init__(
+            self, names, expire=LOCK_EXPIRE, barrier=None,
+            reserve_barrier=False):
+        """
+        :param names: Lock names
+        :param expire: Seconds until the locks expire unless renewed
+        :param str barrier: Optional name of a barrier lock. The locks can't
+                            be acquired while the barrier is held by
+                            someone else.
+        :param bool reserve_barrier: Whether to hold the barrier while
+                                     waiting for the locks. This prevents
+                                     others sharing the barrier from
+                                     acquiring any locks in the meantime,
+                                     so that the locks are eventually
+                                     acquired even under steady contention.
+        """
+        self.names = sorted(set(names))
+        self.keys = [f"{LOCK_KEY_PREFIX}{name}" for name in self.names]
+        self.barrier_key = f"{LOCK_KEY_PREFIX}{barrier}" if barrier else None
+        self.reserve_barrier = reserve_barrier
+        self.expire = expire
+        self.id = os.urandom(16).hex()
+        self.token = None
+        self.lost = False
+
+        self._redis = get_redis_connection()
+        self._renewal_thread = None
+        self._stop_renewal = None
+
+    @property
+    def value(self):
+        return f"{self.id}:{self.token}"
+
+    def _run_script(self, script, keys, *args):
+        return self._redis.register_script(script)(keys=keys, args=args)
+
+    def _try_acquire(self):
+        keys = [FENCING_TOKEN_KEY] + self.keys
+        if self.barrier_key:
+            keys.append(self.barrier_key)
+
+        return self._run_script(
+            ACQUIRE_LOCKS_SCRIPT, keys,
+            self.id, int(self.expire * 1000), len(self.keys),
+            "1" if self.reserve_barrier else "0"
+        )
+
+    def acquire(self, blocking=True):
+        """
+        Acquire all the locks
+
+        :param bool blocking: Whether to wait until the locks can be acquired
+        :returns: True if the locks were acquired, False otherwise
+        """
+        delay = 0.05
+
+        while True:
+            token = self._try_acquire()
+            if token:
+                self.token = token
+                self.lost = False
+                self._start_renewal()
+                return True
+
+            if not blocking:
+                if self.barrier_key:
+                    # Don't leave the barrier reserved
+                    self._run_script(
+                        RELEASE_LOCKS_SCRIPT, [self.barrier_key], self.id
+                    )
+                return False
+
+            # The reserved barrier expires unless the attempts are
+            # repeated within the expiration time
+            time.sleep(delay)
+            delay = min(delay * 2, self.MAX_RETRY_DELAY, self.expire / 3)
+
+    def release(self):
+        """
+        Release all the locks that are still held
+        """
+        self._stop_renewal.set()
+        self._renewal_thread.join()
+        self._renewal_thread = None
+
+        self._run_script(RELEASE_LOCKS_SCRIPT, self.keys, self.value)
+
+    def _start_renewal(self):
+        self._stop_renewal = threading.Event()
+        self._renewal_thread = threading.Thread(
+            target=self._renew, daemon=True
+        )
+        self._renewal_thread.start()
+
+    def _renew(self):
+        # Renew the locks every 2/3 of the expiration time, as 'redis_lock'
+        # does
+        while not self._stop_renewal.wait(timeout=self.expire * 2 / 3):
+            extended = self._run_script(
+                EXTEND_LOCKS_SCRIPT, self.keys,
+                self.value, int(self.expire * 1000)
+            )
+
+            if extended < len(self.keys):
+                # The locks expired before they could be renewed, and may
+                # have been acquired by someone else since
+                LOG.warning(
+                    "Lost %d of the locks %s",
+                    len(self.keys) - extended, ", ".join(self.names)
+                )
+                self.lost = True
+                return
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.release()
+
+
+def get_object_lock(object_id):
+    """
+    Get the lock used to ensure only one job is processing the given object
+    at a time
+    """
+    return MultiLock([f"lock-object-{int(object_id)}"])
+
+
+def get_locks():
+    """
+    Get all locks that are currently held
+
+    :returns: List of LockInfo instances sorted by name. 'ttl' is the
+              amount of seconds until the lock expires, or None if the
+              lock never expires.
+    """
+    redis = get_redis_connection()
+
+    keys = sorted(
+        as_text(key) for key in redis.scan_iter(f"{LOCK_KEY_PREFIX}*")
+    )
+
+    with redis.pipeline() as pipe:
+        for key in keys:
+            pipe.get(key)
+            pipe.ttl(key)
+
+        results = iter(pipe.execute())
+
+    locks = []
+    for key in keys:
+        owner_id, ttl = next(results), next(results)
+
+        if owner_id is None:
+            # Lock was released in the meantime
+            continue
+
+        locks.append(
+            LockInfo(
+                name=key[len(LOCK_KEY_PREFIX):],
+                owner_id=as_text(owner_id),
+                ttl=ttl if ttl >= 0 else None
+            )
+        )
+
+    return locks
+
+
+def get_stale_locks():
+    """
+    Get locks that never expire. Locks acquired using 'MultiLock' always
+    expire, so these were most likely left behind by a process that crashed
+    while running an earlier version of the workflow.
+    """
+    return [lock for lock in get_locks() if lock.ttl is None]
+
+
+def reset_lock(name):
+    """
+    Forcibly release a lock regardless of its owner
+    """
+    redis_lock.Lock(get_redis_connection(), name).reset()
@@ -1,36 +1,165 @@
 """
 Enqueue objects to be downloaded
 """
+from random import randint
+
 import click
+from sqlalchemy import BigInteger, all_, any_, literal
+from sqlalchemy.dialects.postgresql import ARRAY
 from sqlalchemy.sql.expression import func
 
 from passari_workflow.db import scoped_session
 from passari_workflow.db.connection import connect_db
 from passari_workflow.db.models import MuseumObject
 from passari_workflow.jobs.download_object import download_object
-from passari_workflow.queue.queues import (QueueType, get_enqueued_object_ids,
-                                           get_queue, lock_queues)
+from passari_workflow.queue.queues import (DOWNLOAD_OBJECT_QUEUE_TYPES,
+                                           Priority, WorkflowQueue,
+                                           get_indexed_object_ids,
+                                           get_queue, lock_objects)
+from passari_workflow.queue.scheduling import get_object_priorities
+
+# How many jobs to enqueue per Redis pipeline by default
+DEFAULT_BATCH_SIZE = 500
 
 
-def enqueue_object(object_id):
+def enqueue_object(object_id, user_requested=False):
     """
     Enqueue a single object.
 
     This can be called separately outside of 'enqueue_objects'. In this case,
-    the caller needs to ensure the workflow is locked.
+    the caller needs to ensure the object is locked using 'lock_objects'.
+    """
+    return enqueue_object_batch(
+        [object_id], user_requested=user_requested
+    )[0]
+
+
+def enqueue_object_batch(
+        object_ids, batch_size=DEFAULT_BATCH_SIZE, user_requested=False):
+    """
+    Enqueue multiple objects using the same Redis connection, submitting
+    the jobs using one pipeline per batch.
+
+    Each object is placed in the 'download_object' queue corresponding to
+    its priority, as determined by the scheduling policy.
+
+    This can be called separately outside of 'enqueue_objects'. In this case,
+    the caller needs to ensure the objects are locked using 'lock_objects'.
+
+    :param list object_ids: Object IDs to enqueue
+    :param int batch_size: How many jobs to submit per pipeline
+    :param bool user_requested: Whether the objects were enqueued explicitly
+                                by the user
+
+    :returns: List of enqueued jobs
+    """
+    object_ids = [int(object_id) for object_id in object_ids]
+    priorities = get_object_priorities(
+        object_ids, user_requested=user_requested
+    )
+
+    jobs = []
+
+    # Enqueue the jobs with the highest priority first
+    for priority in Priority:
+        queue = get_queue(DOWNLOAD_OBJECT_QUEUE_TYPES[priority])
+
+        # The job ID is the same regardless of the priority, ensuring the
+        # object can only be in one of the queues
+        job_datas = [
+            WorkflowQueue.prepare_data(
+                download_object,
+                kwargs={"object_id": object_id},
+                job_id=f"download_object_{object_id}"
+            )
+            for object_id in object_ids
+            if priorities[object_id] == priority
+        ]
+
+        for i in range(0, len(job_datas), batch_size):
+            with queue.connection.pipeline() as pipe:
+                jobs += queue.enqueue_many(
+                    job_datas[i:i+batch_size], pipeline=pipe
+                )
+                pipe.execute()
+
+    return jobs
+
+
+def get_candidate_object_ids(
+        db, count, exclude_object_ids=(), object_ids=None, random=False):
+    """
+    Get the IDs of objects pending preservation.
+
+    Only the IDs are loaded, and the exclusion and the limit are applied in
+    the database, so the cost depends on 'count' rather than the amount of
+    pending objects.
+
+    :param db: SQLAlchemy session
+    :param int count: How many object IDs to return at most
+    :param exclude_object_ids: Object IDs to exclude, eg. objects that are
+                               already in the workflow
+    :param list object_ids: If provided, only these objects are considered
+    :param bool random: If True, start from a random position instead of the
+                        lowest object ID. The objects are consecutive in ID
+                        order, wrapping around to the lowest ID if necessary.
+
+    :returns: List of object IDs
     """
-    object_id = int(object_id)
-    queue = get_queue(QueueType.DOWNLOAD_OBJECT)
-
-    job_id = f"download_object_{object_id}"
-    return queue.enqueue(
-        download_object,
-        kwargs={"object_id": object_id},
-        job_id=job_id
+    query = (
+        db.query(MuseumObject.id)
+        .with_transformation(MuseumObject.filter_preservation_pending)
     )
 
+    if exclude_object_ids:
+        exclude_object_ids = [
+            int(object_id) for object_id in exclude_object_ids
+        ]
+        query = query.filter(
+            MuseumObject.id != all_(
+                literal(exclude_object_ids, ARRAY(BigInteger))
+            )
+        )
+
+    if object_ids is not None:
+        object_ids = [int(object_id) for object_id in object_ids]
+        query = query.filter(
+            MuseumObject.id == any_(literal(object_ids, ARRAY(BigInteger)))
+        )
+
+    def get_ids(query, limit):
+        return [
+            object_id for object_id,
+            in query.order_by(MuseumObject.id).limit(limit)
+        ]
+
+    if not random:
+        return get_ids(query, count)
+
+    # Pick a random starting point instead of sorting every pending object
+    # using 'ORDER BY random()'
+    min_id, max_id = db.query(
+        func.min(MuseumObject.id), func.max(MuseumObject.id)
+    ).one()
+
+    if min_id is None:
+        return []
+
+    start_id = randint(min_id, max_id)
+
+    result = get_ids(query.filter(MuseumObject.id >= start_id), count)
 
-def enqueue_objects(object_count, object_ids=None, random=False):
+    if len(result) < count:
+        result += get_ids(
+            query.filter(MuseumObject.id < start_id), count - len(result)
+        )
+
+    return result
+
+
+def enqueue_objects(
+        object_count, object_ids=None, random=False,
+        batch_size=DEFAULT_BATCH_SIZE):
     """
     Enqueue given number of objects to the preservation workflow.
 
@@ -39,39 +168,49 @@ def enqueue_objects(object_count, object_ids=None, random=False):
                         of in-order.
     :param list object_ids: Object IDs to enqueue. If provided, 'object_count'
                             and 'random' are ignored.
+    :param int batch_size: How many jobs to submit to Redis at a time
     """
     if object_ids:
+        # Object IDs may be provided as strings, eg. by
+        # 'deferred-enqueue-objects'
+        object_ids = [int(object_id) for object_id in object_ids]
         object_count = len(object_ids)
+        random = False
 
-    with lock_queues():
-        connect_db()
-        enqueued_object_ids = get_enqueued_object_ids()
-
-        new_job_count = 0
+    connect_db()
 
+    if not object_ids:
+        # Select the candidates first, so that only the part of the
+        # workflow concerning them needs to be locked
         with scoped_session() as db:
-            object_query = (
-                db.query(MuseumObject)
-                .with_transformation(MuseumObject.filter_preservation_pending)
-                .yield_per(500)
+            object_ids = get_candidate_object_ids(
+                db, count=object_count,
+                exclude_object_ids=get_indexed_object_ids(), random=random
+            )
+        user_requested = False
+    else:
+        # Objects listed explicitly were requested by the user
+        user_requested = True
+
+    with lock_objects(object_ids):
+        # Check the objects again, as they may have been enqueued or
+        # frozen by someone else in the meantime
+        with scoped_session() as db:
+            new_object_ids = get_candidate_object_ids(
+                db, count=object_count,
+                exclude_object_ids=get_indexed_object_ids(),
+                object_ids=object_ids
             )
 
-            if object_ids:
-                object_query = object_query.filter(
-                    MuseumObject.id.in_(object_ids)
-                )
-
-            if random:
-                object_query = object_query.order_by(func.random())
+        jobs = enqueue_object_batch(
+            new_object_ids, batch_size=batch_size,
+            user_requested=user_requested
+        )
 
-            for museum_object in object_query:
-                if museum_object.id not in enqueued_object_ids:
-                    enqueue_object(museum_object.id)
-                    new_job_count += 1
-                    print(f"Enqueued download_object_{museum_object.id}")
+        for job in jobs:
+            print(f"Enqueued {job.id}")
 
-                if new_job_count >= object_count:
-                    break
+    new_job_count = len(jobs)
 
     print(f"{new_job_count} object(s) enqueued for download")
 
@@ -84,7 +223,8 @@ def enqueue_objects(object_count, object_ids=None, random=False):
 @click.option(
     "--random/--no-random", default=False,
     help=(
-        "Enqueue objects in random order. Should be only used for "
+        "Enqueue consecutive objects starting from a random object ID "
+        "instead of the lowest one. Should be only used for "
         "pre-production tests."
     )
 )
@@ -95,12 +235,17 @@ def enqueue_objects(object_count, object_ids=None, random=False):
         "objects will be enqueued."
     )
 )
-def cli(object_count, random, object_ids):
+@click.option(
+    "--batch-size", default=DEFAULT_BATCH_SIZE, type=click.IntRange(min=1),
+    help="How many jobs to submit to Redis at a time"
+)
+def cli(object_count, random, object_ids, batch_size):
     if object_ids:
         object_ids = [int(object_id) for object_id in object_ids.split(",")]
 
     enqueue_objects(
-        object_count=object_count, random=random, object_ids=object_ids
+        object_count=object_count, random=random, object_ids=object_ids,
+        batch_size=batch_size
     )
 
 
@@ -11,11 +11,14 @@ from passari_workflow.config import ARCHIVE_DIR, PACKAGE_DIR
 from passari_workflow.db import scoped_session
 from passari_workflow.db.connection import connect_db
 from passari_workflow.db.models import (FreezeSource, MuseumObject,
-                                               MuseumPackage)
+                                               MuseumPackage,
+                                               refresh_preservation_pending)
 from passari_workflow.exceptions import WorkflowJobRunningError
+from passari_workflow.stats import ObjectStat, update_stats
 from passari_workflow.queue.queues import (delete_jobs_for_object_id,
                                                   get_running_object_ids,
-                                                  lock_queues)
+                                                  lock_objects)
+from passari_workflow.queue.scheduling import release_disk_space
 
 
 def freeze_objects(object_ids, reason, source, delete_jobs=True):
@@ -29,7 +32,7 @@ def freeze_objects(object_ids, reason, source, delete_jobs=True):
     object_ids = [int(object_id) for object_id in object_ids]
     source = FreezeSource(source)
 
-    with lock_queues():
+    with lock_objects(object_ids):
         # Are there object IDs that we're about to freeze but that are
         # still running?
         running_object_ids = get_running_object_ids()
@@ -43,6 +46,14 @@ def freeze_objects(object_ids, reason, source, delete_jobs=True):
 
         connect_db()
         with scoped_session() as db:
+            newly_frozen_count = (
+                db.query(MuseumObject)
+                .filter(
+                    MuseumObject.id.in_(object_ids),
+                    MuseumObject.frozen == False
+                )
+                .count()
+            )
             freeze_count = (
                 db.query(MuseumObject)
                 .filter(MuseumObject.id.in_(object_ids))
@@ -52,6 +63,7 @@ def freeze_objects(object_ids, reason, source, delete_jobs=True):
                     MuseumObject.freeze_source: source
                 }, synchronize_session=False)
             )
+            refresh_preservation_pending(db, object_ids=object_ids)
 
             packages_to_cancel = list(
                 db.query(MuseumPackage)
@@ -92,6 +104,10 @@ def freeze_objects(object_ids, reason, source, delete_jobs=True):
                         # Directory does not exist
                         pass
 
+                    release_disk_space(object_id)
+
+        update_stats({ObjectStat.FROZEN: newly_frozen_count})
+
         return freeze_count, len(packages_to_cancel)
 
 
@@ -0,0 +1,61 @@
+"""
+List the distributed locks held by the workflow and release stale locks
+"""
+import logging
+
+import click
+
+from passari_workflow.redis.locks import (get_locks, get_stale_locks,
+                                          reset_lock)
+
+from ._base_command import BaseCommand
+
+LOG = logging.getLogger(__name__)
+
+
+def format_lock(lock):
+    ttl = f"expires in {lock.ttl} s" if lock.ttl is not None else "STALE"
+    return f"{lock.name}\towner={lock.owner_id}\t{ttl}"
+
+
+@click.command(cls=BaseCommand, help=(
+    "List the locks held by the workflow jobs and scripts.\n\n"
+    "Locks are renewed while they are held and expire otherwise. Locks "
+    "that never expire are stale and can be released using "
+    "'--reset-stale'."
+))
+@click.option(
+    "--stale", is_flag=True, default=False,
+    help="Only list stale locks that never expire"
+)
+@click.option(
+    "--reset", "reset_names", multiple=True,
+    help=(
+        "Forcibly release the lock with the given name, eg. "
+        "'lock-object-123'. Can be provided multiple times."
+    )
+)
+@click.option(
+    "--reset-stale", is_flag=True, default=False,
+    help="Forcibly release all stale locks"
+)
+def cli(stale, reset_names, reset_stale):
+    if reset_stale:
+        reset_names += tuple(lock.name for lock in get_stale_locks())
+
+    if reset_names:
+        for name in reset_names:
+            reset_lock(name)
+            LOG.info("Released lock %s", name)
+        return
+
+    locks = get_stale_locks() if stale else get_locks()
+
+    for lock in locks:
+        LOG.info(format_lock(lock))
+
+    LOG.info("%d lock(s)", len(locks))
+
+
+if __name__ == "__main__":
+    cli()
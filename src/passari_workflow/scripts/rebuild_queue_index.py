@@ -0,0 +1,32 @@
+"""
+Rebuild the object queue index from the current contents of the queues
+"""
+import logging
+
+import click
+
+from passari_workflow.queue.queues import (get_indexed_object_ids,
+                                           lock_queues,
+                                           rebuild_object_queue_index)
+
+from ._base_command import BaseCommand
+
+LOG = logging.getLogger(__name__)
+
+
+@click.command(cls=BaseCommand, help=(
+    "Rebuild the index of the current queue of each object.\n\n"
+    "The index is updated automatically as jobs are enqueued, finished "
+    "or failed. Run this if the index has become out of sync, for example "
+    "after jobs have been removed or requeued using the RQ command-line "
+    "tools."
+))
+def cli():
+    with lock_queues():
+        rebuild_object_queue_index()
+
+    LOG.info("%d object(s) in the workflow", len(get_indexed_object_ids()))
+
+
+if __name__ == "__main__":
+    cli()
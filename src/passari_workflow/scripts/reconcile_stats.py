@@ -0,0 +1,26 @@
+"""
+Reconcile the dashboard object counts with the database
+"""
+import logging
+
+import click
+
+from passari_workflow.db.connection import connect_db
+from passari_workflow.stats import reconcile_stats
+
+from ._base_command import BaseCommand
+
+LOG = logging.getLogger(__name__)
+
+
+@click.command(cls=BaseCommand)
+def cli():
+    connect_db()
+    counts = reconcile_stats()
+
+    for stat, count in counts.items():
+        LOG.info("%s: %d", stat.value, count)
+
+
+if __name__ == "__main__":
+    cli()
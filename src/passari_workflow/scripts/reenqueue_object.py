@@ -6,11 +6,11 @@ import click
 from passari_workflow.db import scoped_session
 from passari_workflow.db.connection import connect_db
 from passari_workflow.db.models import MuseumObject, MuseumPackage
-from passari_workflow.jobs.download_object import download_object
-from passari_workflow.queue.queues import (QueueType,
-                                                  get_enqueued_object_ids,
-                                                  get_queue,
-                                                  delete_jobs_for_object_id)
+from passari_workflow.queue.queues import (filter_enqueued_object_ids,
+                                                  delete_jobs_for_object_id,
+                                                  lock_objects)
+from passari_workflow.scripts.enqueue_objects import enqueue_object
+from passari_workflow.stats import ObjectStat, update_stats
 
 
 def reenqueue_object(object_id: int):
@@ -20,41 +20,40 @@ def reenqueue_object(object_id: int):
     object_id = int(object_id)
     connect_db()
 
-    queue = get_queue(QueueType.DOWNLOAD_OBJECT)
-
-    with scoped_session() as db:
-        museum_object = (
-            db.query(MuseumObject)
-            .join(
-                MuseumPackage,
-                MuseumObject.latest_package_id == MuseumPackage.id
+    with lock_objects([object_id]):
+        with scoped_session() as db:
+            museum_object = (
+                db.query(MuseumObject)
+                .join(
+                    MuseumPackage,
+                    MuseumObject.latest_package_id == MuseumPackage.id
+                )
+                .filter(MuseumObject.id == object_id)
+                .one()
             )
-            .filter(MuseumObject.id == object_id)
-            .one()
-        )
 
-        if museum_object.latest_package and \
-                not museum_object.latest_package.rejected:
-            raise ValueError(
-                f"Latest package {museum_object.latest_package.sip_filename} "
-                f"wasn't rejected"
-            )
+            if museum_object.latest_package and \
+                    not museum_object.latest_package.rejected:
+                raise ValueError(
+                    f"Latest package "
+                    f"{museum_object.latest_package.sip_filename} "
+                    f"wasn't rejected"
+                )
 
-        object_ids = get_enqueued_object_ids()
+            if filter_enqueued_object_ids([object_id]):
+                raise ValueError(
+                    f"Object is still in the workflow and can't be re-enqueued"
+                )
 
-        if object_id in object_ids:
-            raise ValueError(
-                f"Object is still in the workflow and can't be re-enqueued"
-            )
+            was_rejected = bool(museum_object.latest_package)
+            museum_object.latest_package = None
 
-        museum_object.latest_package = None
+            delete_jobs_for_object_id(object_id)
 
-        delete_jobs_for_object_id(object_id)
+            enqueue_object(object_id, user_requested=True)
 
-        queue.enqueue(
-            download_object, kwargs={"object_id": object_id},
-            job_id=f"download_object_{object_id}"
-        )
+    if was_rejected:
+        update_stats({ObjectStat.REJECTED: -1})
 
 
 @click.command()
@@ -11,19 +11,21 @@ import logging
 from collections import defaultdict
 
 import click
-from sqlalchemy.orm import load_only
-from sqlalchemy.sql.expression import bindparam
+from sqlalchemy import func, or_, select
 
 from passari.museumplus.connection import get_museum_session
 from passari.museumplus.search import iterate_multimedia
 from passari_workflow.db import scoped_session
 from passari_workflow.db.connection import connect_db
-from passari_workflow.db.models import MuseumAttachment, MuseumObject
-from passari_workflow.db.utils import bulk_create_or_get
+from passari_workflow.db.models import (MuseumAttachment, MuseumObject,
+                                        object_attachment_association_table,
+                                        refresh_preservation_pending)
+from passari_workflow.db.utils import (bulk_create_missing, bulk_upsert,
+                                       sync_association)
 from passari_workflow.heartbeat import HeartbeatSource, submit_heartbeat
-from passari_workflow.scripts.utils import (finish_sync_progress,
-                                                   get_sync_status,
-                                                   update_offset)
+from passari_workflow.scripts.utils import (add_dirty_object_ids,
+                                            finish_sync_progress,
+                                            get_sync_status, update_offset)
 
 from ._base_command import BaseCommand
 
@@ -33,6 +35,46 @@ LOG = logging.getLogger(__name__)
 CHUNK_SIZE = 500
 
 
+def update_object_modified_dates(db, attachment_ids):
+    """
+    Update the modification date of each MuseumObject linked to the given
+    attachments if the newest attachment has a more recent modification date
+    """
+    association = object_attachment_association_table
+
+    newest_dates = (
+        select([
+            association.c.museum_object_id,
+            func.max(MuseumAttachment.modified_date).label("modified_date")
+        ])
+        .select_from(
+            association.join(
+                MuseumAttachment,
+                MuseumAttachment.id == association.c.museum_attachment_id
+            )
+        )
+        .where(association.c.museum_attachment_id.in_(attachment_ids))
+        .group_by(association.c.museum_object_id)
+        .alias("newest_dates")
+    )
+
+    updated_object_ids = [
+        object_id for object_id, in db.execute(
+            MuseumObject.__table__.update()
+            .where(MuseumObject.id == newest_dates.c.museum_object_id)
+            .where(
+                or_(
+                    MuseumObject.modified_date == None,
+                    MuseumObject.modified_date < newest_dates.c.modified_date
+                )
+            )
+            .values(modified_date=newest_dates.c.modified_date)
+            .returning(MuseumObject.id)
+        )
+    ]
+    refresh_preservation_pending(db, object_ids=updated_object_ids)
+
+
 async def sync_attachments(offset=0, limit=None, save_progress=False):
     """
     Synchronize attachment metadata from MuseumPlus to determine which
@@ -83,56 +125,28 @@ async def sync_attachments(offset=0, limit=None, save_progress=False):
                 break
 
         attachments = {result["id"]: result for result in results}
-        attachment_ids = list(attachments.keys())
-
-        inserts, updates = 0, 0
 
         with scoped_session() as db:
-            existing_attachment_ids = set([
-                result.id for result in
-                db.query(MuseumAttachment).options(load_only("id"))
-                  .filter(MuseumAttachment.id.in_(attachment_ids))
-            ])
-
             attachment_id2object_id = defaultdict(set)
             object_ids = set()
 
-            update_params = []
+            entries = []
 
-            # Create existing objects, update the rest
             for result in attachments.values():
                 attachment_id = int(result["id"])
-                filename = result["filename"]
-                modified_date = result["modified_date"]
-                created_date = result["created_date"]
-                xml_hash = result["xml_hash"]
 
                 attachment_id2object_id[attachment_id].update(
                     result["object_ids"]
                 )
                 object_ids.update(result["object_ids"])
 
-                if attachment_id in existing_attachment_ids:
-                    # Update
-                    update_params.append({
-                        "_id": attachment_id,
-                        "_filename": filename,
-                        "_modified_date": modified_date,
-                        "_created_date": created_date,
-                        "_metadata_hash": xml_hash
-                    })
-                    updates += 1
-                else:
-                    # Create
-                    mus_attachment = MuseumAttachment(
-                        id=attachment_id,
-                        filename=filename,
-                        modified_date=modified_date,
-                        created_date=created_date,
-                        metadata_hash=xml_hash
-                    )
-                    db.add(mus_attachment)
-                    inserts += 1
+                entries.append({
+                    "id": attachment_id,
+                    "filename": result["filename"],
+                    "modified_date": result["modified_date"],
+                    "created_date": result["created_date"],
+                    "metadata_hash": result["xml_hash"]
+                })
 
                 processed += 1
 
@@ -140,51 +154,39 @@ async def sync_attachments(offset=0, limit=None, save_progress=False):
                     all_iterated = True
                     break
 
-            if update_params:
-                # Perform updates in bulk
-                stmt = (
-                    MuseumAttachment.__table__.update()
-                    .where(MuseumAttachment.id == bindparam("_id"))
-                    .values({
-                        "filename": bindparam("_filename"),
-                        "created_date": bindparam("_created_date"),
-                        "modified_date": bindparam("_modified_date"),
-                        "metadata_hash": bindparam("_metadata_hash")
-                    })
-                )
-                db.execute(stmt, update_params)
-
-            # Create/update MuseumObjects with references
-            # to the newly updated MuseumAttachments.
-            # For performance reasons update references for a batch
-            # of objects at once
-            attachments = (
-                db.query(MuseumAttachment)
-                .filter(MuseumAttachment.id.in_(attachment_ids))
-            )
-            objects = bulk_create_or_get(db, MuseumObject, object_ids)
-            objects_by_id = {
-                mus_object.id: mus_object for mus_object in objects
-            }
-
-            for attachment in attachments:
-                attachment.museum_objects = [
-                    objects_by_id[object_id] for object_id
-                    in attachment_id2object_id[attachment.id]
+            # Create new attachments and update existing ones in bulk
+            inserts, updates = bulk_upsert(
+                db, MuseumAttachment, entries,
+                update_fields=[
+                    "filename", "created_date", "modified_date",
+                    "metadata_hash"
                 ]
+            )
 
-                for museum_object in attachment.museum_objects:
-                    # Set the modification date of MuseumObject to the same
-                    # as the attachment's if it's newer.
-                    # This is because we want to know if the museum object OR
-                    # one of its attachments has been changed.
-                    object_date_needs_update = (
-                        not museum_object.modified_date
-                        or museum_object.modified_date < attachment.modified_date
-                    )
-
-                    if object_date_needs_update:
-                        museum_object.modified_date = attachment.modified_date
+            # Create placeholder MuseumObjects for objects that haven't been
+            # synchronized yet, and update the references for the entire
+            # batch of attachments at once
+            bulk_create_missing(db, MuseumObject, object_ids)
+            _, removed = sync_association(
+                db,
+                object_attachment_association_table.c.museum_attachment_id,
+                object_attachment_association_table.c.museum_object_id,
+                attachment_id2object_id
+            )
+
+            # Objects that are or were linked to the attachments need to
+            # have their attachment metadata hashes recalculated
+            add_dirty_object_ids(
+                object_ids | {object_id for _, object_id in removed}
+            )
+
+            # Set the modification date of MuseumObject to the same as the
+            # attachment's if it's newer.
+            # This is because we want to know if the museum object OR
+            # one of its attachments has been changed.
+            update_object_modified_dates(
+                db, attachment_ids=list(attachment_id2object_id.keys())
+            )
 
         results = []
 
@@ -4,17 +4,26 @@ to determine which objects need to be preserved again.
 """
 import hashlib
 import logging
-from collections import defaultdict
+import math
+import multiprocessing
+import sys
+from collections import defaultdict, namedtuple
 
 import click
+from sqlalchemy import BigInteger, any_, func, literal, select
+from sqlalchemy.dialects.postgresql import ARRAY, aggregate_order_by
 from sqlalchemy.orm import load_only
-from sqlalchemy.sql.expression import bindparam
+from sqlalchemy.sql.expression import bindparam, case
 
+from passari_workflow.config import CONFIG
 from passari_workflow.db import scoped_session
 from passari_workflow.db.connection import connect_db
 from passari_workflow.db.models import (MuseumAttachment, MuseumObject,
-                                               object_attachment_association_table)
+                                               object_attachment_association_table,
+                                               refresh_preservation_pending)
 from passari_workflow.heartbeat import HeartbeatSource, submit_heartbeat
+from passari_workflow.scripts.utils import (claim_dirty_object_ids,
+                                            finish_dirty_object_ids)
 
 from ._base_command import BaseCommand
 
@@ -23,8 +32,11 @@ LOG = logging.getLogger(__name__)
 # Process 2000 objects at a time
 CHUNK_SIZE = 2000
 
+HashSyncCounts = namedtuple("HashSyncCounts", ["total", "updated", "skipped"])
 
-def get_museum_objects_and_attachments(db, from_id=0, limit=500):
+
+def get_museum_objects_and_attachments(
+        db, from_id=0, limit=500, object_ids=None, to_id=None):
     """
     Get a list of MuseumObject and MuseumAttachment instances and an
     association map between the two.
@@ -35,17 +47,24 @@ def get_museum_objects_and_attachments(db, from_id=0, limit=500):
     :param db: SQLAlchemy instance
     :param int from_id: Retrieve objects with higher IDs than this
     :param int limit: How many objects to retrieve at most
+    :param object_ids: Optional collection of object IDs. If provided,
+                       only objects with these IDs are retrieved.
+    :param int to_id: Optional highest object ID to retrieve
 
     :returns: List of (museum_object, museum_attachments) tuples
     """
     # Retrieve objects
-    objects = list(
+    query = (
         db.query(MuseumObject)
         .options(load_only("id", "metadata_hash", "attachment_metadata_hash"))
         .filter(MuseumObject.id > from_id)
-        .order_by(MuseumObject.id)
-        .limit(limit)
     )
+    if object_ids is not None:
+        query = query.filter(MuseumObject.id.in_(object_ids))
+    if to_id is not None:
+        query = query.filter(MuseumObject.id <= to_id)
+
+    objects = list(query.order_by(MuseumObject.id).limit(limit))
     object_ids = [obj.id for obj in objects]
 
     # Retrieve object -> attachment associations
@@ -85,15 +104,33 @@ def get_museum_objects_and_attachments(db, from_id=0, limit=500):
     return results
 
 
-def iterate_museum_objects_and_attachments(db):
+def iterate_museum_objects_and_attachments(
+        db, object_ids=None, from_id=0, to_id=None):
     """
     Iterate MuseumObjects and related MuseumAttachment instances
     from start to end
+
+    :param object_ids: Optional sorted list of object IDs. If provided,
+                       only objects with these IDs are iterated.
+    :param int from_id: Iterate objects with higher IDs than this
+    :param int to_id: Optional highest object ID to iterate
     """
-    current_id = 0
+    if object_ids is not None:
+        # Query the given objects a chunk at a time to keep the queries
+        # reasonably sized
+        for i in range(0, len(object_ids), CHUNK_SIZE):
+            chunk_ids = object_ids[i:i+CHUNK_SIZE]
+            yield from get_museum_objects_and_attachments(
+                db=db, from_id=chunk_ids[0] - 1, limit=CHUNK_SIZE,
+                object_ids=chunk_ids
+            )
+
+        return
+
+    current_id = from_id
     while True:
         results = get_museum_objects_and_attachments(
-            db=db, from_id=current_id, limit=CHUNK_SIZE
+            db=db, from_id=current_id, limit=CHUNK_SIZE, to_id=to_id
         )
         if results:
             for result in results:
@@ -119,94 +156,353 @@ def get_metadata_hash_for_attachments(attachments):
     return hashlib.sha256(data).hexdigest()
 
 
-def sync_hashes():
+def update_hashes_python(db, object_ids=None, from_id=0, to_id=None):
     """
-    Update object entries with latest metadata hashes to determine which
-    objects have been changed. This is done after 'sync_objects' and
-    'sync_attachments'.
+    Calculate the attachment metadata hashes in Python and update the objects
+    whose hashes have changed
+
+    :param db: SQLAlchemy session
+    :param object_ids: Optional sorted list of object IDs to process.
+                       If not provided, all objects are processed.
+    :param int from_id: Process objects with higher IDs than this
+    :param int to_id: Optional highest object ID to process
+
+    :returns: HashSyncCounts instance
     """
     updated = 0
     skipped = 0
     total = 0
 
-    with scoped_session() as db:
-        query = iterate_museum_objects_and_attachments(db)
-
-        all_iterated = False
-
-        while True:
-            results = []
-            for i in range(0, CHUNK_SIZE):
-                try:
-                    results.append(next(query))
-                except StopIteration:
-                    all_iterated = True
-                    break
-
-            update_params = []
-
-            for museum_object, museum_attachments in results:
-                total += 1
-
-                # Calculate the attachment metadata hash
-                if museum_attachments:
-                    # Don't calculate the hash if some attachments are
-                    # incomplete
-                    metadata_incomplete = any(
-                        attach.metadata_hash is None
-                        for attach in museum_attachments
-                    )
-
-                    if metadata_incomplete:
-                        skipped += 1
-                        continue
-
-                    attachment_metadata_hash = get_metadata_hash_for_attachments(
-                        museum_attachments
-                    )
-                else:
-                    attachment_metadata_hash = ""
-
-                if museum_object.attachment_metadata_hash \
-                        == attachment_metadata_hash:
-                    # Attachment hash hasn't changed, no need to update
-                    continue
+    query = iterate_museum_objects_and_attachments(
+        db, object_ids=object_ids, from_id=from_id, to_id=to_id
+    )
 
-                updated += 1
+    all_iterated = False
 
-                update_params.append({
-                    "_id": museum_object.id,
-                    "_attachment_metadata_hash": attachment_metadata_hash
-                })
+    while True:
+        results = []
+        for i in range(0, CHUNK_SIZE):
+            try:
+                results.append(next(query))
+            except StopIteration:
+                all_iterated = True
+                break
+
+        update_params = []
+
+        for museum_object, museum_attachments in results:
+            total += 1
 
-            if update_params:
-                update_stmt = (
-                    MuseumObject.__table__.update()
-                    .where(MuseumObject.id == bindparam("_id"))
-                    .values({
-                        "attachment_metadata_hash":
-                            bindparam("_attachment_metadata_hash")
-                    })
+            # Calculate the attachment metadata hash
+            if museum_attachments:
+                # Don't calculate the hash if some attachments are
+                # incomplete
+                metadata_incomplete = any(
+                    attach.metadata_hash is None
+                    for attach in museum_attachments
                 )
-                db.execute(update_stmt, update_params)
 
-            LOG.info(
-                "%s iterated, %s updated and %s skipped so far",
-                total,
-                updated,
-                skipped,
+                if metadata_incomplete:
+                    skipped += 1
+                    continue
+
+                attachment_metadata_hash = get_metadata_hash_for_attachments(
+                    museum_attachments
+                )
+            else:
+                attachment_metadata_hash = ""
+
+            if museum_object.attachment_metadata_hash \
+                    == attachment_metadata_hash:
+                # Attachment hash hasn't changed, no need to update
+                continue
+
+            updated += 1
+
+            update_params.append({
+                "_id": museum_object.id,
+                "_attachment_metadata_hash": attachment_metadata_hash
+            })
+
+        if update_params:
+            update_stmt = (
+                MuseumObject.__table__.update()
+                .where(MuseumObject.id == bindparam("_id"))
+                .values({
+                    "attachment_metadata_hash":
+                        bindparam("_attachment_metadata_hash")
+                })
+            )
+            db.execute(update_stmt, update_params)
+            refresh_preservation_pending(
+                db, object_ids=[params["_id"] for params in update_params]
             )
 
-            if all_iterated:
-                break
+        LOG.info(
+            "%s iterated, %s updated and %s skipped so far",
+            total,
+            updated,
+            skipped,
+        )
+
+        if all_iterated:
+            break
+
+    return HashSyncCounts(total=total, updated=updated, skipped=skipped)
+
+
+def get_object_id_ranges(db, count):
+    """
+    Split the object IDs into contiguous ranges containing roughly the same
+    amount of objects
+
+    :param db: SQLAlchemy session
+    :param int count: How many ranges to create at most
+
+    :returns: List of (first_id, last_id) tuples
+    """
+    bucket = func.ntile(count).over(order_by=MuseumObject.id)
+    buckets = db.query(
+        MuseumObject.id.label("object_id"), bucket.label("bucket")
+    ).subquery()
+
+    return [
+        (first_id, last_id) for first_id, last_id in
+        db.query(func.min(buckets.c.object_id), func.max(buckets.c.object_id))
+        .group_by(buckets.c.bucket)
+        .order_by(func.min(buckets.c.object_id))
+    ]
+
+
+def _init_worker(db_config, log_level):
+    """
+    Initialize a worker process spawned by :func:`update_hashes_parallel`
+    """
+    logging.basicConfig(stream=sys.stdout, format="%(message)s")
+    LOG.setLevel(log_level)
+
+    CONFIG["db"].update(db_config)
+    connect_db()
+
+
+def _update_hashes_shard(shard):
+    with scoped_session() as db:
+        return update_hashes_python(db, **shard)
+
+
+def update_hashes_parallel(workers, object_ids=None):
+    """
+    Calculate the attachment metadata hashes in Python using multiple worker
+    processes, each processing a separate range of objects with its own
+    database connection
+
+    :param int workers: Amount of worker processes
+    :param object_ids: Optional sorted list of object IDs to process.
+                       If not provided, all objects are processed.
+
+    :returns: HashSyncCounts instance with the sums of each worker's counts
+    """
+    if object_ids is not None:
+        shard_size = max(math.ceil(len(object_ids) / workers), 1)
+        shards = [
+            {"object_ids": object_ids[i:i+shard_size]}
+            for i in range(0, len(object_ids), shard_size)
+        ]
+    else:
+        with scoped_session() as db:
+            shards = [
+                {"from_id": first_id - 1, "to_id": last_id}
+                for first_id, last_id in get_object_id_ranges(db, workers)
+            ]
+
+    LOG.info("Processing %d ranges using %d workers", len(shards), workers)
+
+    # Spawn the workers instead of forking, as the database connections
+    # can't be shared with the parent process
+    context = multiprocessing.get_context("spawn")
+    with context.Pool(
+            processes=workers, initializer=_init_worker,
+            initargs=(dict(CONFIG["db"]), LOG.getEffectiveLevel())) as pool:
+        results = pool.map(_update_hashes_shard, shards)
+
+    return HashSyncCounts(
+        total=sum(result.total for result in results),
+        updated=sum(result.updated for result in results),
+        skipped=sum(result.skipped for result in results)
+    )
+
+
+def update_hashes_sql(db, object_ids=None):
+    """
+    Calculate the attachment metadata hashes and update the objects whose
+    hashes have changed using a single UPDATE statement.
+
+    The hashes are identical to the ones calculated by
+    :func:`get_metadata_hash_for_attachments`: the attachment hashes are
+    sorted in code point order, concatenated and hashed using SHA-256.
+    Objects with incomplete attachments are skipped.
+
+    :param db: SQLAlchemy session
+    :param object_ids: Optional sorted list of object IDs to process.
+                       If not provided, all objects are processed.
+
+    :returns: Number of updated objects
+    """
+    object_table = MuseumObject.__table__
+    attachment_table = MuseumAttachment.__table__
+    assoc_table = object_attachment_association_table
+
+    # Concatenate the attachment hashes in byte order, which is equivalent
+    # to sorting the strings in Python
+    concatenated_hashes = func.string_agg(
+        attachment_table.c.metadata_hash,
+        aggregate_order_by(
+            literal(""), attachment_table.c.metadata_hash.collate("C")
+        )
+    )
+    # pgcrypto's digest() is used instead of sha256() since the latter
+    # requires PostgreSQL 11
+    attachment_metadata_hash = case(
+        [(func.count(attachment_table.c.id) == 0, literal(""))],
+        else_=func.encode(
+            func.digest(
+                func.convert_to(concatenated_hashes, "UTF8"), "sha256"
+            ),
+            "hex"
+        )
+    )
+
+    new_hashes = (
+        select([
+            object_table.c.id.label("object_id"),
+            attachment_metadata_hash.label("attachment_metadata_hash")
+        ])
+        .select_from(
+            object_table
+            .outerjoin(
+                assoc_table,
+                assoc_table.c.museum_object_id == object_table.c.id
+            )
+            .outerjoin(
+                attachment_table,
+                attachment_table.c.id == assoc_table.c.museum_attachment_id
+            )
+        )
+        .group_by(object_table.c.id)
+        # Skip objects with attachments that don't have metadata hashes yet
+        .having(
+            func.count(attachment_table.c.id)
+            == func.count(attachment_table.c.metadata_hash)
+        )
+    )
+
+    if object_ids is not None:
+        new_hashes = new_hashes.where(
+            object_table.c.id == any_(
+                literal(object_ids, type_=ARRAY(BigInteger))
+            )
+        )
+
+    new_hashes = new_hashes.alias("new_hashes")
+
+    update_stmt = (
+        object_table.update()
+        .values(
+            attachment_metadata_hash=new_hashes.c.attachment_metadata_hash
+        )
+        .where(object_table.c.id == new_hashes.c.object_id)
+        .where(
+            object_table.c.attachment_metadata_hash.is_distinct_from(
+                new_hashes.c.attachment_metadata_hash
+            )
+        )
+        .returning(object_table.c.id)
+    )
+
+    updated_object_ids = [
+        object_id for object_id, in db.execute(update_stmt)
+    ]
+    refresh_preservation_pending(db, object_ids=updated_object_ids)
+
+    return len(updated_object_ids)
+
+
+def sync_hashes(incremental=False, engine="python", workers=1):
+    """
+    Update object entries with latest metadata hashes to determine which
+    objects have been changed. This is done after 'sync_objects' and
+    'sync_attachments'.
+
+    :param bool incremental: If True, only process the objects marked as
+                             dirty by 'sync_objects' and 'sync_attachments'
+                             since the last run. Otherwise, process all
+                             objects.
+    :param str engine: Where to calculate the hashes, either 'python'
+                       or 'sql'
+    :param int workers: Amount of worker processes to use with the 'python'
+                        engine
+    """
+    # Claim the dirty object IDs even when processing all objects, as a full
+    # run covers them as well
+    object_ids = claim_dirty_object_ids()
+
+    if incremental:
+        LOG.info("%d dirty objects to process", len(object_ids))
+    else:
+        object_ids = None
+
+    if engine == "sql":
+        with scoped_session() as db:
+            updated = update_hashes_sql(db, object_ids=object_ids)
+
+        LOG.info("Finished, %s updated", updated)
+    else:
+        if workers > 1:
+            counts = update_hashes_parallel(
+                workers=workers, object_ids=object_ids
+            )
+        else:
+            with scoped_session() as db:
+                counts = update_hashes_python(db, object_ids=object_ids)
+
+        LOG.info(
+            "Finished, %s iterated, %s updated and %s skipped",
+            counts.total, counts.updated, counts.skipped
+        )
+
+    # All claimed objects were processed and committed
+    finish_dirty_object_ids()
 
     submit_heartbeat(HeartbeatSource.SYNC_HASHES)
 
 
 @click.command(cls=BaseCommand)
-def cli():
+@click.option(
+    "--incremental/--no-incremental", default=False,
+    help=(
+        "Only process objects that have been changed by 'sync-objects' or "
+        "'sync-attachments' since the last run"
+    )
+)
+@click.option(
+    "--engine", type=click.Choice(["python", "sql"]), default="python",
+    help=(
+        "Calculate the hashes in Python or in the database using a single "
+        "SQL statement"
+    )
+)
+@click.option(
+    "--workers", type=click.IntRange(min=1), default=1,
+    help="Amount of worker processes to use with the 'python' engine"
+)
+def cli(incremental, engine, workers):
+    if engine == "sql" and workers > 1:
+        raise click.UsageError(
+            "--workers can only be used with the 'python' engine"
+        )
+
     connect_db()
-    sync_hashes()
+    sync_hashes(incremental=incremental, engine=engine, workers=workers)
 
 
 if __name__ == "__main__":
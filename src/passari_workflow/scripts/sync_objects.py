@@ -6,23 +6,24 @@ Missing objects are added and existing objects' metadata hashes are updated
 
 import asyncio
 import logging
-from collections import defaultdict
+import threading
+from collections import defaultdict, deque
+from concurrent.futures import ThreadPoolExecutor
 
 import click
-from sqlalchemy import and_, or_
-from sqlalchemy.orm import load_only
-from sqlalchemy.sql.expression import bindparam
-
 from passari.museumplus.connection import get_museum_session
 from passari.museumplus.search import iterate_objects
 from passari_workflow.db import scoped_session
 from passari_workflow.db.connection import connect_db
-from passari_workflow.db.models import MuseumAttachment, MuseumObject
-from passari_workflow.db.utils import bulk_create_or_get
+from passari_workflow.db.models import (MuseumAttachment, MuseumObject,
+                                        object_attachment_association_table,
+                                        refresh_preservation_pending)
+from passari_workflow.db.utils import (bulk_create_missing, bulk_upsert,
+                                       sync_association)
 from passari_workflow.heartbeat import HeartbeatSource, submit_heartbeat
-from passari_workflow.scripts.utils import (finish_sync_progress,
-                                                   get_sync_status,
-                                                   update_offset)
+from passari_workflow.scripts.utils import (add_dirty_object_ids,
+                                            finish_sync_progress,
+                                            get_sync_status, update_offset)
 
 from ._base_command import BaseCommand
 
@@ -31,6 +32,72 @@ LOG = logging.getLogger(__name__)
 # How many objects to retrieve at a time before updating the database
 CHUNK_SIZE = 500
 
+# How many retrieved chunks can be waiting to be written into the database
+# before retrieving more objects from MuseumPlus
+MAX_PENDING_CHUNKS = 2
+
+
+def update_objects(results):
+    """
+    Create or update the given chunk of objects retrieved from MuseumPlus
+    in the database
+
+    :param list results: List of object results from MuseumPlus
+    :returns: (inserts, updates) tuple
+    """
+    objects = {result["id"]: result for result in results}
+
+    # Attachments may have changed for any of the objects, meaning
+    # the attachment metadata hashes need to be recalculated
+    add_dirty_object_ids(objects.keys())
+
+    with scoped_session() as db:
+        object_id2attachment_id = defaultdict(set)
+        attachment_ids = set()
+
+        entries = []
+
+        for result in objects.values():
+            object_id = int(result["id"])
+            multimedia_ids = result["multimedia_ids"]
+
+            object_id2attachment_id[object_id].update(multimedia_ids)
+            attachment_ids.update(multimedia_ids)
+
+            entries.append({
+                "id": object_id,
+                "title": result["title"],
+                "modified_date": result["modified_date"],
+                "created_date": result["created_date"],
+                "metadata_hash": result["xml_hash"]
+            })
+
+        # Create new objects and update existing ones in bulk. The creation
+        # date is only set for new objects, and the modification date is
+        # only updated if it's newer; it might have been set from a newer
+        # attachment by 'sync_attachments'.
+        inserts, updates = bulk_upsert(
+            db, MuseumObject, entries,
+            update_fields=["title", "metadata_hash"],
+            increasing_fields=["modified_date"]
+        )
+        refresh_preservation_pending(
+            db, object_ids=[entry["id"] for entry in entries]
+        )
+
+        # Create placeholder MuseumAttachments for attachments that
+        # haven't been synchronized yet, and update the references for
+        # the entire batch of objects at once
+        bulk_create_missing(db, MuseumAttachment, attachment_ids)
+        sync_association(
+            db,
+            object_attachment_association_table.c.museum_object_id,
+            object_attachment_association_table.c.museum_attachment_id,
+            object_id2attachment_id
+        )
+
+    return inserts, updates
+
 
 async def sync_objects(offset=0, limit=None, save_progress=False):
     """
@@ -38,6 +105,9 @@ async def sync_objects(offset=0, limit=None, save_progress=False):
     objects have changed and need to be updated in the DPRES service. This
     is followed by 'sync_hashes'.
 
+    Objects are retrieved from MuseumPlus while the previously retrieved
+    chunks are still being written to the database in a separate thread.
+
     :param int offset: Offset to start synchronizing from
     :param int limit: How many objects to sync before stopping.
         Default is None, meaning all available objects are synchronized.
@@ -66,148 +136,77 @@ async def sync_objects(offset=0, limit=None, save_progress=False):
     index = offset
     processed = 0
 
-    while True:
-        results = []
-
-        all_iterated = True
-        async for result in object_iter:
-            all_iterated = False
-            results.append(result)
-            index += 1
-
-            if len(results) >= CHUNK_SIZE:
-                break
-
-        objects = {result["id"]: result for result in results}
-        object_ids = list(objects.keys())
-
-        inserts, updates = 0, 0
-
-        with scoped_session() as db:
-            existing_object_ids = set([
-                result.id for result in
-                db.query(MuseumObject).options(load_only("id"))
-                  .filter(MuseumObject.id.in_(object_ids))
-            ])
-
-            object_id2attachment_id = defaultdict(set)
-            attachment_ids = set()
-
-            update_params = []
-
-            # Create existing objects, update the rest
-            for result in objects.values():
-                object_id = int(result["id"])
-                title = result["title"]
-                modified_date = result["modified_date"]
-                created_date = result["created_date"]
-                multimedia_ids = result["multimedia_ids"]
-                xml_hash = result["xml_hash"]
-
-                object_id2attachment_id[object_id].update(multimedia_ids)
-                attachment_ids.update(multimedia_ids)
-
-                if object_id in existing_object_ids:
-                    # Don't run the update query instantly; instead,
-                    # set the parameters and run them all together later
-                    # in bulk
-                    update_params.append({
-                        "_id": object_id,
-                        "_title": title,
-                        "_modified_date": modified_date,
-                        "_metadata_hash": xml_hash
-                    })
-                    updates += 1
-                else:
-                    # Create
-                    mus_object = MuseumObject(
-                        id=object_id,
-                        title=title,
-                        modified_date=modified_date,
-                        created_date=created_date,
-                        metadata_hash=xml_hash
-                    )
-                    db.add(mus_object)
-                    inserts += 1
+    # Chunks are written using a single thread to ensure they're committed
+    # in the same order they were retrieved. This ensures the saved offset
+    # only moves forward once every chunk before it has been committed.
+    executor = ThreadPoolExecutor(max_workers=1)
+    pending_writes = deque()
+    write_failed = threading.Event()
+
+    def write_chunk(results, index):
+        if write_failed.is_set():
+            # An earlier chunk failed; don't save progress past it
+            return
+
+        try:
+            inserts, updates = update_objects(results)
+
+            LOG.info(
+                "Updated, %s inserts, %s updates. Updating from offset: %s",
+                inserts,
+                updates,
+                index,
+            )
+
+            # Submit heartbeat after each successful iteration instead of
+            # once at the end. This is because this script is designed to be
+            # stopped before it has finished iterating everything.
+            submit_heartbeat(HeartbeatSource.SYNC_OBJECTS)
 
+            if save_progress:
+                update_offset("sync_objects", offset=index)
+        except BaseException:
+            write_failed.set()
+            raise
+
+    try:
+        while not all_iterated:
+            results = []
+
+            all_iterated = True
+            async for result in object_iter:
+                all_iterated = False
+                results.append(result)
+                index += 1
                 processed += 1
 
                 if limit is not None and processed == limit:
                     all_iterated = True
                     break
 
-            if update_params:
-                # Perform updates in bulk
-                stmt_a = (
-                    MuseumObject.__table__.update()
-                    .where(MuseumObject.id == bindparam("_id"))
-                    .values({
-                        "title": bindparam("_title"),
-                        "metadata_hash": bindparam("_metadata_hash")
-                    })
-                )
-                stmt_b = (
-                    MuseumObject.__table__.update()
-                    .where(
-                        and_(
-                            MuseumObject.id == bindparam("_id"),
-                            or_(
-                                MuseumObject.modified_date == None,
-                                MuseumObject.modified_date
-                                < bindparam("_modified_date")
-                            )
-                        )
-                    )
-                    .values({
-                        "modified_date": bindparam("_modified_date")
-                    })
-                )
-                db.execute(stmt_a, update_params)
-                db.execute(stmt_b, update_params)
-
-            # Create/update MuseumAttachments with references
-            # to the newly updated MuseumObjects.
-            # For performance reasons update references for a batch
-            # of objects at once
-            objects = (
-                db.query(MuseumObject)
-                .filter(MuseumObject.id.in_(object_ids))
-            )
-            attachments = bulk_create_or_get(
-                db, MuseumAttachment, attachment_ids
-            )
-            attachments_by_id = {
-                attachment.id: attachment for attachment in attachments
-            }
-
-            for museum_object in objects:
-                museum_object.attachments = [
-                    attachments_by_id[attachment_id] for attachment_id
-                    in object_id2attachment_id[museum_object.id]
-                ]
-
-        results = []
-
-        LOG.info(
-            "Updated, %s inserts, %s updates. Updating from offset: %s",
-            inserts,
-            updates,
-            index,
-        )
+                if len(results) >= CHUNK_SIZE:
+                    break
 
-        # Submit heartbeat after each successful iteration instead of once
-        # at the end. This is because this script is designed to be stopped
-        # before it has finished iterating everything.
-        submit_heartbeat(HeartbeatSource.SYNC_OBJECTS)
+            # Wait for the oldest write to finish if too many chunks
+            # are already waiting to be written
+            while len(pending_writes) >= MAX_PENDING_CHUNKS:
+                await asyncio.wrap_future(pending_writes.popleft())
 
-        if save_progress:
-            update_offset("sync_objects", offset=index)
+            pending_writes.append(
+                executor.submit(write_chunk, results, index)
+            )
+    finally:
+        # Finish writing the chunks that were already retrieved, even if
+        # the iteration was interrupted. This ensures the progress made
+        # so far is saved.
+        executor.shutdown(wait=True)
 
-        if all_iterated:
-            if save_progress:
-                finish_sync_progress("sync_objects")
+    for future in pending_writes:
+        # Raise the exception if any of the remaining writes failed
+        future.result()
 
-            break
+    if save_progress:
+        finish_sync_progress("sync_objects")
 
     await museum_session.close()
 
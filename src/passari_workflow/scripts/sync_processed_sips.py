@@ -6,26 +6,46 @@ import datetime
 import logging
 import os
 import os.path
+import threading
 from collections import OrderedDict, namedtuple
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 
 import click
-from sqlalchemy.sql import and_, or_, select
+from sqlalchemy.sql import select
 
 from passari.dpres.package import MuseumObjectPackage
 from passari.dpres.ssh import connect_dpres_sftp
 from passari_workflow.config import PACKAGE_DIR
 from passari_workflow.db import scoped_session
 from passari_workflow.db.connection import connect_db
-from passari_workflow.db.models import MuseumObject, MuseumPackage
+from passari_workflow.db.models import MuseumPackage
 from passari_workflow.heartbeat import HeartbeatSource, submit_heartbeat
 from passari_workflow.jobs.confirm_sip import confirm_sip
-from passari_workflow.queue.queues import QueueType, get_queue
+from passari_workflow.queue.queues import QueueType, WorkflowQueue, get_queue
+from passari_workflow.scripts.utils import (get_crawl_state,
+                                            update_crawl_state)
+from passari_workflow.stats import ObjectStat, update_stats
 
 from ._base_command import BaseCommand
 
 LOG = logging.getLogger(__name__)
 
+# How many SFTP channels to use for crawling the directories and downloading
+# the ingest reports by default
+DEFAULT_SFTP_WORKERS = 8
+
+# How many processed SIPs to update per database transaction
+DEFAULT_CHUNK_SIZE = 100
+
+# Date directories older than this many days don't receive new reports
+# anymore, so they are not listed again if they haven't changed since the
+# last run
+IMMUTABLE_DIR_DAYS = 2
+
+# Name of the SyncStatus entry containing the crawl state
+SYNC_STATUS_NAME = "sync_processed_sips"
+
 SIPResult = namedtuple(
     "SIPResult",
     [
@@ -35,6 +55,55 @@ SIPResult = namedtuple(
 )
 
 
+class SFTPClientPool:
+    """
+    Pool of SFTP clients sharing the SSH connection of an existing client.
+
+    Each thread gets its own client with a separate SFTP channel, allowing
+    the threads to perform requests concurrently. SFTP clients themselves
+    are not thread-safe.
+    """
+    def __init__(self, sftp):
+        self.transport = sftp.get_channel().get_transport()
+        self.client_cls = type(sftp)
+
+        self._local = threading.local()
+        self._clients = []
+        self._lock = threading.Lock()
+
+    def get_client(self):
+        """
+        Get the SFTP client of the current thread
+        """
+        client = getattr(self._local, "client", None)
+
+        if client is None:
+            client = self.client_cls.from_transport(self.transport)
+            self._local.client = client
+
+            with self._lock:
+                self._clients.append(client)
+
+        return client
+
+    def close(self):
+        """
+        Close the SFTP channels opened by the pool. The SSH connection is
+        left open.
+        """
+        with self._lock:
+            for client in self._clients:
+                client.close()
+
+            self._clients = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
 def sftp_rmtree(sftp, path):
     """
     Recursive version of rmdir that deletes all files and subdirectories from
@@ -54,89 +123,211 @@ def sftp_rmtree(sftp, path):
     sftp.rmdir(str(path))
 
 
-def update_sip(sip, sftp, queue):
+def get_report_transfers(sip, object_id):
     """
-    Update a single SIP by downloading its ingest reports and enqueing the
-    final task to confirm it
+    Get the ingest reports to download for a single SIP
+
+    :returns: List of (remote_path, temp_path, report_path) tuples
     """
-    with scoped_session() as db:
-        db_museum_package = (
-            db.query(MuseumPackage).join(
-                MuseumObject, MuseumObject.id == MuseumPackage.museum_object_id
-            ).filter(
-                and_(
-                    MuseumPackage.sip_filename == sip.sip_filename,
-                    MuseumPackage.preserved == False,
-                    MuseumPackage.rejected == False
-                )
-            ).one_or_none()
-        )
+    package_dir = Path(PACKAGE_DIR) / str(object_id)
+    museum_package = MuseumObjectPackage.from_path_sync(package_dir)
+
+    xml_temp_path = museum_package.log_dir / "ingest-report.xml.download"
+    xml_report_path = museum_package.log_dir / "ingest-report.xml"
+
+    # HTML report also exists with the same path and name, but different
+    # suffix
+    html_remote_path = sip.report_path.with_suffix(".html")
+
+    html_temp_path = museum_package.log_dir / "ingest-report.html.download"
+    html_report_path = museum_package.log_dir / "ingest-report.html"
 
-        if not db_museum_package:
-            return
+    return [
+        (sip.report_path, xml_temp_path, xml_report_path),
+        (html_remote_path, html_temp_path, html_report_path)
+    ]
 
-        if sip.status == "accepted":
-            # Package was accepted
-            db_museum_package.preserved = True
-        elif sip.status == "rejected":
-            db_museum_package.rejected = True
 
-        object_id = db_museum_package.museum_object.id
-        package_dir = Path(PACKAGE_DIR) / str(object_id)
-        museum_package = MuseumObjectPackage.from_path_sync(package_dir)
+def fetch_report(sftp, remote_path, temp_path, report_path):
+    """
+    Download an ingest report to the log directory. The report is
+    downloaded to a temporary file first, so that an incomplete download
+    is never mistaken for the report.
+    """
+    sftp.get(str(remote_path), str(temp_path))
+    os.rename(temp_path, report_path)
 
-        xml_temp_path = museum_package.log_dir / "ingest-report.xml.download"
-        xml_report_path = museum_package.log_dir / "ingest-report.xml"
 
-        # HTML report also exists with the same path and name, but different
-        # suffix
-        html_remote_path = sip.report_path.with_suffix(".html")
+def finish_sip(sip, sftp, object_id):
+    """
+    Clean up the rejected SIP and write the status for the 'confirm_sip'
+    task once the ingest reports have been downloaded
+    """
+    package_dir = Path(PACKAGE_DIR) / str(object_id)
 
-        html_temp_path = museum_package.log_dir / "ingest-report.html.download"
-        html_report_path = museum_package.log_dir / "ingest-report.html"
+    # Remove the directory containing the rejected SIP so that the DPRES
+    # service does not store the package unnecessarily
+    if sip.status == "rejected":
+        sftp_rmtree(sftp, sip.transfer_path)
+
+    # Write the status for use by the 'confirm_sip' task
+    (package_dir / f"{sip.sip_filename}.status").write_text(sip.status)
 
-        # Download ingest report to the log directory
-        sftp.get(
-            str(sip.report_path),
-            str(xml_temp_path)
-        )
-        os.rename(xml_temp_path, xml_report_path)
 
-        sftp.get(
-            str(html_remote_path),
-            str(html_temp_path)
+def get_unconfirmed_packages(sip_filenames):
+    """
+    Get the packages with the given SIP filenames that haven't been marked
+    as preserved or rejected yet
+
+    :returns: {sip_filename: (package_id, object_id, sip_id)} dict
+    """
+    with scoped_session() as db:
+        query = (
+            select([
+                MuseumPackage.sip_filename, MuseumPackage.id,
+                MuseumPackage.museum_object_id, MuseumPackage.sip_id
+            ])
+            .where(MuseumPackage.sip_filename.in_(sip_filenames))
+            .where(MuseumPackage.preserved == False)
+            .where(MuseumPackage.rejected == False)
         )
-        os.rename(html_temp_path, html_report_path)
-
-        # Remove the directory containing the rejected SIP so that the DPRES
-        # service does not store the package unnecessarily
-        if sip.status == "rejected":
-            sftp_rmtree(sftp, sip.transfer_path)
-
-        # Write the status for use by the 'confirm_sip' task
-        (package_dir / f"{sip.sip_filename}.status").write_text(sip.status)
-
-        # Enqueue the final task
-        queue.enqueue(
-            confirm_sip,
-            kwargs={
-                "object_id": object_id, "sip_id": db_museum_package.sip_id
-            },
-            job_id=f"confirm_sip_{object_id}"
+
+        return {
+            sip_filename: (package_id, object_id, sip_id)
+            for sip_filename, package_id, object_id, sip_id
+            in db.execute(query)
+        }
+
+
+def confirm_processed_sips(processed, queue):
+    """
+    Mark the packages of processed SIPs as preserved or rejected and
+    enqueue the final task to confirm them
+
+    :param processed: List of (SIPResult, (package_id, object_id, sip_id))
+                      tuples
+    """
+    package_ids = {"accepted": [], "rejected": []}
+    job_datas = []
+
+    for sip, (package_id, object_id, sip_id) in processed:
+        package_ids[sip.status].append(package_id)
+        job_datas.append(
+            WorkflowQueue.prepare_data(
+                confirm_sip,
+                kwargs={"object_id": object_id, "sip_id": sip_id},
+                job_id=f"confirm_sip_{object_id}"
+            )
         )
 
+    with scoped_session() as db:
+        if package_ids["accepted"]:
+            db.query(MuseumPackage).filter(
+                MuseumPackage.id.in_(package_ids["accepted"])
+            ).update(
+                {MuseumPackage.preserved: True}, synchronize_session=False
+            )
+        if package_ids["rejected"]:
+            db.query(MuseumPackage).filter(
+                MuseumPackage.id.in_(package_ids["rejected"])
+            ).update(
+                {MuseumPackage.rejected: True}, synchronize_session=False
+            )
+
+        # Enqueue the final tasks
+        with queue.connection.pipeline() as pipe:
+            queue.enqueue_many(job_datas, pipeline=pipe)
+            pipe.execute()
+
+    update_stats({ObjectStat.REJECTED: len(package_ids["rejected"])})
+
 
-def update_sips(sip_results, sftp):
+def update_sip_chunk(sip_results, sftp, queue, pool, executor):
     """
-    Update processed SIPs one-by-one
+    Update a chunk of processed SIPs using one query to find the packages
+    and one transaction to update them.
+
+    The ingest reports of the chunk are downloaded concurrently using the
+    SFTP client pool and the executor.
+    """
+    packages = get_unconfirmed_packages(
+        [sip.sip_filename for sip in sip_results]
+    )
+    sips = [
+        (sip, packages[sip.sip_filename]) for sip in sip_results
+        if sip.sip_filename in packages
+    ]
+    processed = []
+
+    def fetch(transfer):
+        fetch_report(pool.get_client(), *transfer)
+
+    try:
+        report_futures = []
+        submit_error = None
+        for sip, (_, object_id, _) in sips:
+            try:
+                transfers = get_report_transfers(sip, object_id)
+            except Exception as exc:
+                # Finish the SIPs before this one first, so that they can
+                # be confirmed
+                submit_error = exc
+                break
+
+            report_futures.append([
+                executor.submit(fetch, transfer) for transfer in transfers
+            ])
+
+        try:
+            for (sip, package), futures in zip(sips, report_futures):
+                for future in futures:
+                    future.result()
+
+                _, object_id, _ = package
+                finish_sip(sip, sftp=sftp, object_id=object_id)
+                processed.append((sip, package))
+
+            if submit_error:
+                raise submit_error
+        except BaseException:
+            # Don't start the remaining downloads
+            for futures in report_futures:
+                for future in futures:
+                    future.cancel()
+            raise
+    except BaseException:
+        # Confirm the SIPs that were processed before the failure, as the
+        # rejected SIPs have already been removed from the DPRES service.
+        # The error is logged first in case the confirmation fails as well.
+        if processed:
+            LOG.exception(
+                "Failed to update SIP, confirming the %d SIP(s) processed "
+                "before it", len(processed)
+            )
+            confirm_processed_sips(processed, queue=queue)
+        raise
+
+    if processed:
+        confirm_processed_sips(processed, queue=queue)
+
+
+def update_sips(
+        sip_results, sftp, chunk_size=DEFAULT_CHUNK_SIZE,
+        workers=DEFAULT_SFTP_WORKERS):
+    """
+    Update processed SIPs in chunks
+
+    :param int workers: How many ingest reports to download concurrently
     """
-    # TODO: We could process SIPs in chunks to reduce DB load
-    # (eg. 50 SIPs per DB session). However, this requires a bit more
-    # complexity and may not be necessary performance-wise.
     queue = get_queue(QueueType.CONFIRM_SIP)
 
-    for sip in sip_results:
-        update_sip(sip, sftp=sftp, queue=queue)
+    with SFTPClientPool(sftp) as pool:
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            for i in range(0, len(sip_results), chunk_size):
+                update_sip_chunk(
+                    sip_results[i:i+chunk_size], sftp=sftp, queue=queue,
+                    pool=pool, executor=executor
+                )
 
 
 def combine_results(*sip_result_lists):
@@ -166,107 +357,196 @@ def combine_results(*sip_result_lists):
     return list(results.values())
 
 
+def get_sip_uploads(sftp, sip_dir):
+    """
+    Get the uploads of a SIP from its SIP directory.
+
+    The modification times of the ingest reports are included in the
+    directory listing, so they don't need to be retrieved separately.
+
+    :returns: List of (transfer_name, report_time) tuples
+    """
+    return [
+        (attr.filename[:-18], attr.st_mtime)
+        for attr in sftp.listdir_attr(str(sip_dir))
+        if attr.filename.endswith("-ingest-report.xml")
+    ]
+
+
+def create_sip_results(status, date_dir, sip_filename, uploads):
+    """
+    Create a SIPResult for each upload of a SIP
+    """
+    sip_dir = Path(status) / date_dir / sip_filename
+
+    # The report time is used to differentiate between the older
+    # and newer uploads of the same SIP
+    # We will remove all but the newest upload later on
+    # TODO: For now this is done just in case we ever upload
+    # a SIP multiple times, which shouldn't happen in practice.
+    #
+    # If it *does* happen, and the SIP has been confirmed in the
+    # database already, then the newer version will be skipped
+    # as only the SIP directories of unconfirmed packages are crawled
+    return [
+        SIPResult(
+            sip_filename=sip_filename,
+            report_path=sip_dir / f"{transfer}-ingest-report.xml",
+            report_time=report_time,
+            transfer_name=transfer,
+            transfer_path=(
+                # Store the path to the original SIP if available
+                sip_dir / sip_filename if status == "rejected" else None
+            ),
+            status=status
+        )
+        for transfer, report_time in uploads
+    ]
+
+
 def get_processed_sips(
-        sftp, status: str, days: int, confirmed_sip_filenames: set):
+        sftp, status: str, days: int, sip_filenames: set,
+        workers: int = DEFAULT_SFTP_WORKERS, crawl_state: dict = None):
     """
-    Get a list of processed SIPs from the DPRES service
+    Get a list of processed SIPs from the DPRES service.
+
+    The directories are crawled concurrently using multiple SFTP channels.
+    The results are in the same order as if the directories were crawled
+    sequentially.
 
     :param status: Status ('accepted' or 'rejected') determining which
                    directory to scrape
     :param days: How many days to scrape
-    :param confirmed_sip_filenames: Set of filenames to filter confirmed SIPs
+    :param sip_filenames: Set of filenames of the SIPs to look for. Other
+                          SIP directories are not crawled.
+    :param workers: How many directories to crawl concurrently
+    :param crawl_state: Optional dict containing the fingerprint and the
+                        SIP directories of each date directory listed on
+                        an earlier run. Date directories older than
+                        'IMMUTABLE_DIR_DAYS' days whose fingerprint hasn't
+                        changed since are not listed again; the saved
+                        SIP directories are used instead. The dict is
+                        updated in-place, and should be persisted once the
+                        returned SIPs have been updated.
     """
+    if crawl_state is None:
+        crawl_state = {}
+
     today = datetime.datetime.now(datetime.timezone.utc)
 
     status_dir = Path(status)
-    dirs = sftp.listdir(str(status_dir))
 
-    results = []
+    # The modification time and size of a directory change when entries
+    # are added to or removed from it
+    fingerprints = {
+        attr.filename: [attr.st_mtime, attr.st_size]
+        for attr in sftp.listdir_attr(str(status_dir))
+    }
+
+    date_dirs = []
+    # {date_dir: [sip_filename, ...]}
+    listings = {}
 
     for i in range(0, days):
-        date = today - datetime.timedelta(days=i)
-        date_dir = date.strftime("%Y-%m-%d")
+        date_dir = (today - datetime.timedelta(days=i)).strftime("%Y-%m-%d")
 
-        if date_dir not in dirs:
+        if date_dir not in fingerprints:
             continue
 
-        sip_filenames = sftp.listdir(str(status_dir / date_dir))
-        sip_filenames = [
-            filename for filename in sip_filenames
-            if filename not in confirmed_sip_filenames
-        ]
-        found_sips = 0
+        date_dirs.append(date_dir)
+
+        # Recent directories are always listed, as a report added within
+        # the same second as the previous crawl wouldn't change the
+        # fingerprint
+        saved = crawl_state.get(date_dir)
+        is_unchanged = (
+            i >= IMMUTABLE_DIR_DAYS
+            and isinstance(saved, dict)
+            and saved.get("fingerprint") == fingerprints[date_dir]
+        )
+        if is_unchanged:
+            listings[date_dir] = saved["sip_filenames"]
+
+    unchanged_count = len(listings)
+    listed_date_dirs = [d for d in date_dirs if d not in listings]
+
+    with SFTPClientPool(sftp) as pool:
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            def list_date_dir(date_dir):
+                return pool.get_client().listdir(str(status_dir / date_dir))
+
+            def get_sip_dir_uploads(sip_dir):
+                date_dir, sip_filename = sip_dir
+                return get_sip_uploads(
+                    pool.get_client(),
+                    status_dir / date_dir / sip_filename
+                )
 
-        for sip_filename in sip_filenames:
-            transfers = sftp.listdir(
-                str(status_dir / date_dir / sip_filename)
+            # List the changed date directories first, and then the SIP
+            # directories in all of them. SIP directories of unchanged
+            # date directories are still crawled if they're outstanding,
+            # eg. because a confirmed SIP has been rolled back.
+            listings.update(
+                zip(
+                    listed_date_dirs,
+                    executor.map(list_date_dir, listed_date_dirs)
+                )
             )
-            transfers = [
-                transfer[:-18] for transfer in transfers
-                if transfer.endswith("-ingest-report.xml")
+            sip_dirs = [
+                (date_dir, sip_filename)
+                for date_dir in date_dirs
+                for sip_filename in listings[date_dir]
+                if sip_filename in sip_filenames
             ]
 
-            for transfer in transfers:
-                ingest_report_name = f"{transfer}-ingest-report.xml"
+            found_sips = OrderedDict((date_dir, 0) for date_dir in date_dirs)
+            results = []
 
-                report_path = (
-                    status_dir / date_dir / sip_filename / ingest_report_name
-                )
-                # Retrieve the date to differentiate between the older
-                # and newer uploads of the same SIP
-                # We will remove all but the newest upload later on
-                # TODO: For now this is done just in case we ever upload
-                # a SIP multiple times, which shouldn't happen in practice.
-                #
-                # If it *does* happen, and the SIP has been confirmed in the
-                # database already, then the newer version will be skipped
-                # due to the 'skip confirmed SIP directories' optimization
-                ingest_report_time = sftp.lstat(str(report_path)).st_mtime
-                results.append(
-                    SIPResult(
-                        sip_filename=sip_filename,
-                        report_path=(
-                            status_dir / date_dir / sip_filename
-                            / ingest_report_name
-                        ),
-                        report_time=ingest_report_time,
-                        transfer_name=transfer,
-                        transfer_path=(
-                            # Store the path to the original SIP if available
-                            status_dir / date_dir / sip_filename / sip_filename
-                            if status == "rejected" else None
-                        ),
-                        status=status
-                    )
+            for (date_dir, sip_filename), uploads in zip(
+                    sip_dirs, executor.map(get_sip_dir_uploads, sip_dirs)):
+                sip_results = create_sip_results(
+                    status, date_dir, sip_filename, uploads
                 )
-                found_sips += 1
+                results += sip_results
+                found_sips[date_dir] += len(sip_results)
+
+    for date_dir, count in found_sips.items():
+        LOG.info("Found %s on %s", count, date_dir)
 
-        LOG.info("Found %s on %s", found_sips, date_dir)
+    if unchanged_count:
+        LOG.info(
+            "Skipped listing %d unchanged directories", unchanged_count
+        )
+
+    # Only the directories within the crawled period are remembered
+    crawl_state.clear()
+    crawl_state.update({
+        date_dir: {
+            "fingerprint": fingerprints[date_dir],
+            "sip_filenames": list(listings[date_dir])
+        }
+        for date_dir in date_dirs
+    })
 
     return results
 
 
-def get_confirmed_sip_filenames(days: int) -> set:
+def get_outstanding_sip_filenames() -> set:
     """
-    Get a set of SIP filenames that have already been marked as preserved or
-    rejected in the workflow.
+    Get a set of SIP filenames that have been uploaded but haven't been
+    marked as preserved or rejected in the workflow yet.
 
-    The SIPs can be safely skipped as they're either already confirmed or the
+    These are the only SIPs whose processing results need to be checked.
+    SIPs that have already been confirmed can be safely skipped, as the
     corresponding workflow job has been enqueued.
     """
-    # Find packages that are at most (days + 2) days old. The extra two days
-    # are used to account for days that took longer to get processed for
-    # whatever reason.
-    cutoff = (
-        datetime.datetime.now(datetime.timezone.utc)
-        - datetime.timedelta(days=days + 2)
-    )
-
     with scoped_session() as db:
         query = (
             select([MuseumPackage.sip_filename])
-            .where(MuseumPackage.created_date > cutoff)
-            .where(or_(MuseumPackage.preserved, MuseumPackage.rejected))
+            .where(MuseumPackage.uploaded == True)
+            .where(MuseumPackage.preserved == False)
+            .where(MuseumPackage.rejected == False)
+            .where(MuseumPackage.cancelled == False)
         )
         results = db.execute(query)
         results = {result[0] for result in results}
@@ -274,31 +554,51 @@ def get_confirmed_sip_filenames(days: int) -> set:
     return results
 
 
-def sync_processed_sips(days):
+def sync_processed_sips(days, workers=DEFAULT_SFTP_WORKERS, full=False):
     """
     Synchronize processed SIPs from the DPRES service, mark the corresponding
     packages as either preserved or rejected and cleanup the remaining files
+
+    :param int days: How many days to search through
+    :param int workers: How many SFTP directories to crawl and ingest
+                        reports to download concurrently
+    :param bool full: Whether to list all directories, including the ones
+                      that haven't changed since the last run
     """
     connect_db()
 
-    confirmed_sip_filenames = get_confirmed_sip_filenames(days)
+    sip_filenames = get_outstanding_sip_filenames()
+    LOG.info("%d SIPs are awaiting processing", len(sip_filenames))
+
+    if not sip_filenames:
+        # Nothing to look for, so the directories don't need to be crawled
+        submit_heartbeat(HeartbeatSource.SYNC_PROCESSED_SIPS)
+        return
+
+    crawl_state = {} if full else get_crawl_state(SYNC_STATUS_NAME)
 
     with connect_dpres_sftp() as sftp:
         accepted_sips = get_processed_sips(
             sftp, status="accepted", days=days,
-            confirmed_sip_filenames=confirmed_sip_filenames
+            sip_filenames=sip_filenames, workers=workers,
+            crawl_state=crawl_state.setdefault("accepted", {})
         )
         LOG.info("Found %s accepted SIPs", len(accepted_sips))
 
         rejected_sips = get_processed_sips(
             sftp, status="rejected", days=days,
-            confirmed_sip_filenames=confirmed_sip_filenames
+            sip_filenames=sip_filenames, workers=workers,
+            crawl_state=crawl_state.setdefault("rejected", {})
         )
         LOG.info("Found %s rejected SIPs", len(rejected_sips))
 
         completed_sips = combine_results(accepted_sips, rejected_sips)
 
-        update_sips(completed_sips, sftp=sftp)
+        update_sips(completed_sips, sftp=sftp, workers=workers)
+
+        # Save the crawl state only once the SIPs have been updated, so that
+        # the directories are crawled again if the run fails
+        update_crawl_state(SYNC_STATUS_NAME, crawl_state)
 
         submit_heartbeat(HeartbeatSource.SYNC_PROCESSED_SIPS)
 
@@ -308,8 +608,23 @@ def sync_processed_sips(days):
     # According to DPRES API docs, reports for rejected packages will preserved
     # for at least 10 days
     "--days", default=31, help="Amount of days to search through")
-def cli(days):
-    sync_processed_sips(days)
+@click.option(
+    "--workers", default=DEFAULT_SFTP_WORKERS, type=click.IntRange(min=1),
+    help=(
+        "How many SFTP directories to crawl and ingest reports to download "
+        "concurrently"
+    )
+)
+@click.option(
+    "--full", is_flag=True, default=False,
+    help=(
+        "List all directories again, including the ones that haven't "
+        "changed since the last run. Use this if the saved listings are "
+        "suspected to be out of date."
+    )
+)
+def cli(days, workers, full):
+    sync_processed_sips(days, workers=workers, full=full)
 
 
 if __name__ == "__main__":
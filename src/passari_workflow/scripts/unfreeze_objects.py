@@ -6,8 +6,9 @@ import click
 from passari_workflow.db import scoped_session
 from passari_workflow.db.connection import connect_db
 from passari_workflow.db.models import MuseumObject, MuseumPackage
-from passari_workflow.queue.queues import lock_queues
-from passari_workflow.scripts.enqueue_objects import enqueue_object
+from passari_workflow.queue.queues import lock_objects
+from passari_workflow.scripts.enqueue_objects import enqueue_object_batch
+from passari_workflow.stats import ObjectStat, update_stats
 
 
 def unfreeze_objects(reason=None, object_ids=None, enqueue=False):
@@ -26,24 +27,43 @@ def unfreeze_objects(reason=None, object_ids=None, enqueue=False):
     if not reason and not object_ids:
         raise ValueError("Either 'reason' or 'object_ids' has to be provided")
 
-    with lock_queues():
-        with scoped_session() as db:
-            query = (
-                db.query(MuseumObject)
-                .outerjoin(
-                    MuseumPackage,
-                    MuseumPackage.id == MuseumObject.latest_package_id
-                )
-                .filter(MuseumObject.frozen == True)
+    def get_query(db, object_ids):
+        query = (
+            db.query(MuseumObject)
+            .outerjoin(
+                MuseumPackage,
+                MuseumPackage.id == MuseumObject.latest_package_id
             )
+            .filter(MuseumObject.frozen == True)
+        )
+
+        if reason:
+            query = query.filter(MuseumObject.freeze_reason == reason)
+        if object_ids:
+            query = query.filter(MuseumObject.id.in_(object_ids))
+
+        return query
+
+    if object_ids:
+        object_ids = [int(object_id) for object_id in object_ids]
+    else:
+        # Find the objects with the given reason first, so that only the
+        # part of the workflow concerning them needs to be locked
+        with scoped_session() as db:
+            object_ids = [
+                object_id for object_id, in
+                get_query(db, None).with_entities(MuseumObject.id)
+            ]
 
-            if reason:
-                query = query.filter(MuseumObject.freeze_reason == reason)
-            if object_ids:
-                object_ids = [int(object_id) for object_id in object_ids]
-                query = query.filter(MuseumObject.id.in_(object_ids))
+        if not object_ids:
+            return 0
 
-            museum_objects = list(query)
+    with lock_objects(object_ids):
+        with scoped_session() as db:
+            # Objects may have been unfrozen by someone else in the meantime
+            museum_objects = list(get_query(db, object_ids))
+            enqueue_object_ids = []
+            unrejected_count = 0
             for museum_object in museum_objects:
                 museum_object.frozen = False
                 museum_object.freeze_reason = None
@@ -57,12 +77,21 @@ def unfreeze_objects(reason=None, object_ids=None, enqueue=False):
                 )
 
                 if remove_latest_package:
+                    if museum_object.latest_package.rejected:
+                        unrejected_count += 1
                     museum_object.latest_package = None
 
                 if enqueue:
-                    enqueue_object(object_id=museum_object.id)
+                    enqueue_object_ids.append(museum_object.id)
+
+            enqueue_object_batch(enqueue_object_ids, user_requested=True)
+
+        update_stats({
+            ObjectStat.FROZEN: -len(museum_objects),
+            ObjectStat.REJECTED: -unrejected_count
+        })
 
-            return len(museum_objects)
+        return len(museum_objects)
 
 
 @click.command()
@@ -7,6 +7,15 @@ from sqlalchemy.orm import load_only
 
 from passari_workflow.db import scoped_session
 from passari_workflow.db.models import SyncStatus
+from passari_workflow.redis.connection import get_redis_connection
+
+
+# Redis set containing the IDs of objects whose attachment metadata hash may
+# have changed since the last 'sync_hashes' run
+DIRTY_OBJECT_IDS_KEY = "sync_hashes:dirty_object_ids"
+# Dirty object IDs claimed by a 'sync_hashes' run that is still in progress
+# or was interrupted
+CLAIMED_DIRTY_OBJECT_IDS_KEY = "sync_hashes:claimed_dirty_object_ids"
 
 
 SyncStatusReadOnly = namedtuple(
@@ -82,3 +91,76 @@ def finish_sync_progress(name):
         sync_status.offset = 0
         sync_status.prev_start_sync_date = sync_status.start_sync_date
         sync_status.start_sync_date = None
+
+
+def get_crawl_state(name):
+    """
+    Get the crawl state persisted by the previous run
+
+    :returns: The crawl state, or an empty dict if it hasn't been saved yet
+    """
+    with scoped_session() as db:
+        crawl_state = (
+            db.query(SyncStatus.crawl_state)
+            .filter_by(name=name)
+            .scalar()
+        )
+
+    return crawl_state or {}
+
+
+def update_crawl_state(name, crawl_state):
+    """
+    Save the crawl state to the database to be used by the next run
+    """
+    with scoped_session() as db:
+        sync_status = _get_sync_status(db, name)
+        sync_status.crawl_state = crawl_state
+
+
+def add_dirty_object_ids(object_ids):
+    """
+    Mark objects as dirty, meaning their attachment metadata hashes need to
+    be recalculated on the next incremental 'sync_hashes' run.
+
+    This should be called before the corresponding database changes are
+    committed; an object being marked unnecessarily is harmless, but an
+    object that is never marked won't be updated.
+    """
+    object_ids = [int(object_id) for object_id in object_ids]
+
+    if object_ids:
+        redis = get_redis_connection()
+        redis.sadd(DIRTY_OBJECT_IDS_KEY, *object_ids)
+
+
+def claim_dirty_object_ids():
+    """
+    Claim the current dirty object IDs for processing and return them.
+
+    Object IDs that were claimed by an earlier run that didn't finish are
+    included as well. Objects marked as dirty after this call will be
+    processed on the next run.
+
+    :returns: Sorted list of object IDs
+    """
+    redis = get_redis_connection()
+
+    with redis.pipeline() as pipe:
+        pipe.sunionstore(
+            CLAIMED_DIRTY_OBJECT_IDS_KEY,
+            [CLAIMED_DIRTY_OBJECT_IDS_KEY, DIRTY_OBJECT_IDS_KEY]
+        )
+        pipe.delete(DIRTY_OBJECT_IDS_KEY)
+        pipe.smembers(CLAIMED_DIRTY_OBJECT_IDS_KEY)
+        object_ids = pipe.execute()[-1]
+
+    return sorted(int(object_id) for object_id in object_ids)
+
+
+def finish_dirty_object_ids():
+    """
+    Discard the claimed dirty object IDs once they have been processed
+    """
+    redis = get_redis_connection()
+    redis.delete(CLAIMED_DIRTY_OBJECT_IDS_KEY)
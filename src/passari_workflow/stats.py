@@ -0,0 +1,174 @@
+"""
+Object counts for the workflow dashboard.
+
+The database-derived counts are stored as Redis counters, which are adjusted
+by the jobs and scripts that change the corresponding objects and
+periodically reconciled against the database using :func:`reconcile_stats`.
+This allows the counts to be retrieved in constant time regardless of the
+amount of objects.
+"""
+import enum
+
+from sqlalchemy import func
+
+from passari_workflow.db import scoped_session
+from passari_workflow.db.models import MuseumObject, MuseumPackage
+from passari_workflow.heartbeat import HeartbeatSource, submit_heartbeat
+from passari_workflow.queue.queues import OBJECT_QUEUE_TYPES, WorkflowQueue
+from passari_workflow.redis.connection import get_redis_connection
+from rq.registry import (FailedJobRegistry, ScheduledJobRegistry,
+                         StartedJobRegistry)
+from rq.utils import current_timestamp
+
+# Redis hash of {stat: count} for the database-derived counts
+STATS_KEY = "stats:objects"
+
+
+class ObjectStat(enum.Enum):
+    """
+    Object count displayed in the dashboard
+    """
+    # Objects pending preservation. Objects become pending as time passes,
+    # so this is only updated when the counts are reconciled.
+    PENDING = "pending"
+    # Frozen objects
+    FROZEN = "frozen"
+    # Objects that have been preserved at least once
+    PRESERVED = "preserved"
+    # Objects whose latest package was rejected
+    REJECTED = "rejected"
+    # Objects that have a pending or executing job in the workflow.
+    # This is retrieved from the job queues directly.
+    IN_WORKFLOW = "in_workflow"
+    # Objects whose last job in the workflow failed.
+    # This is retrieved from the job queues directly.
+    FAILED = "failed"
+
+
+# Counts that are retrieved from the job queues instead of the counters
+QUEUE_STATS = (ObjectStat.IN_WORKFLOW, ObjectStat.FAILED)
+
+
+def update_stats(changes, pipeline=None):
+    """
+    Adjust the counters by the given amounts
+
+    :param dict changes: {stat: amount} dict. Amount can be negative.
+    :param pipeline: Optional Redis pipeline to use. If not provided,
+                     the counters are updated immediately.
+    """
+    redis = pipeline if pipeline is not None else get_redis_connection()
+
+    for stat, amount in changes.items():
+        stat = ObjectStat(stat)
+        if stat in QUEUE_STATS:
+            raise ValueError(f"{stat.value} can't be updated")
+
+        if amount:
+            redis.hincrby(STATS_KEY, stat.value, amount)
+
+
+def count_stats(db):
+    """
+    Count the objects in the database.
+
+    This is used by :func:`reconcile_stats` and can also be used when
+    exact counts are required.
+
+    :param db: SQLAlchemy session
+    :returns: {stat: count} dict of the database-derived counts
+    """
+    def count(query):
+        return query.with_entities(func.count(MuseumObject.id)).scalar()
+
+    query = db.query(MuseumObject)
+
+    return {
+        ObjectStat.PENDING: count(
+            query.with_transformation(MuseumObject.filter_preservation_pending)
+        ),
+        ObjectStat.FROZEN: count(query.filter(MuseumObject.frozen == True)),
+        ObjectStat.PRESERVED: count(
+            query.filter(MuseumObject.preserved == True)
+        ),
+        ObjectStat.REJECTED: count(
+            query.join(
+                MuseumPackage,
+                MuseumPackage.id == MuseumObject.latest_package_id
+            ).filter(MuseumPackage.rejected == True)
+        )
+    }
+
+
+def reconcile_stats():
+    """
+    Replace the counters with the current counts from the database.
+
+    Changes that are made while the objects are being counted may be lost,
+    which is corrected on the next run.
+
+    :returns: {stat: count} dict of the new counts
+    """
+    with scoped_session() as db:
+        counts = count_stats(db)
+
+    redis = get_redis_connection()
+    redis.hset(
+        STATS_KEY,
+        mapping={stat.value: count for stat, count in counts.items()}
+    )
+
+    submit_heartbeat(HeartbeatSource.RECONCILE_STATS)
+
+    return counts
+
+
+def get_stats():
+    """
+    Get a dict containing the current counts for all stats.
+
+    The database-derived counts are approximate and may be slightly out of
+    date until the next :func:`reconcile_stats` run. Counts that haven't
+    been reconciled yet are None.
+    """
+    redis = get_redis_connection()
+    now = current_timestamp()
+
+    with redis.pipeline() as pipe:
+        pipe.hgetall(STATS_KEY)
+
+        for queue_type in OBJECT_QUEUE_TYPES:
+            queue = WorkflowQueue(queue_type.value, connection=redis)
+            started_key = StartedJobRegistry(queue=queue).key
+            failed_key = FailedJobRegistry(queue=queue).key
+            scheduled_key = ScheduledJobRegistry(queue=queue).key
+
+            pipe.llen(queue.key)
+            pipe.zcard(scheduled_key)
+            pipe.zcount(started_key, f"({now}", "+inf")
+            # Executing jobs that have expired are considered failed, as in
+            # 'QueueSnapshot'
+            pipe.zcount(started_key, 0, now)
+            pipe.zcount(failed_key, f"({now}", "+inf")
+
+        results = iter(pipe.execute())
+
+    counts = {
+        key.decode("utf-8"): int(value)
+        for key, value in next(results).items()
+    }
+
+    result = {
+        stat: counts.get(stat.value) for stat in ObjectStat
+        if stat not in QUEUE_STATS
+    }
+    result[ObjectStat.IN_WORKFLOW] = 0
+    result[ObjectStat.FAILED] = 0
+
+    for _ in OBJECT_QUEUE_TYPES:
+        result[ObjectStat.IN_WORKFLOW] += (
+            next(results) + next(results) + next(results)
+        )
+        result[ObjectStat.FAILED] += next(results) + next(results)
+
+    return result
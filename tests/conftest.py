@@ -29,13 +29,25 @@ def redis(monkeypatch):
         lambda: conn
     )
     monkeypatch.setattr(
-        "passari_workflow.jobs.utils.get_redis_connection",
+        "passari_workflow.redis.locks.get_redis_connection",
         lambda: conn
     )
     monkeypatch.setattr(
         "passari_workflow.heartbeat.get_redis_connection",
         lambda: conn
     )
+    monkeypatch.setattr(
+        "passari_workflow.scripts.utils.get_redis_connection",
+        lambda: conn
+    )
+    monkeypatch.setattr(
+        "passari_workflow.stats.get_redis_connection",
+        lambda: conn
+    )
+    monkeypatch.setattr(
+        "passari_workflow.queue.scheduling.get_redis_connection",
+        lambda: conn
+    )
 
     yield conn
 
@@ -62,6 +74,8 @@ def engine(database, monkeypatch):
 
     # pg_trgm extension must exist
     engine.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+    # pgcrypto extension must exist
+    engine.execute("CREATE EXTENSION IF NOT EXISTS pgcrypto")
 
     Base.metadata.create_all(engine)
     yield engine
@@ -107,6 +121,10 @@ def museum_packages_dir(tmpdir, monkeypatch):
         "passari_workflow.db.models.PACKAGE_DIR",
         str(path)
     )
+    monkeypatch.setattr(
+        "passari_workflow.queue.scheduling.PACKAGE_DIR",
+        str(path)
+    )
     return path
 
 
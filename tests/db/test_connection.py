@@ -0,0 +1,37 @@
+from passari_workflow.config import CONFIG
+from passari_workflow.db import DBSession
+from passari_workflow.db.connection import connect_db
+
+
+def test_connect_db_cached(engine):
+    """
+    Test that the same engine is reused within a process
+    """
+    assert connect_db() is engine
+    assert DBSession.kw["bind"] is engine
+
+
+def test_connect_db_pool_options(engine, monkeypatch):
+    """
+    Test that the connection pool options are read from the configuration
+    """
+    monkeypatch.setitem(CONFIG["db"], "pool_size", 2)
+    monkeypatch.setitem(CONFIG["db"], "max_overflow", 3)
+
+    new_engine = connect_db()
+
+    assert new_engine is not engine
+    assert new_engine.pool.size() == 2
+    assert new_engine.pool._max_overflow == 3
+
+
+def test_connect_db_fork(engine, monkeypatch):
+    """
+    Test that a forked process doesn't reuse the parent's engine
+    """
+    monkeypatch.setattr("os.getpid", lambda: -1)
+
+    child_engine = connect_db()
+
+    assert child_engine is not engine
+    assert connect_db() is child_engine
@@ -1,9 +1,15 @@
 import datetime
 import gzip
+import random
 
+from sqlalchemy import and_, or_
+from sqlalchemy.sql.functions import coalesce
+
+from passari_workflow.config import PRESERVATION_DELAY, UPDATE_DELAY
 from passari_workflow.db import scoped_session
 from passari_workflow.db.models import (FreezeSource, MuseumAttachment,
-                                               MuseumObject, MuseumPackage)
+                                               MuseumObject, MuseumPackage,
+                                               refresh_preservation_pending)
 
 
 def assert_preservation_pending_count(query, count):
@@ -27,6 +33,61 @@ def assert_preservation_pending_count(query, count):
     )
 
 
+def filter_preservation_pending_unmaterialized(q):
+    """
+    Filter the objects pending preservation by comparing the objects
+    against their latest packages directly, the same way it was done
+    before the 'preservation pending' state was materialized
+    """
+    now = datetime.datetime.now(datetime.timezone.utc)
+    preservation_boundary = now - PRESERVATION_DELAY
+    update_boundary = now - UPDATE_DELAY
+
+    return (
+        q.outerjoin(
+            MuseumPackage,
+            MuseumPackage.id == MuseumObject.latest_package_id
+        )
+        .filter(MuseumObject.frozen == False)
+        .filter(MuseumObject.attachment_metadata_hash != None)
+        .filter(MuseumObject.metadata_hash != None)
+        .filter(
+            or_(
+                and_(
+                    MuseumObject.latest_package_id == None,
+                    or_(
+                        MuseumObject.created_date == None,
+                        MuseumObject.created_date < preservation_boundary
+                    )
+                ),
+                and_(
+                    MuseumObject.latest_package_id != None,
+                    coalesce(
+                        MuseumPackage.object_modified_date,
+                        datetime.datetime.min
+                    ) != coalesce(
+                        MuseumObject.modified_date, datetime.datetime.min
+                    ),
+                    or_(
+                        MuseumPackage.object_modified_date == None,
+                        MuseumPackage.object_modified_date < update_boundary
+                    ),
+                    or_(
+                        MuseumObject.metadata_hash
+                        != MuseumPackage.metadata_hash,
+                        MuseumObject.attachment_metadata_hash
+                        != MuseumPackage.attachment_metadata_hash
+                    )
+                ),
+                and_(
+                    MuseumObject.latest_package_id != None,
+                    MuseumPackage.cancelled == True
+                )
+            )
+        )
+    )
+
+
 class TestMuseumObject:
     def test_museum_object(self, session):
         mus_object = MuseumObject(
@@ -540,3 +601,107 @@ class TestMuseumPackage:
         # is not possible until a change is detected
         assert not museum_object.preservation_pending
         assert_preservation_pending_count(session.query(MuseumObject), 0)
+
+    def test_preservation_pending_materialized(self, session):
+        """
+        Test that the materialized 'preservation pending' state matches both
+        the 'preservation_pending' property and the unmaterialized query
+        for random objects, including after the objects and their packages
+        have been changed
+        """
+        rand = random.Random(1234)
+        now = datetime.datetime.now(datetime.timezone.utc)
+
+        # Use a handful of dates and hashes to make equal values likely
+        dates = [
+            None,
+            now - datetime.timedelta(days=5),
+            now - datetime.timedelta(days=45),
+            now - datetime.timedelta(days=90)
+        ]
+        hashes = ["hash1", "hash2"]
+        package_count = 0
+
+        def randomize_package(museum_package):
+            museum_package.object_modified_date = rand.choice(dates)
+            museum_package.metadata_hash = rand.choice(hashes)
+            museum_package.attachment_metadata_hash = rand.choice(hashes)
+            museum_package.cancelled = rand.random() < 0.2
+
+        def randomize_object(museum_object):
+            nonlocal package_count
+
+            museum_object.frozen = rand.random() < 0.2
+            museum_object.created_date = rand.choice(dates)
+            museum_object.modified_date = rand.choice(dates)
+            museum_object.metadata_hash = rand.choice(hashes + [None])
+            museum_object.attachment_metadata_hash = rand.choice(
+                hashes + [None]
+            )
+
+            if rand.random() < 0.7:
+                package_count += 1
+                museum_package = MuseumPackage(
+                    sip_filename=f"test_{package_count}.tar",
+                    museum_object=museum_object
+                )
+                randomize_package(museum_package)
+                museum_object.latest_package = museum_package
+            else:
+                museum_object.latest_package = None
+
+        def assert_materialized_state():
+            session.commit()
+
+            museum_objects = session.query(MuseumObject).all()
+            object_ids = {museum_object.id for museum_object in museum_objects}
+            expected_ids = {
+                museum_object.id for museum_object in museum_objects
+                if museum_object.preservation_pending
+            }
+
+            query = session.query(MuseumObject.id)
+            pending_ids = {
+                object_id for object_id, in query.with_transformation(
+                    MuseumObject.filter_preservation_pending
+                )
+            }
+            unmaterialized_ids = {
+                object_id for object_id, in query.with_transformation(
+                    filter_preservation_pending_unmaterialized
+                )
+            }
+            excluded_ids = {
+                object_id for object_id, in query.with_transformation(
+                    MuseumObject.exclude_preservation_pending
+                )
+            }
+
+            # Ensure the random states cover both outcomes
+            assert 0 < len(expected_ids) < len(object_ids)
+
+            assert pending_ids == expected_ids
+            assert unmaterialized_ids == expected_ids
+            assert excluded_ids == object_ids - expected_ids
+
+            # Recomputing all the fields from scratch doesn't change anything
+            assert refresh_preservation_pending(session) == 0
+
+        museum_objects = []
+        for i in range(1, 301):
+            museum_object = MuseumObject(id=i)
+            randomize_object(museum_object)
+            museum_objects.append(museum_object)
+
+        session.add_all(museum_objects)
+        assert_materialized_state()
+
+        for _ in range(3):
+            for museum_object in rand.sample(museum_objects, 100):
+                if museum_object.latest_package and rand.random() < 0.5:
+                    # Change only the latest package
+                    randomize_package(museum_object.latest_package)
+                else:
+                    randomize_object(museum_object)
+
+            assert_materialized_state()
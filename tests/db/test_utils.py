@@ -0,0 +1,83 @@
+from passari_workflow.db.models import (MuseumAttachment, MuseumObject,
+                                        object_attachment_association_table)
+from passari_workflow.db.utils import (bulk_create_missing, bulk_upsert,
+                                       sync_association)
+
+
+def test_bulk_upsert(session, museum_object_factory):
+    """
+    Test that 'bulk_upsert' creates new entries, updates existing entries
+    and only moves the increasing fields forward
+    """
+    museum_object = museum_object_factory(id=1, title="Old title")
+
+    inserts, updates = bulk_upsert(
+        session, MuseumObject,
+        [
+            {
+                "id": 1, "title": "New title",
+                "modified_date": museum_object.modified_date.replace(year=2000)
+            },
+            {
+                "id": 2, "title": "Second object",
+                "modified_date": museum_object.modified_date
+            }
+        ],
+        update_fields=["title"],
+        increasing_fields=["modified_date"]
+    )
+    session.commit()
+
+    assert inserts == 1
+    assert updates == 1
+
+    museum_object = session.query(MuseumObject).get(1)
+    assert museum_object.title == "New title"
+    # Older modification date was not used
+    assert museum_object.modified_date.year == 2019
+
+    assert session.query(MuseumObject).get(2).title == "Second object"
+
+
+def test_sync_association(session):
+    """
+    Test that 'sync_association' only adds and removes the associations
+    that have changed
+    """
+    bulk_create_missing(session, MuseumObject, [1, 2, 3])
+    bulk_create_missing(session, MuseumAttachment, [10, 11, 12, 13])
+    # Creating existing entries again is a no-op
+    bulk_create_missing(session, MuseumAttachment, [10, 11])
+
+    association = object_attachment_association_table
+
+    added, removed = sync_association(
+        session,
+        association.c.museum_object_id,
+        association.c.museum_attachment_id,
+        {1: [10, 11], 2: [12]}
+    )
+    assert added == {(1, 10), (1, 11), (2, 12)}
+    assert not removed
+
+    added, removed = sync_association(
+        session,
+        association.c.museum_object_id,
+        association.c.museum_attachment_id,
+        {1: [11, 13], 2: [], 3: [10]}
+    )
+    session.commit()
+
+    assert added == {(1, 13), (3, 10)}
+    assert removed == {(1, 10), (2, 12)}
+
+    # The relationship has no defined order
+    assert {
+        attachment.id for attachment in
+        session.query(MuseumObject).get(1).attachments
+    } == {11, 13}
+    assert not session.query(MuseumObject).get(2).attachments
+    assert {
+        attachment.id for attachment in
+        session.query(MuseumObject).get(3).attachments
+    } == {10}
@@ -2,6 +2,7 @@ from collections import namedtuple
 from pathlib import Path
 
 from passari_workflow.db.models import MuseumPackage, MuseumObject
+from passari_workflow.stats import ObjectStat, get_stats
 
 import pytest
 
@@ -73,6 +74,9 @@ def test_confirm_sip(
         assert not db_museum_package.rejected
 
         assert db_museum_object.preserved
+
+        # Preserved object counter was updated
+        assert get_stats()[ObjectStat.PRESERVED] == 1
     elif status == "rejected":
         assert db_museum_package.rejected
         assert not db_museum_package.preserved
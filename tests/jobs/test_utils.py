@@ -0,0 +1,140 @@
+import time
+
+import pytest
+from passari_workflow.exceptions import LockLostError
+from passari_workflow.jobs.utils import fence_object, job_locked_by_object_id
+from passari_workflow.queue.queues import (QueueType, get_enqueued_object_ids,
+                                           get_queue)
+from passari_workflow.redis.locks import (MultiLock, get_locks,
+                                          get_object_lock)
+from rq import SimpleWorker
+from rq.job import Job, JobStatus
+
+
+@job_locked_by_object_id
+def locked_job(object_id, lock_token):
+    get_queue(QueueType.DOWNLOAD_OBJECT).connection.rpush(
+        "test:executed", object_id
+    )
+
+
+def test_job_locked_by_object_id_deferral(redis, monkeypatch):
+    """
+    Test that a job whose object is locked is postponed without blocking
+    the worker, and is executed exactly once after the lock is released
+    """
+    monkeypatch.setattr("passari_workflow.jobs.utils.LOCK_DEFERRAL", True)
+
+    queue = get_queue(QueueType.DOWNLOAD_OBJECT)
+    queue.enqueue(
+        locked_job, kwargs={"object_id": 1}, job_id="download_object_1"
+    )
+    queue.enqueue(
+        locked_job, kwargs={"object_id": 2}, job_id="download_object_2"
+    )
+
+    # Another job is processing the first object
+    lock = get_object_lock(1)
+    lock.acquire()
+
+    SimpleWorker([queue], connection=redis).work(burst=True)
+
+    # The worker moved on to the second object instead of waiting
+    assert redis.lrange("test:executed", 0, -1) == [b"2"]
+    assert queue.scheduled_job_registry.get_job_ids() == ["download_object_1"]
+    assert queue.failed_job_registry.count == 0
+    assert get_enqueued_object_ids() == {1}
+
+    lock.release()
+
+    # Enqueue the postponed job as the RQ scheduler would once the delay
+    # has passed
+    for job_id in queue.scheduled_job_registry.get_job_ids():
+        job = Job.fetch(job_id, connection=redis)
+        queue.scheduled_job_registry.remove(job)
+        queue.enqueue_job(job)
+
+    SimpleWorker([queue], connection=redis).work(burst=True)
+
+    assert redis.lrange("test:executed", 0, -1) == [b"2", b"1"]
+    assert queue.scheduled_job_registry.count == 0
+    assert queue.failed_job_registry.count == 0
+
+    job = Job.fetch("download_object_1", connection=redis)
+    assert job.get_status() == JobStatus.FINISHED
+    assert job.meta["deferral_count"] == 1
+    assert get_enqueued_object_ids() == set()
+
+
+def test_fence_object(session, museum_object):
+    """
+    Test that updates using an older fencing token than the latest one are
+    rejected
+    """
+    fence_object(session, 123456, 5)
+    session.refresh(museum_object)
+    assert museum_object.lock_token == 5
+
+    # Newer token replaces the older one
+    fence_object(session, 123456, 6)
+    session.refresh(museum_object)
+    assert museum_object.lock_token == 6
+
+    # Job holding an older token has lost its lock
+    with pytest.raises(LockLostError):
+        fence_object(session, 123456, 5)
+
+    # Objects that don't exist are ignored
+    fence_object(session, 654321, 1)
+
+
+def test_fencing_token_lock_expired(session, museum_object):
+    """
+    Test that a job whose lock expired while it was paused can't update
+    the object after another job has acquired the lock
+    """
+    lock_a = MultiLock(["lock-object-123456"], expire=0.2)
+    assert lock_a.acquire(blocking=False)
+
+    # Job A is paused and its lock isn't renewed
+    lock_a._stop_renewal.set()
+    time.sleep(0.3)
+
+    # Job B acquires the expired lock and gets a newer token, even though
+    # job A hasn't used its token yet
+    lock_b = get_object_lock(123456)
+    assert lock_b.acquire(blocking=False)
+    assert lock_b.token > lock_a.token
+
+    fence_object(session, 123456, lock_b.token)
+
+    # Job A wakes up and its updates are rejected
+    with pytest.raises(LockLostError):
+        fence_object(session, 123456, lock_a.token)
+
+    # Releasing the expired lock doesn't release the lock of job B
+    lock_a.release()
+    assert [lock.name for lock in get_locks()] == ["lock-object-123456"]
+
+    lock_b.release()
+    assert get_locks() == []
+
+
+def test_lock_renewal_failed(redis):
+    """
+    Test that a lock is marked as lost if it can't be renewed
+    """
+    lock = MultiLock(["lock-a", "lock-b"], expire=0.3)
+    lock.acquire()
+    assert not lock.lost
+
+    # Another process acquired one of the locks after it expired
+    redis.set("lock:lock-b", "other")
+
+    time.sleep(0.4)
+    assert lock.lost
+
+    # Only the lock still held is released
+    lock.release()
+    assert redis.get("lock:lock-b") == b"other"
+    assert not redis.exists("lock:lock-a")
@@ -1,9 +1,22 @@
-from passari_workflow.queue.queues import (QueueType,
+import threading
+import time
+
+from passari_workflow.queue.queues import (GLOBAL_LOCK_BARRIER,
+                                                  LOCK_STRIPE_COUNT,
+                                                  OBJECT_QUEUE_INDEX_BUILT_KEY,
+                                                  OBJECT_QUEUE_INDEX_KEY,
+                                                  QueueSnapshot, QueueType,
                                                   delete_jobs_for_object_id,
+                                                  filter_enqueued_object_ids,
                                                   get_enqueued_object_ids,
+                                                  get_indexed_object_ids,
+                                                  get_lock_stripe_names,
                                                   get_object_id2queue_map,
-                                                  get_queue)
+                                                  get_queue, lock_objects,
+                                                  lock_queues)
+from passari_workflow.redis.locks import MultiLock, get_locks
 from rq import SimpleWorker
+from rq.registry import StartedJobRegistry
 
 
 def successful_job():
@@ -14,6 +27,12 @@ def failing_job():
     raise RuntimeError("no no no no!")
 
 
+def enqueue_next_job():
+    get_queue(QueueType.CREATE_SIP).enqueue(
+        successful_job, job_id="create_sip_123456"
+    )
+
+
 def test_get_enqueued_object_ids(redis):
     queue = get_queue(QueueType.CREATE_SIP)
 
@@ -66,3 +85,207 @@ def test_get_object_id2queue_map(redis):
     assert queue_map[123456] == ["download_object"]
     assert queue_map[654321] == ["submit_sip", "failed"]
     assert queue_map[111111] == []
+
+
+def test_queue_snapshot(redis):
+    """
+    Test that 'QueueSnapshot' returns the pending, running and failed
+    object IDs of every queue
+    """
+    queue_a = get_queue(QueueType.DOWNLOAD_OBJECT)
+    queue_b = get_queue(QueueType.SUBMIT_SIP)
+
+    queue_a.enqueue(successful_job, job_id="download_object_123456")
+    queue_b.enqueue(failing_job, job_id="submit_sip_654321")
+    SimpleWorker([queue_b], connection=queue_b.connection).work(burst=True)
+
+    # Simulate one executing job and one that has exceeded its timeout
+    # without the worker cleaning it up
+    started_registry = StartedJobRegistry(queue=get_queue(QueueType.CREATE_SIP))
+    redis.zadd(started_registry.key, {"create_sip_111111": time.time() + 60})
+    redis.zadd(started_registry.key, {"create_sip_222222": time.time() - 60})
+
+    snapshot = QueueSnapshot.fetch()
+
+    assert snapshot.enqueued_object_ids == {123456, 654321, 111111, 222222}
+    assert snapshot.running_object_ids == {111111}
+    assert snapshot.get_object_id2queue_map([111111, 222222]) == {
+        111111: ["create_sip"],
+        222222: ["create_sip", "failed"]
+    }
+
+
+def test_object_queue_index(redis):
+    """
+    Test that the object queue index is updated when jobs are enqueued,
+    finished and failed
+    """
+    queue_a = get_queue(QueueType.DOWNLOAD_OBJECT)
+    queue_b = get_queue(QueueType.CREATE_SIP)
+
+    queue_a.enqueue(enqueue_next_job, job_id="download_object_123456")
+    queue_a.enqueue(failing_job, job_id="download_object_654321")
+    queue_a.enqueue(successful_job, job_id="download_object_111111")
+
+    assert get_object_id2queue_map([123456, 654321, 111111]) == {
+        123456: ["download_object"],
+        654321: ["download_object"],
+        111111: ["download_object"]
+    }
+
+    SimpleWorker([queue_a], connection=queue_a.connection).work(burst=True)
+
+    # The finished job doesn't remove the entry for the job it enqueued
+    assert get_object_id2queue_map([123456, 654321, 111111]) == {
+        123456: ["create_sip"],
+        654321: ["download_object", "failed"],
+        111111: []
+    }
+    assert filter_enqueued_object_ids([123456, 654321, 111111]) == {
+        123456, 654321
+    }
+
+    SimpleWorker([queue_b], connection=queue_b.connection).work(burst=True)
+    assert filter_enqueued_object_ids([123456]) == set()
+
+    delete_jobs_for_object_id(654321)
+    assert filter_enqueued_object_ids([654321]) == set()
+
+
+def test_object_queue_index_rebuild(redis):
+    """
+    Test that the object queue index is built from the queues if it
+    doesn't exist
+    """
+    queue = get_queue(QueueType.SUBMIT_SIP)
+    queue.enqueue(successful_job, job_id="submit_sip_123456")
+    queue.enqueue(failing_job, job_id="submit_sip_654321")
+    SimpleWorker([queue], connection=queue.connection).work(burst=True)
+    queue.enqueue(successful_job, job_id="submit_sip_111111")
+
+    redis.delete(OBJECT_QUEUE_INDEX_KEY, OBJECT_QUEUE_INDEX_BUILT_KEY)
+
+    assert get_object_id2queue_map([123456, 654321, 111111]) == {
+        123456: [],
+        654321: ["submit_sip", "failed"],
+        111111: ["submit_sip"]
+    }
+    assert redis.exists(OBJECT_QUEUE_INDEX_BUILT_KEY)
+
+
+def test_object_queue_index_prune(redis):
+    """
+    Test that index entries are removed once their jobs no longer exist,
+    even if the RQ callbacks weren't called
+    """
+    queue_a = get_queue(QueueType.DOWNLOAD_OBJECT_HIGH)
+    queue_b = get_queue(QueueType.SUBMIT_SIP)
+    queue_a.enqueue(successful_job, job_id="download_object_123456")
+    queue_b.enqueue(failing_job, job_id="submit_sip_654321")
+    queue_b.enqueue(failing_job, job_id="submit_sip_111111")
+    SimpleWorker([queue_b], connection=queue_b.connection).work(burst=True)
+
+    assert get_indexed_object_ids() == {123456, 654321, 111111}
+
+    # Failed job expires from the registry, and another one is removed
+    # using the RQ command-line tools
+    redis.delete(queue_b.fetch_job("submit_sip_654321").key)
+    queue_b.failed_job_registry.remove("submit_sip_111111", delete_job=True)
+
+    assert get_indexed_object_ids() == {123456}
+    assert redis.hkeys(OBJECT_QUEUE_INDEX_KEY) == [b"123456"]
+
+
+def test_lock_objects(redis):
+    """
+    Test that operations concerning different objects can lock the workflow
+    concurrently, while operations on the same objects are serialized
+    """
+    def try_lock(object_ids):
+        lock = MultiLock(get_lock_stripe_names(object_ids))
+        if lock.acquire(blocking=False):
+            lock.release()
+            return True
+
+        return False
+
+    with lock_objects([1, 2, 3]):
+        # Objects in other stripes can be locked at the same time
+        assert try_lock([4, 5])
+        # Objects in the same stripes can't
+        assert not try_lock([3, 4])
+        assert not try_lock([2 + LOCK_STRIPE_COUNT])
+        # Nor can the entire workflow
+        assert not try_lock(range(LOCK_STRIPE_COUNT))
+
+        # Partially overlapping lock didn't leave any stripes locked
+        assert len(get_locks()) == 3
+
+    assert get_locks() == []
+
+    with lock_queues():
+        assert len(get_locks()) == LOCK_STRIPE_COUNT
+        assert not try_lock([123456])
+
+    assert try_lock([123456])
+
+
+def test_lock_queues_not_starved(redis):
+    """
+    Test that 'lock_queues' stops new 'lock_objects' calls while it waits,
+    instead of retrying until no stripe happens to be locked
+    """
+    def try_lock(object_ids):
+        lock = MultiLock(
+            get_lock_stripe_names(object_ids), barrier=GLOBAL_LOCK_BARRIER
+        )
+        if lock.acquire(blocking=False):
+            lock.release()
+            return True
+
+        return False
+
+    global_lock = MultiLock(
+        get_lock_stripe_names(range(LOCK_STRIPE_COUNT)),
+        barrier=GLOBAL_LOCK_BARRIER, reserve_barrier=True
+    )
+
+    with lock_objects([1]):
+        # Other stripes are still free, but the global lock is waiting
+        assert not global_lock.acquire(blocking=False)
+        assert try_lock([2])
+
+        # Global lock keeps waiting and reserves the barrier
+        acquired = []
+        thread = threading.Thread(
+            target=lambda: acquired.append(global_lock.acquire())
+        )
+        thread.start()
+        time.sleep(0.2)
+
+        # New operations can't lock any stripes in the meantime
+        assert not try_lock([2])
+        assert not acquired
+
+    # Global lock is acquired once the current holder is done
+    thread.join(timeout=5)
+    assert acquired == [True]
+    assert not try_lock([2])
+
+    global_lock.release()
+    assert try_lock([2])
+    assert get_locks() == []
+
+
+def test_multi_lock_renewal(redis):
+    """
+    Test that the locks are renewed while they are held
+    """
+    lock = MultiLock(["lock-a", "lock-b"], expire=0.3)
+    lock.acquire()
+
+    time.sleep(0.6)
+    assert [lock.name for lock in get_locks()] == ["lock-a", "lock-b"]
+
+    lock.release()
+    assert get_locks() == []
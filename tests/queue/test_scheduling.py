@@ -0,0 +1,198 @@
+from collections import namedtuple
+
+import pytest
+from passari_workflow.exceptions import JobDeferredError
+from passari_workflow.queue.queues import (OBJECT_QUEUE_INDEX_KEY, Priority,
+                                           QueueType, get_queue)
+from passari_workflow.queue.scheduling import (DISK_RESERVATIONS_KEY,
+                                               defer_current_job,
+                                               get_object_priorities,
+                                               release_disk_space,
+                                               reserve_disk_space)
+from passari_workflow.scripts.enqueue_objects import enqueue_object_batch
+
+DiskUsage = namedtuple("DiskUsage", ["total", "used", "free"])
+
+
+@pytest.fixture(scope="function")
+def scheduling_policy(monkeypatch):
+    monkeypatch.setattr(
+        "passari_workflow.queue.scheduling.NEW_OBJECT_PRIORITY", "normal"
+    )
+    monkeypatch.setattr(
+        "passari_workflow.queue.scheduling.UPDATED_OBJECT_PRIORITY", "high"
+    )
+    monkeypatch.setattr(
+        "passari_workflow.queue.scheduling.USER_PRIORITY", "high"
+    )
+    monkeypatch.setattr(
+        "passari_workflow.queue.scheduling.LARGE_OBJECT_ATTACHMENT_COUNT", 2
+    )
+
+
+@pytest.fixture(scope="function")
+def museum_objects(
+        session, museum_object_factory, museum_attachment_factory):
+    # New object
+    museum_object_factory(id=10)
+    # Updated object
+    museum_object_factory(id=20, preserved=True)
+    # Updated object with too many attachments
+    museum_object_factory(
+        id=30, preserved=True,
+        attachments=[
+            museum_attachment_factory(id=i, filename=f"test{i}.jpg")
+            for i in range(1, 4)
+        ]
+    )
+
+
+def test_get_object_priorities(session, scheduling_policy, museum_objects):
+    """
+    Test that the priorities are determined according to the configured
+    scheduling policy
+    """
+    assert get_object_priorities([10, 20, 30, 40]) == {
+        10: Priority.NORMAL,
+        20: Priority.HIGH,
+        30: Priority.LOW,
+        # Unknown object gets the priority of a new object
+        40: Priority.NORMAL
+    }
+
+    # Objects requested by the user all get the same priority
+    assert get_object_priorities([10, 30], user_requested=True) == {
+        10: Priority.HIGH,
+        30: Priority.HIGH
+    }
+
+
+def test_enqueue_object_batch_priorities(
+        redis, session, scheduling_policy, museum_objects):
+    """
+    Test that the objects are enqueued to the queue corresponding to their
+    priority
+    """
+    jobs = enqueue_object_batch([10, 20, 30])
+
+    # Jobs with the highest priority are enqueued first
+    assert [job.id for job in jobs] == [
+        "download_object_20", "download_object_10", "download_object_30"
+    ]
+
+    assert get_queue(QueueType.DOWNLOAD_OBJECT_HIGH).job_ids == [
+        "download_object_20"
+    ]
+    assert get_queue(QueueType.DOWNLOAD_OBJECT).job_ids == [
+        "download_object_10"
+    ]
+    assert get_queue(QueueType.DOWNLOAD_OBJECT_LOW).job_ids == [
+        "download_object_30"
+    ]
+
+
+@pytest.fixture(scope="function")
+def disk_usage(monkeypatch):
+    """
+    Set the free space in the package directory
+    """
+    usage = {"free": 0}
+
+    monkeypatch.setattr(
+        "passari_workflow.queue.scheduling.MIN_FREE_SPACE", 100
+    )
+    monkeypatch.setattr(
+        "passari_workflow.queue.scheduling.shutil.disk_usage",
+        lambda path: DiskUsage(total=0, used=0, free=usage["free"])
+    )
+
+    return usage
+
+
+def test_reserve_disk_space(redis, session, disk_usage):
+    """
+    Test that objects are only admitted if there is enough free space
+    after the reservations of the other objects in the workflow
+    """
+    enqueue_object_batch([10, 20, 30])
+    disk_usage["free"] = 1100
+
+    # The first object is admitted even if it doesn't fit
+    assert reserve_disk_space(10, 2000)
+    release_disk_space(10)
+
+    assert reserve_disk_space(10, 600)
+    assert reserve_disk_space(20, 400)
+    assert not reserve_disk_space(30, 1)
+
+    # Reservation is freed once the object has been processed
+    release_disk_space(20)
+    assert reserve_disk_space(30, 400)
+
+    # Reservations of objects no longer in the workflow are ignored
+    # and removed
+    get_queue(QueueType.DOWNLOAD_OBJECT).empty()
+    redis.delete(OBJECT_QUEUE_INDEX_KEY)
+    enqueue_object_batch([40])
+
+    assert reserve_disk_space(40, 1000)
+    assert redis.hkeys(DISK_RESERVATIONS_KEY) == [b"40"]
+
+
+def test_reserve_disk_space_partially_written(
+        redis, session, disk_usage, museum_packages_dir):
+    """
+    Test that the files an admitted object has already written are only
+    counted once, as they are already missing from the free space
+    """
+    enqueue_object_batch([10, 20, 30])
+    disk_usage["free"] = 1100
+
+    assert reserve_disk_space(10, 600)
+
+    # Object 10 has written 400 of its 600 bytes, leaving 700 bytes free
+    (museum_packages_dir / "10").mkdir()
+    (museum_packages_dir / "10" / "file.jpg").write_bytes(b"a" * 400)
+    disk_usage["free"] = 700
+
+    # 200 bytes are still reserved for object 10, so 400 bytes fit
+    assert reserve_disk_space(20, 400)
+    assert not reserve_disk_space(30, 1)
+
+    # Files written beyond the reservation don't count as negative
+    (museum_packages_dir / "10" / "file2.jpg").write_bytes(b"a" * 400)
+    disk_usage["free"] = 300
+    release_disk_space(20)
+
+    assert reserve_disk_space(30, 200)
+    assert not reserve_disk_space(20, 1)
+
+
+def test_defer_current_job(redis, monkeypatch):
+    """
+    Test that a deferred job is scheduled to be retried with an increasing
+    delay
+    """
+    monkeypatch.setattr(
+        "passari_workflow.queue.scheduling.DEFERRAL_DELAY", 60
+    )
+    monkeypatch.setattr(
+        "passari_workflow.queue.scheduling.MAX_DEFERRAL_DELAY", 200
+    )
+
+    job = get_queue(QueueType.DOWNLOAD_OBJECT).enqueue(
+        print, job_id="download_object_10"
+    )
+    monkeypatch.setattr(
+        "passari_workflow.queue.scheduling.get_current_job", lambda: job
+    )
+
+    for expected_delay in (60, 120, 200):
+        with pytest.raises(JobDeferredError):
+            defer_current_job("Not enough space")
+
+        assert job.retries_left == 1
+        assert job.retry_intervals == [expected_delay]
+
+    job.refresh()
+    assert job.meta["deferral_count"] == 3
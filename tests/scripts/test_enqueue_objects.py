@@ -4,6 +4,8 @@ import pytest
 from passari_workflow.queue.queues import QueueType, get_queue
 from passari_workflow.scripts.enqueue_objects import \
     cli as enqueue_objects_cli
+from passari_workflow.scripts.enqueue_objects import \
+    enqueue_objects as enqueue_objects_func
 
 TEST_DATE = datetime.datetime(
     2019, 1, 2, 10, 0, 0, 0, tzinfo=datetime.timezone.utc
@@ -94,3 +96,79 @@ def test_enqueue_objects_with_object_ids(
 
     assert "download_object_5" in queue.job_ids
     assert "download_object_8" in queue.job_ids
+
+
+def test_enqueue_objects_with_string_object_ids(
+        redis, session, museum_object_factory):
+    """
+    Enqueue object IDs provided as strings, as done by the deferred
+    'enqueue_objects' job
+    """
+    for i in range(0, 5):
+        museum_object_factory(
+            id=i, preserved=False,
+            metadata_hash="", attachment_metadata_hash=""
+        )
+
+    assert enqueue_objects_func(object_ids=["1", "2"], object_count=2) == 2
+
+    queue = get_queue(QueueType.DOWNLOAD_OBJECT)
+    assert set(queue.job_ids) == {"download_object_1", "download_object_2"}
+
+
+def test_enqueue_objects_batch_size(
+        redis, session, enqueue_objects, museum_object_factory):
+    """
+    Enqueue objects using a batch size smaller than the amount of objects
+    """
+    for i in range(0, 5):
+        museum_object_factory(
+            id=i, preserved=False,
+            metadata_hash="", attachment_metadata_hash=""
+        )
+
+    result = enqueue_objects(["--object-count", "10", "--batch-size", "2"])
+    assert "5 object(s) enqueued" in result.stdout
+
+    queue = get_queue(QueueType.DOWNLOAD_OBJECT)
+    assert sorted(queue.job_ids) == [
+        f"download_object_{i}" for i in range(0, 5)
+    ]
+
+    job = queue.fetch_job("download_object_3")
+    assert job.kwargs == {"object_id": 3}
+    assert job.timeout == 14400
+
+
+def test_enqueue_objects_random(
+        redis, session, enqueue_objects, museum_object_factory, monkeypatch):
+    """
+    Enqueue objects starting from a random object ID, wrapping around to the
+    lowest object ID once the highest one is reached
+    """
+    for i in range(0, 20):
+        museum_object_factory(
+            id=i, preserved=False,
+            metadata_hash="", attachment_metadata_hash=""
+        )
+
+    monkeypatch.setattr(
+        "passari_workflow.scripts.enqueue_objects.randint",
+        lambda a, b: 17
+    )
+
+    result = enqueue_objects(["--object-count", "5", "--random"])
+    assert "5 object(s) enqueued" in result.stdout
+
+    queue = get_queue(QueueType.DOWNLOAD_OBJECT)
+    assert sorted(queue.job_ids) == sorted(
+        f"download_object_{i}" for i in (17, 18, 19, 0, 1)
+    )
+
+    # Objects that are already enqueued are skipped
+    result = enqueue_objects(["--object-count", "5", "--random"])
+    assert "5 object(s) enqueued" in result.stdout
+
+    assert sorted(queue.job_ids) == sorted(
+        f"download_object_{i}" for i in (17, 18, 19, 0, 1, 2, 3, 4, 5, 6)
+    )
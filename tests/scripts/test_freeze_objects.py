@@ -3,6 +3,7 @@ from passari_workflow.db.models import (FreezeSource, MuseumObject,
                                         MuseumPackage)
 from passari_workflow.exceptions import WorkflowJobRunningError
 from passari_workflow.queue.queues import QueueType, get_queue
+from passari_workflow.queue.scheduling import DISK_RESERVATIONS_KEY
 from passari_workflow.scripts.freeze_objects import cli as freeze_objects_cli
 from rq import SimpleWorker
 from rq.registry import StartedJobRegistry
@@ -140,6 +141,7 @@ def test_freeze_objects_existing_dirs(
 
     (museum_packages_dir / "123456" / "data" / "reports").mkdir(parents=True)
     (museum_packages_dir / "654321" / "data" / "reports").mkdir(parents=True)
+    redis.hset(DISK_RESERVATIONS_KEY, mapping={123456: 1000, 654321: 1000})
 
     freeze_objects([
         "--delete-jobs", "--reason", "Test reason", "654321", "123456"
@@ -149,6 +151,9 @@ def test_freeze_objects_existing_dirs(
     assert not (museum_packages_dir / "123456").is_dir()
     assert not (museum_packages_dir / "654321").is_dir()
 
+    # Disk space reservations were released as well
+    assert not redis.exists(DISK_RESERVATIONS_KEY)
+
 
 def test_freeze_objects_cancel_package(
         session, freeze_objects, redis, museum_object_factory,
@@ -0,0 +1,50 @@
+import pytest
+import redis_lock
+from passari_workflow.redis.locks import get_locks, get_object_lock
+from passari_workflow.scripts.locks import cli as locks_cli
+
+
+@pytest.fixture(scope="function")
+def locks(cli):
+    def func(args, **kwargs):
+        return cli(locks_cli, args, **kwargs)
+
+    return func
+
+
+@pytest.fixture(scope="function")
+def held_locks(redis):
+    # Lock that is renewed by the process holding it
+    lease_lock = get_object_lock(123)
+    lease_lock.acquire()
+
+    # Lock without an expiration time left behind by a crashed process
+    redis_lock.Lock(redis, "lock-object-456", id="crashed").acquire()
+
+    yield
+
+    lease_lock.release()
+
+
+def test_locks_list(locks, held_locks):
+    result = locks([])
+
+    assert "lock-object-123" in result.stdout
+    assert "lock-object-456\towner=crashed\tSTALE" in result.stdout
+    assert "2 lock(s)" in result.stdout
+
+    result = locks(["--stale"])
+
+    assert "lock-object-123" not in result.stdout
+    assert "lock-object-456" in result.stdout
+    assert "1 lock(s)" in result.stdout
+
+
+def test_locks_reset_stale(locks, held_locks):
+    result = locks(["--reset-stale"])
+
+    assert "Released lock lock-object-456" in result.stdout
+
+    # Only the stale lock was released
+    assert [lock.name for lock in get_locks()] == ["lock-object-123"]
+    assert 0 < get_locks()[0].ttl <= 60
@@ -0,0 +1,28 @@
+from passari_workflow.queue.queues import (OBJECT_QUEUE_INDEX_KEY, QueueType,
+                                           get_object_id2queue_map, get_queue)
+from passari_workflow.scripts.rebuild_queue_index import \
+    cli as rebuild_queue_index_cli
+from rq import SimpleWorker
+
+
+def failing_job():
+    raise RuntimeError("Job failed")
+
+
+def test_rebuild_queue_index(cli, redis):
+    queue = get_queue(QueueType.CREATE_SIP)
+    queue.enqueue(failing_job, job_id="create_sip_123")
+    SimpleWorker([queue], connection=queue.connection).work(burst=True)
+
+    # Failed job was requeued using the RQ command-line tools, which
+    # doesn't update the index
+    queue.failed_job_registry.requeue("create_sip_123")
+    redis.hset(OBJECT_QUEUE_INDEX_KEY, 456, "submit_sip")
+
+    result = cli(rebuild_queue_index_cli, [])
+
+    assert "1 object(s) in the workflow" in result.stdout
+    assert get_object_id2queue_map([123, 456]) == {
+        123: ["create_sip"],
+        456: []
+    }
@@ -3,6 +3,7 @@ import pytest
 from passari_workflow.scripts.sync_hashes import cli as sync_hashes_cli
 
 from passari_workflow.db.models import MuseumObject
+from passari_workflow.scripts.utils import add_dirty_object_ids
 
 
 @pytest.fixture(scope="function")
@@ -60,3 +61,140 @@ def test_sync_hashes(
     assert museum_object_a.attachment_metadata_hash == expected_hash
     assert museum_object_b.attachment_metadata_hash == ""
     assert museum_object_c.attachment_metadata_hash is None
+
+
+def test_sync_hashes_incremental(
+        sync_hashes, session, redis, museum_object_factory,
+        museum_attachment_factory):
+    """
+    Sync hashes incrementally and ensure only objects marked as dirty
+    are processed
+    """
+    museum_object_factory(id=10)
+    museum_object_factory(id=20)
+    museum_object_factory(
+        id=30,
+        attachments=[
+            museum_attachment_factory(
+                metadata_hash="1568e677140ab834ebdbd98ffa092a273af66084eb04e13b9d07be493847b94f"
+            )
+        ]
+    )
+
+    # Objects 20 and 30 were changed. Object 30 was already claimed by an
+    # earlier interrupted run.
+    add_dirty_object_ids([20])
+    redis.sadd("sync_hashes:claimed_dirty_object_ids", 30)
+
+    sync_hashes(["--incremental"])
+
+    assert session.query(MuseumObject).get(10).attachment_metadata_hash \
+        is None
+    assert session.query(MuseumObject).get(20).attachment_metadata_hash == ""
+    assert session.query(MuseumObject).get(30).attachment_metadata_hash \
+        == "aea044f7ec218b7212661d2890156e4349d22e257415b80cf04444acd88f35fe"
+
+    # Dirty object IDs were consumed
+    assert not redis.exists("sync_hashes:dirty_object_ids")
+    assert not redis.exists("sync_hashes:claimed_dirty_object_ids")
+
+    # Full run processes the rest
+    sync_hashes([])
+
+    assert session.query(MuseumObject).get(10).attachment_metadata_hash == ""
+
+
+def test_sync_hashes_sql_engine(
+        sync_hashes, session, museum_object_factory,
+        museum_attachment_factory):
+    """
+    Sync hashes using both engines and ensure the results are identical
+    """
+    def create_objects():
+        attachment_hashes = [
+            "1568e677140ab834ebdbd98ffa092a273af66084eb04e13b9d07be493847b94f",
+            "a7c4f6c82ab5ed73a359c5d875a9870d899a0642922b6f852539d048676dac74",
+            "",
+            "ä",
+            "Z",
+            None
+        ]
+        attachment_sets = [
+            [0, 1], [1, 0], [], [2], [3, 4, 0], [0, 5], [5]
+        ]
+        for i, attachment_set in enumerate(attachment_sets):
+            museum_object_factory(
+                id=i + 1,
+                attachment_metadata_hash="outdated",
+                attachments=[
+                    museum_attachment_factory(
+                        metadata_hash=attachment_hashes[index]
+                    )
+                    for index in attachment_set
+                ]
+            )
+
+    def get_hashes():
+        session.expire_all()
+        return [
+            museum_object.attachment_metadata_hash
+            for museum_object in
+            session.query(MuseumObject).order_by(MuseumObject.id)
+        ]
+
+    create_objects()
+    sync_hashes(["--engine", "python"])
+    python_hashes = get_hashes()
+
+    session.query(MuseumObject).update(
+        {MuseumObject.attachment_metadata_hash: "outdated"}
+    )
+    session.commit()
+
+    sync_hashes(["--engine", "sql"])
+    sql_hashes = get_hashes()
+
+    assert python_hashes == sql_hashes
+    assert python_hashes[0] == python_hashes[1] == (
+        "be2c3265f2c8f4b05e287ac9fae8a25dad227bda2ebb60ac8dcc929d6b891c27"
+    )
+    assert python_hashes[2] == ""
+    # Objects with incomplete attachments are skipped
+    assert python_hashes[5] == python_hashes[6] == "outdated"
+
+
+@pytest.mark.parametrize("incremental", [False, True])
+def test_sync_hashes_workers(
+        sync_hashes, session, museum_object_factory,
+        museum_attachment_factory, incremental):
+    """
+    Sync hashes using multiple worker processes
+    """
+    for object_id in range(1, 11):
+        museum_object_factory(
+            id=object_id,
+            attachments=[
+                museum_attachment_factory(
+                    metadata_hash="1568e677140ab834ebdbd98ffa092a273af66084eb04e13b9d07be493847b94f"
+                )
+            ] if object_id % 2 else []
+        )
+
+    if incremental:
+        add_dirty_object_ids(range(1, 11))
+
+    args = ["--workers", "3"]
+    if incremental:
+        args.append("--incremental")
+
+    result = sync_hashes(args)
+
+    assert "Finished, 10 iterated, 10 updated and 0 skipped" in result.stdout
+
+    hashes = [
+        museum_object.attachment_metadata_hash for museum_object
+        in session.query(MuseumObject).order_by(MuseumObject.id)
+    ]
+    assert hashes == [
+        "aea044f7ec218b7212661d2890156e4349d22e257415b80cf04444acd88f35fe", ""
+    ] * 5
@@ -300,3 +300,47 @@ def test_sync_objects_second_run_filter(
     assert sync_status.prev_start_sync_date == datetime.datetime(
         2019, 2, 2, tzinfo=datetime.timezone.utc
     )
+
+
+def test_sync_objects_save_progress_failed_chunk(
+        sync_objects, session, monkeypatch):
+    """
+    Fail writing the second chunk while the next chunks are already being
+    retrieved and ensure progress isn't saved past the failed chunk
+    """
+    from passari_workflow.scripts import sync_objects as sync_objects_module
+
+    monkeypatch.setattr(
+        "passari_workflow.scripts.sync_objects.CHUNK_SIZE", 3
+    )
+
+    update_objects = sync_objects_module.update_objects
+    calls = []
+
+    def mock_update_objects(results):
+        calls.append(results)
+        if len(calls) == 2:
+            raise RuntimeError("Database went away")
+
+        return update_objects(results)
+
+    monkeypatch.setattr(
+        "passari_workflow.scripts.sync_objects.update_objects",
+        mock_update_objects
+    )
+
+    with pytest.raises(RuntimeError):
+        sync_objects(["--save-progress"])
+
+    # Only the first chunk was written, and the chunks retrieved after
+    # the failed one were discarded
+    assert len(calls) == 2
+    assert session.query(MuseumObject).count() == 3
+
+    sync_status = (
+        session.query(SyncStatus)
+        .filter_by(name="sync_objects")
+        .first()
+    )
+    assert sync_status.offset == 3
+    assert sync_status.start_sync_date
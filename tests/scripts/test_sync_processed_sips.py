@@ -1,4 +1,5 @@
 import datetime
+import logging
 import os
 import shutil
 import time
@@ -6,10 +7,16 @@ from pathlib import Path
 
 import freezegun
 import pytest
+from passari.dpres.ssh import connect_dpres_sftp
 from passari_workflow.db.models import MuseumObject, MuseumPackage
 from passari_workflow.queue.queues import QueueType, get_queue
 from passari_workflow.scripts.sync_processed_sips import \
     cli as sync_processed_sips_cli
+from passari_workflow.scripts.sync_processed_sips import (
+    SFTPClientPool, combine_results, create_sip_results, fetch_report,
+    finish_sip, get_outstanding_sip_filenames, get_processed_sips,
+    get_report_transfers, get_sip_uploads, get_unconfirmed_packages,
+    update_sips)
 
 TEST_DATE = datetime.datetime(
     2019, 1, 2, 10, 0, 0, 0, tzinfo=datetime.timezone.utc
@@ -29,6 +36,93 @@ def sync_processed_sips(cli, museum_packages_dir, monkeypatch):
     return func
 
 
+@pytest.fixture(scope="function")
+def get_sip_results():
+    """
+    Returns a function to retrieve the processed SIPs of the outstanding
+    packages, sorted by SIP filename
+    """
+    def func(sftp):
+        sip_filenames = get_outstanding_sip_filenames()
+
+        with freezegun.freeze_time("2019-06-01"):
+            results = combine_results(*[
+                get_processed_sips(
+                    sftp, status=status, days=7, sip_filenames=sip_filenames
+                )
+                for status in ("accepted", "rejected")
+            ])
+
+        return sorted(results, key=lambda sip: sip.sip_filename)
+
+    return func
+
+
+@pytest.fixture(scope="function")
+def processed_packages(
+        session, museum_packages_dir, sftp_dir, redis, monkeypatch,
+        sftp_package_factory, museum_object_factory,
+        local_museum_package_factory):
+    """
+    Create five uploaded packages that have been accepted or rejected by the
+    DPRES service
+
+    :returns: {object_id: status} dict
+    """
+    monkeypatch.setattr(
+        "passari_workflow.scripts.sync_processed_sips.PACKAGE_DIR",
+        str(museum_packages_dir)
+    )
+
+    statuses = {
+        1: "accepted", 2: "rejected", 3: "accepted", 4: "rejected",
+        5: "accepted"
+    }
+
+    for object_id, status in statuses.items():
+        sftp_package_factory(
+            status=status, date=datetime.datetime(2019, 5, 28),
+            object_id=object_id, transfer_id="aabbcc",
+            content=f"Report {object_id}"
+        )
+        local_museum_package_factory(
+            sip_filename=f"20190102_Object_{object_id}.tar",
+            downloaded=True,
+            packaged=True,
+            uploaded=True,
+            museum_object=museum_object_factory(id=object_id)
+        )
+
+    return statuses
+
+
+def assert_confirmed(session, museum_packages_dir, statuses):
+    """
+    Assert that exactly the given SIPs have been confirmed with the given
+    statuses
+    """
+    for package in session.query(MuseumPackage):
+        object_id = package.museum_object_id
+        status = statuses.get(object_id)
+        status_path = (
+            museum_packages_dir / str(object_id)
+            / f"{package.sip_filename}.status"
+        )
+
+        assert package.preserved == (status == "accepted")
+        assert package.rejected == (status == "rejected")
+
+        if status:
+            assert status_path.read_text() == status
+        else:
+            assert not status_path.exists()
+
+    queue = get_queue(QueueType.CONFIRM_SIP)
+    assert set(queue.job_ids) == {
+        f"confirm_sip_{object_id}" for object_id in statuses
+    }
+
+
 @pytest.fixture(scope="function")
 def sftp_package_factory(sftp_dir):
     (sftp_dir / "accepted").mkdir()
@@ -131,8 +225,9 @@ def test_sync_processed_sips_accepted(
     with freezegun.freeze_time("2019-06-01"):
         result = sync_processed_sips(["--days", "7"])
 
-    assert "Found 2 on 2019-05-28" in result.stdout
-    assert "Found 2 accepted SIPs" in result.stdout
+    # The SIP without a corresponding unconfirmed package is not crawled
+    assert "Found 1 on 2019-05-28" in result.stdout
+    assert "Found 1 accepted SIPs" in result.stdout
     assert "Found 0 rejected SIPs" in result.stdout
 
     # Ingest reports are downloaded
@@ -298,13 +393,326 @@ def test_sync_processed_sips_skipped(
     # Only one will be found since the rest were skipped automatically
     assert "Found 1 on 2019-05-28" in result.stdout
     assert "Found 1 accepted SIPs" in result.stdout
+    # The unchanged directory wasn't listed again
+    assert "Skipped listing 1 unchanged directories" in result.stdout
 
     assert (
         museum_packages_dir / "1"
         / "20190102_Object_1.tar.status"
     ).read_text() == "accepted"
 
+    # No SIPs are awaiting processing, so nothing is crawled
     with freezegun.freeze_time("2019-06-01"):
         result = sync_processed_sips(["--days", 7])
 
-    assert "Found 0 on 2019-05-28" in result.stdout
+    assert "0 SIPs are awaiting processing" in result.stdout
+    assert "Found 0 accepted SIPs" not in result.stdout
+
+
+def test_get_processed_sips_concurrent(
+        sftp_dir, sftp_package_factory, monkeypatch, caplog):
+    """
+    Test that crawling the directories concurrently gives the same results
+    in the same order as crawling them sequentially
+    """
+    caplog.set_level(logging.INFO)
+
+    sip_counts = {"2019-05-28": 3, "2019-05-29": 2, "2019-05-31": 4}
+    object_id = 0
+
+    for date_dir, count in sip_counts.items():
+        for _ in range(0, count):
+            object_id += 1
+            sftp_package_factory(
+                status="accepted",
+                date=datetime.datetime.strptime(date_dir, "%Y-%m-%d"),
+                object_id=object_id, transfer_id="aabbcc",
+                content=f"Report {object_id}"
+            )
+
+    sip_filenames = {
+        f"20190102_Object_{i}.tar" for i in range(1, object_id + 1)
+    }
+
+    clients = []
+
+    def mock_get_client(self):
+        client = get_client(self)
+        if client not in clients:
+            clients.append(client)
+
+        return client
+
+    get_client = SFTPClientPool.get_client
+    monkeypatch.setattr(SFTPClientPool, "get_client", mock_get_client)
+
+    with freezegun.freeze_time("2019-06-01"):
+        with connect_dpres_sftp() as sftp:
+            # Crawl the directories one by one, newest first
+            expected_results = []
+            for date_dir in sorted(sip_counts, reverse=True):
+                for sip_filename in sftp.listdir(f"accepted/{date_dir}"):
+                    expected_results += create_sip_results(
+                        "accepted", date_dir, sip_filename,
+                        get_sip_uploads(
+                            sftp, Path("accepted", date_dir, sip_filename)
+                        )
+                    )
+
+            results = get_processed_sips(
+                sftp, status="accepted", days=7, sip_filenames=sip_filenames,
+                workers=4
+            )
+
+            assert results == expected_results
+            assert len(results) == 9
+
+    for date_dir, count in sip_counts.items():
+        assert f"Found {count} on {date_dir}" in caplog.text
+
+    # Multiple SFTP channels were used, and all of them were closed
+    assert len(clients) > 1
+    assert all(client.get_channel().closed for client in clients)
+
+
+def test_get_processed_sips_crawl_state(sftp_dir, sftp_package_factory):
+    """
+    Test that date directories that won't change anymore are not listed
+    again unless they have changed since the last run
+    """
+    old_date_dir = sftp_dir / "accepted" / "2019-05-28"
+
+    sftp_package_factory(
+        status="accepted", date=datetime.datetime(2019, 5, 28),
+        object_id=123456, transfer_id="aabbcc", content="Old"
+    )
+    sftp_package_factory(
+        status="accepted", date=datetime.datetime(2019, 6, 1),
+        object_id=654321, transfer_id="ccbbaa", content="New"
+    )
+
+    sip_filenames = {
+        "20190102_Object_123456.tar", "20190102_Object_123457.tar",
+        "20190102_Object_654321.tar"
+    }
+    crawl_state = {}
+
+    with freezegun.freeze_time("2019-06-01"):
+        with connect_dpres_sftp() as sftp:
+            results = get_processed_sips(
+                sftp, status="accepted", days=7, sip_filenames=sip_filenames,
+                crawl_state=crawl_state
+            )
+            assert [result.sip_filename for result in results] == [
+                "20190102_Object_654321.tar", "20190102_Object_123456.tar"
+            ]
+            assert set(crawl_state.keys()) == {"2019-05-28", "2019-06-01"}
+            assert crawl_state["2019-05-28"]["sip_filenames"] == [
+                "20190102_Object_123456.tar"
+            ]
+
+            # The older directory hasn't changed, so its saved listing is
+            # used instead of listing it again. The outstanding SIP in it
+            # is still found.
+            results = get_processed_sips(
+                sftp, status="accepted", days=7, sip_filenames=sip_filenames,
+                crawl_state=crawl_state
+            )
+            assert [result.sip_filename for result in results] == [
+                "20190102_Object_654321.tar", "20190102_Object_123456.tar"
+            ]
+
+            # The recent directory is always listed again. Remove its SIP
+            # from the saved listings to confirm which directories were
+            # listed.
+            crawl_state["2019-06-01"]["sip_filenames"] = []
+            crawl_state["2019-05-28"]["sip_filenames"] = []
+
+            results = get_processed_sips(
+                sftp, status="accepted", days=7, sip_filenames=sip_filenames,
+                crawl_state=crawl_state
+            )
+            assert [result.sip_filename for result in results] == [
+                "20190102_Object_654321.tar"
+            ]
+
+            # The older directory is listed again once it changes. SIPs
+            # that aren't outstanding are not crawled.
+            sftp_package_factory(
+                status="accepted", date=datetime.datetime(2019, 5, 28),
+                object_id=123457, transfer_id="ddeeff", content="Late"
+            )
+            # Ensure the modification time changes even if the SIP was
+            # added within the same second
+            mtime = old_date_dir.stat().st_mtime + 10
+            os.utime(old_date_dir, (mtime, mtime))
+
+            results = get_processed_sips(
+                sftp, status="accepted", days=7,
+                sip_filenames=sip_filenames - {"20190102_Object_123456.tar"},
+                crawl_state=crawl_state
+            )
+            assert [result.sip_filename for result in results] == [
+                "20190102_Object_654321.tar", "20190102_Object_123457.tar"
+            ]
+
+    # Directories outside the crawled period are forgotten
+    with freezegun.freeze_time("2019-06-10"):
+        with connect_dpres_sftp() as sftp:
+            get_processed_sips(
+                sftp, status="accepted", days=10, sip_filenames=sip_filenames,
+                crawl_state=crawl_state
+            )
+            assert set(crawl_state.keys()) == {"2019-06-01"}
+
+
+def test_get_outstanding_sip_filenames(museum_package_factory):
+    """
+    Test that only the SIPs awaiting processing are retrieved
+    """
+    museum_package_factory(sip_filename="uploaded.tar", uploaded=True)
+    museum_package_factory(sip_filename="packaged.tar", packaged=True)
+    museum_package_factory(
+        sip_filename="preserved.tar", uploaded=True, preserved=True
+    )
+    museum_package_factory(
+        sip_filename="rejected.tar", uploaded=True, rejected=True
+    )
+    museum_package_factory(
+        sip_filename="cancelled.tar", uploaded=True, cancelled=True
+    )
+
+    assert get_outstanding_sip_filenames() == {"uploaded.tar"}
+
+
+def test_update_sips_chunks(
+        session, museum_packages_dir, processed_packages, get_sip_results,
+        monkeypatch):
+    """
+    Test that accepted and rejected SIPs are updated in chunks
+    """
+    chunks = []
+
+    def mock_get_unconfirmed_packages(sip_filenames):
+        chunks.append(len(sip_filenames))
+        return get_unconfirmed_packages(sip_filenames)
+
+    monkeypatch.setattr(
+        "passari_workflow.scripts.sync_processed_sips."
+        "get_unconfirmed_packages",
+        mock_get_unconfirmed_packages
+    )
+
+    with connect_dpres_sftp() as sftp:
+        sip_results = get_sip_results(sftp)
+        assert len(sip_results) == 5
+
+        update_sips(sip_results, sftp=sftp, chunk_size=2, workers=2)
+
+    assert chunks == [2, 2, 1]
+
+    session.expire_all()
+    assert_confirmed(session, museum_packages_dir, processed_packages)
+
+
+def test_update_sips_confirm_processed_on_error(
+        session, museum_packages_dir, processed_packages, get_sip_results,
+        monkeypatch):
+    """
+    Test that the SIPs processed before a failing SIP in the same chunk are
+    still confirmed
+    """
+    def mock_finish_sip(sip, sftp, object_id):
+        if object_id == 3:
+            raise RuntimeError("Failed to finish SIP")
+
+        return finish_sip(sip, sftp=sftp, object_id=object_id)
+
+    monkeypatch.setattr(
+        "passari_workflow.scripts.sync_processed_sips.finish_sip",
+        mock_finish_sip
+    )
+
+    with connect_dpres_sftp() as sftp:
+        sip_results = get_sip_results(sftp)
+
+        with pytest.raises(RuntimeError):
+            update_sips(sip_results, sftp=sftp, chunk_size=5, workers=2)
+
+    # The accepted and the rejected SIP before the failing one were
+    # confirmed in the same update
+    session.expire_all()
+    assert_confirmed(
+        session, museum_packages_dir, {1: "accepted", 2: "rejected"}
+    )
+
+
+def test_update_sips_download_failed(
+        session, museum_packages_dir, processed_packages, get_sip_results,
+        monkeypatch):
+    """
+    Test that the SIPs before a SIP whose ingest report can't be downloaded
+    are confirmed, and the SIPs after it are not
+    """
+    failing_sip_filenames = {"20190102_Object_3.tar"}
+
+    def mock_fetch_report(sftp, remote_path, temp_path, report_path):
+        if remote_path.parent.name in failing_sip_filenames:
+            raise IOError("Download failed")
+
+        return fetch_report(sftp, remote_path, temp_path, report_path)
+
+    monkeypatch.setattr(
+        "passari_workflow.scripts.sync_processed_sips.fetch_report",
+        mock_fetch_report
+    )
+
+    with connect_dpres_sftp() as sftp:
+        sip_results = get_sip_results(sftp)
+
+        with pytest.raises(IOError):
+            update_sips(sip_results, sftp=sftp, chunk_size=5, workers=2)
+
+    session.expire_all()
+    assert_confirmed(
+        session, museum_packages_dir, {1: "accepted", 2: "rejected"}
+    )
+
+    # The SIPs are confirmed on the next run once the download succeeds
+    failing_sip_filenames.clear()
+
+    with connect_dpres_sftp() as sftp:
+        update_sips(get_sip_results(sftp), sftp=sftp, chunk_size=5)
+
+    session.expire_all()
+    assert_confirmed(session, museum_packages_dir, processed_packages)
+
+
+def test_update_sips_bad_package_dir(
+        session, museum_packages_dir, processed_packages, get_sip_results,
+        monkeypatch):
+    """
+    Test that the SIPs before a SIP whose local package can't be loaded
+    are confirmed
+    """
+    def mock_get_report_transfers(sip, object_id):
+        if object_id == 3:
+            raise OSError("Package directory can't be read")
+
+        return get_report_transfers(sip, object_id)
+
+    monkeypatch.setattr(
+        "passari_workflow.scripts.sync_processed_sips.get_report_transfers",
+        mock_get_report_transfers
+    )
+
+    with connect_dpres_sftp() as sftp:
+        sip_results = get_sip_results(sftp)
+
+        with pytest.raises(OSError):
+            update_sips(sip_results, sftp=sftp, chunk_size=5, workers=2)
+
+    session.expire_all()
+    assert_confirmed(
+        session, museum_packages_dir, {1: "accepted", 2: "rejected"}
+    )
@@ -0,0 +1,40 @@
+from passari_workflow.config import CONFIG
+from passari_workflow.redis.connection import get_redis_connection
+
+
+def test_get_redis_connection_cached(monkeypatch):
+    """
+    Test that the same Redis client is reused within a process
+    """
+    monkeypatch.setitem(CONFIG, "redis", {"url": "redis://localhost/0"})
+    monkeypatch.setattr(
+        "passari_workflow.redis.connection._CLIENTS", {}
+    )
+
+    redis = get_redis_connection()
+    assert get_redis_connection() is redis
+    assert redis.connection_pool.connection_kwargs["db"] == 0
+
+    # Different URL uses a different client
+    monkeypatch.setitem(CONFIG, "redis", {"url": "redis://localhost/1"})
+    redis_b = get_redis_connection()
+    assert redis_b is not redis
+    assert redis_b.connection_pool.connection_kwargs["db"] == 1
+
+
+def test_get_redis_connection_fork(monkeypatch):
+    """
+    Test that a forked process doesn't reuse the parent's Redis client
+    """
+    monkeypatch.setitem(CONFIG, "redis", {"url": "redis://localhost/0"})
+    monkeypatch.setattr(
+        "passari_workflow.redis.connection._CLIENTS", {}
+    )
+
+    parent_redis = get_redis_connection()
+
+    monkeypatch.setattr("os.getpid", lambda: -1)
+    child_redis = get_redis_connection()
+
+    assert child_redis is not parent_redis
+    assert get_redis_connection() is child_redis
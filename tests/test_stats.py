@@ -0,0 +1,81 @@
+import datetime
+
+from passari_workflow.heartbeat import HeartbeatSource, get_heartbeats
+from passari_workflow.queue.queues import QueueType, get_queue
+from passari_workflow.stats import (ObjectStat, get_stats, reconcile_stats,
+                                    update_stats)
+from rq import SimpleWorker
+
+
+def failing_job():
+    raise RuntimeError("Failed")
+
+
+def test_stats_reconcile(
+        session, museum_object_factory, museum_package_factory):
+    """
+    Test that the counters are replaced with the counts from the database
+    when reconciling
+    """
+    now = datetime.datetime.now(datetime.timezone.utc)
+
+    # Counts haven't been reconciled yet
+    stats = get_stats()
+    assert stats[ObjectStat.PENDING] is None
+    assert stats[ObjectStat.FROZEN] is None
+
+    # Pending preservation
+    museum_object_factory(
+        id=10, created_date=now - datetime.timedelta(days=60),
+        metadata_hash="", attachment_metadata_hash=""
+    )
+    # Frozen
+    museum_object_factory(
+        id=20, frozen=True, metadata_hash="", attachment_metadata_hash=""
+    )
+    # Preserved and rejected during the latest attempt
+    museum_object = museum_object_factory(id=30, preserved=True)
+    museum_object.latest_package = museum_package_factory(
+        sip_filename="test.tar", museum_object=museum_object, rejected=True
+    )
+    session.commit()
+
+    # Counters that were updated before reconciling are overwritten
+    update_stats({ObjectStat.FROZEN: 5})
+
+    reconcile_stats()
+
+    stats = get_stats()
+    assert stats[ObjectStat.PENDING] == 1
+    assert stats[ObjectStat.FROZEN] == 1
+    assert stats[ObjectStat.PRESERVED] == 1
+    assert stats[ObjectStat.REJECTED] == 1
+
+    assert get_heartbeats()[HeartbeatSource.RECONCILE_STATS]
+
+    # Counters are adjusted until the next reconciliation
+    update_stats({ObjectStat.FROZEN: 2, ObjectStat.REJECTED: -1})
+
+    stats = get_stats()
+    assert stats[ObjectStat.FROZEN] == 3
+    assert stats[ObjectStat.REJECTED] == 0
+
+
+def test_stats_queues(redis):
+    """
+    Test that the in-workflow and failed counts are retrieved from the
+    job queues
+    """
+    queue = get_queue(QueueType.DOWNLOAD_OBJECT)
+
+    queue.enqueue(failing_job, job_id="download_object_10")
+    SimpleWorker([queue], connection=queue.connection).work(burst=True)
+
+    queue.enqueue(failing_job, job_id="download_object_20")
+    get_queue(QueueType.CREATE_SIP).enqueue(
+        failing_job, job_id="create_sip_30"
+    )
+
+    stats = get_stats()
+    assert stats[ObjectStat.IN_WORKFLOW] == 2
+    assert stats[ObjectStat.FAILED] == 1